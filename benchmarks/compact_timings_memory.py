@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.sample_cap_tradeoff import (  # noqa: E402
+    CAPPED_VERIFIERS,
+    top_k_accuracies,
+)
+from classifiers.verifier_registry import get_verifier, score_matrices  # noqa: E402
+
+UNITS = [None, "us", "ms"]
+
+
+def template_memory(units, platforms=(1, 3), probe_platform=2):
+    """
+    Extract the KHT and KIT templates of every user with float64 and with compact timings, and
+    score long-lived enrollments (every session of a platform range) against the probes of
+    another platform with each.
+
+    Returns:
+    - list[dict]: Per unit, the bytes of the press and release columns, the bytes the templates
+      take and per timing sample, and per verifier the mean absolute score difference from the
+      float64 timings and the top-1..5 accuracies.
+    """
+    from classifiers.session_templates import SessionTemplateCache
+    from classifiers.template_generator import all_ids, read_compact_format
+    from features.compact_timings import to_session_offsets
+
+    with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
+        config = dict(json.load(f), compact_timing_unit=None)
+    ids = all_ids()
+    families = ["kht", "kit1", "kit2", "kit3", "kit4"]
+    verifiers = [get_verifier(verifier_type) for verifier_type in CAPPED_VERIFIERS]
+    exact = None
+    rows = []
+    for unit in units:
+        df = read_compact_format()
+        if unit:
+            df = to_session_offsets(df, unit)
+        cache = SessionTemplateCache(df, cache_size=len(ids))
+        tracemalloc.start()
+        templates = {
+            user_id: cache.template(user_id, [1, 3], None, families) for user_id in ids
+        }
+        template_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        samples = sum(
+            len(timings)
+            for template in templates.values()
+            for timings in template.values()
+        )
+        unit_config = dict(config, compact_timing_unit=unit)
+        matrices = score_matrices(
+            verifiers,
+            [
+                cache.template(user_id, list(platforms), None, families)
+                for user_id in ids
+            ],
+            [
+                cache.template(user_id, probe_platform, None, families)
+                for user_id in ids
+            ],
+            unit_config,
+        )
+        if exact is None:
+            exact = matrices
+        for index, verifier_type in enumerate(CAPPED_VERIFIERS):
+            rows.append(
+                {
+                    "unit": unit or "ns",
+                    "column_bytes": int(
+                        df["press_time"].nbytes + df["release_time"].nbytes
+                    ),
+                    "template_bytes": template_bytes,
+                    "bytes_per_sample": template_bytes / max(samples, 1),
+                    "verifier": verifier_type.name.lower(),
+                    "mean_difference": float(
+                        np.abs(exact[index] - matrices[index]).mean()
+                    ),
+                    "top_k": top_k_accuracies(matrices[index]),
+                }
+            )
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the memory and accuracy of float64 and compact int32 timings"
+    )
+    parser.add_argument("--units", nargs="+", default=["us", "ms"])
+    args = parser.parse_args()
+    print(
+        f"{'unit':<6}{'columns MB':>11}{'templates MB':>13}{'B/sample':>9}  "
+        f"{'verifier':<18}{'mean diff':>10}"
+        + "".join(f"{f'top{k}':>7}" for k in range(1, 6))
+    )
+    for row in template_memory([None] + args.units):
+        print(
+            f"{row['unit']:<6}{row['column_bytes'] / 1e6:>11.2f}"
+            f"{row['template_bytes'] / 1e6:>13.2f}{row['bytes_per_sample']:>9.1f}  "
+            f"{row['verifier']:<18}{row['mean_difference']:>10.4f}"
+            + "".join(f"{accuracy:>7.3f}" for accuracy in row["top_k"])
+        )
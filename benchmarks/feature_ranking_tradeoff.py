@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.sample_cap_tradeoff import (
+    CAPPED_VERIFIERS,
+    top_k_accuracies,
+)  # noqa: E402
+from classifiers.verifier_registry import get_verifier, score_matrices  # noqa: E402
+
+
+def tradeoff(tops, ranking_path, platform=1, probe_platform=2, kit_feature_type=1):
+    """
+    Score the enrollments of a platform against the probes of another platform with the
+    verifiers restricted to the top ranked features of a ranking.
+
+    Returns:
+    - list[dict]: Per number of top features and verifier, the number of features, the
+      template preparation and scoring time and the top-1..5 accuracies.
+    """
+    from classifiers.session_templates import session_templates
+    from classifiers.template_generator import all_ids
+    from classifiers.template_store import family_for_kit
+
+    with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
+        config = json.load(f)
+    ids = all_ids()
+    families = ["kht", family_for_kit(kit_feature_type)]
+    sessions = session_templates()
+    enrollments = [sessions.template(i, platform, None, families) for i in ids]
+    probes = [sessions.template(i, probe_platform, None, families) for i in ids]
+    verifiers = [get_verifier(verifier_type) for verifier_type in CAPPED_VERIFIERS]
+    rows = []
+    for top in [None] + [top for top in tops if top is not None]:
+        start = time.perf_counter()
+        matrices = score_matrices(
+            verifiers,
+            enrollments,
+            probes,
+            dict(config, feature_ranking_path=ranking_path, top_features=top),
+        )
+        seconds = time.perf_counter() - start
+        for index, verifier_type in enumerate(CAPPED_VERIFIERS):
+            rows.append(
+                {
+                    "top": top,
+                    "verifier": verifier_type.name.lower(),
+                    "seconds": seconds,
+                    "top_k": top_k_accuracies(matrices[index]),
+                }
+            )
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the accuracy and speed of scoring only the top ranked features"
+    )
+    parser.add_argument(
+        "ranking", help="A ranking written by python -m classifiers.feature_ranking"
+    )
+    parser.add_argument("--tops", type=int, nargs="+", default=[200, 100, 50, 25])
+    parser.add_argument("--platform", type=int, default=1)
+    parser.add_argument("--probe-platform", type=int, default=2)
+    args = parser.parse_args()
+    print(
+        f"{'top':>5}  {'verifier':<18}{'seconds':>8}"
+        + "".join(f"{f'top{k}':>7}" for k in range(1, 6))
+    )
+    for row in tradeoff(args.tops, args.ranking, args.platform, args.probe_platform):
+        print(
+            f"{row['top'] if row['top'] else '-':>5}  {row['verifier']:<18}"
+            f"{row['seconds']:>8.2f}"
+            + "".join(f"{accuracy:>7.3f}" for accuracy in row["top_k"])
+        )
@@ -0,0 +1,80 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The import time budget, in milliseconds, of every module on the verification path. Scoring,
+# feature extraction and fusion only need numpy; the heatmap builders and the service also load
+# the compact format with pandas.
+BUDGETS_MS = {
+    "classifiers.verifier_registry": 300,
+    "classifiers.template_snapshot": 300,
+    "fusion.decsion_fusion": 300,
+    "fusion.score_fusion": 300,
+    "features.keystroke_features": 300,
+    "performance_evaluation.heatmap": 1000,
+    "service.verification_service": 1000,
+}
+
+# Dependencies that must only be imported once they are used (plotting, word parsing, progress bars)
+HEAVY_MODULES = ("matplotlib", "seaborn", "spacy", "sklearn", "scipy", "rich")
+
+
+def measure(module):
+    """
+    Import a module in a fresh interpreter with `python -X importtime`.
+
+    Returns:
+    - tuple[float, list[str]]: The cumulative import time of the module in milliseconds, and the
+      heavy modules it pulled in.
+    """
+    code = (
+        f"import sys, json; import {module}; "
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [REPOSITORY, environment.get("PYTHONPATH")])
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=REPOSITORY,
+        env=environment,
+        check=True,
+    )
+    cumulative_us = None
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            cumulative_us = int(fields[1])
+    return cumulative_us / 1000, json.loads(result.stdout.splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the import time of the verification path against its budget"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Keep the best of this many imports"
+    )
+    parser.add_argument("modules", nargs="*", default=list(BUDGETS_MS))
+    args = parser.parse_args()
+    failed = False
+    print(f"{'module':<36}{'import ms':>10}{'budget ms':>10}  heavy imports")
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.repeat)]
+        milliseconds = min(run[0] for run in runs)
+        heavy = runs[0][1]
+        budget = BUDGETS_MS.get(module)
+        over = budget is not None and milliseconds > budget
+        failed |= over or bool(heavy)
+        print(
+            f"{module:<36}{milliseconds:>10.1f}{budget if budget else '-':>10}  "
+            f"{', '.join(heavy) or '-'}{'  OVER BUDGET' if over else ''}"
+        )
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classifiers.quantile_sketch import KLLSketch  # noqa: E402
+from classifiers.verifier_registry import (  # noqa: E402
+    VerifierType,
+    get_verifier,
+    score_matrices,
+)
+
+SKETCHED_VERIFIERS = [
+    VerifierType.ABSOLUTE,
+    VerifierType.SIMILARITY,
+    VerifierType.ITAD,
+    VerifierType.RELATIVE,
+]
+
+
+def sketch_errors(sizes, ks, chunks=20, seeds=5):
+    """
+    Compare sketched medians and ECDFs of lognormal timings with the exact ones.
+
+    Returns:
+    - list[dict]: Per (n, k), the worst normalized rank error of the median and of the ECDF at
+      99 percentiles over `seeds` sketches (each built from `chunks` merged updates), the
+      number of retained timings, and the sketch and exact summary times.
+    """
+    rows = []
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        timings = rng.lognormal(18, 0.4, n)
+        start = time.perf_counter()
+        exact_sorted = np.sort(timings)
+        np.median(timings)
+        exact_seconds = time.perf_counter() - start
+        grid = np.quantile(timings, np.linspace(0.01, 0.99, 99))
+        true_cdf = np.searchsorted(exact_sorted, grid, side="right") / n
+        for k in ks:
+            median_error = cdf_error = retained = sketch_seconds = 0
+            for seed in range(seeds):
+                start = time.perf_counter()
+                sketch = KLLSketch(k, seed)
+                for chunk in np.array_split(timings, chunks):
+                    sketch.merge(KLLSketch(k, seed).update(chunk))
+                median = sketch.quantile(0.5)
+                sketch_seconds = max(sketch_seconds, time.perf_counter() - start)
+                median_rank = np.searchsorted(exact_sorted, median, side="right") / n
+                median_error = max(median_error, abs(median_rank - 0.5))
+                cdf_error = max(cdf_error, np.abs(sketch.cdf(grid) - true_cdf).max())
+                retained = max(retained, len(sketch))
+            rows.append(
+                {
+                    "n": n,
+                    "k": k,
+                    "bound": 3.3 / k,
+                    "median_rank_error": float(median_error),
+                    "cdf_error": float(cdf_error),
+                    "retained": retained,
+                    "sketch_ms": 1000 * sketch_seconds,
+                    "exact_ms": 1000 * exact_seconds,
+                }
+            )
+    return rows
+
+
+def verifier_errors(ks, platforms=(1, 3), kit_feature_type=1):
+    """
+    Score long-lived enrollments (all sessions of a platform range) against per-platform probes
+    with exact and sketched enrollment templates.
+
+    Returns:
+    - list[dict]: Per k and verifier, the mean and largest absolute score difference and the
+      top-1 identification accuracy with exact and with sketched enrollments.
+    """
+    from classifiers.session_templates import session_templates
+    from classifiers.template_generator import all_ids
+    from classifiers.template_store import family_for_kit
+
+    with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
+        config = json.load(f)
+    ids = all_ids()
+    families = ["kht", family_for_kit(kit_feature_type)]
+
+    def template(user_id, platform_id):
+        return session_templates().template(user_id, platform_id, None, families)
+
+    enrollments = [template(user_id, list(platforms)) for user_id in ids]
+    probes = [template(user_id, platforms[0]) for user_id in ids]
+    verifiers = [get_verifier(verifier_type) for verifier_type in SKETCHED_VERIFIERS]
+    exact = score_matrices(
+        verifiers, enrollments, probes, dict(config, quantile_sketch_k=None)
+    )
+    rows = []
+    for k in ks:
+        sketched = score_matrices(
+            verifiers, enrollments, probes, dict(config, quantile_sketch_k=k)
+        )
+        for index, verifier_type in enumerate(SKETCHED_VERIFIERS):
+            difference = np.abs(exact[index] - sketched[index])
+            rows.append(
+                {
+                    "k": k,
+                    "verifier": verifier_type.name.lower(),
+                    "mean_difference": float(difference.mean()),
+                    "max_difference": float(difference.max()),
+                    "exact_top1": _top1(exact[index]),
+                    "sketched_top1": _top1(sketched[index]),
+                }
+            )
+    return rows
+
+
+def _top1(matrix):
+    """The share of probes (columns) whose best scoring enrollment is their own user"""
+    return float(np.mean(np.argmax(matrix, axis=0) == np.arange(matrix.shape[1])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the accuracy of quantile sketched templates against exact ones"
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--ks", type=int, nargs="+", default=[50, 100, 200, 400])
+    parser.add_argument(
+        "--verifier-ks",
+        type=int,
+        nargs="+",
+        default=[8, 16, 32, 64],
+        help="Sketch sizes for the verifier comparison, small since dataset features are short",
+    )
+    parser.add_argument(
+        "--skip-dataset", action="store_true", help="Only measure synthetic timings"
+    )
+    args = parser.parse_args()
+    failed = False
+    print(
+        f"{'n':>9}{'k':>5}{'bound':>8}{'median err':>12}{'cdf err':>9}"
+        f"{'retained':>10}{'sketch ms':>11}{'exact ms':>10}"
+    )
+    for row in sketch_errors(args.sizes, args.ks):
+        over = max(row["median_rank_error"], row["cdf_error"]) > row["bound"]
+        failed |= over
+        print(
+            f"{row['n']:>9}{row['k']:>5}{row['bound']:>8.4f}{row['median_rank_error']:>12.4f}"
+            f"{row['cdf_error']:>9.4f}{row['retained']:>10}{row['sketch_ms']:>11.1f}"
+            f"{row['exact_ms']:>10.1f}{'  OVER BOUND' if over else ''}"
+        )
+    if not args.skip_dataset:
+        print()
+        print(
+            f"{'k':>5}  {'verifier':<12}{'mean diff':>10}{'max diff':>10}"
+            f"{'exact top1':>12}{'sketched top1':>15}"
+        )
+        for row in verifier_errors(args.verifier_ks):
+            print(
+                f"{row['k']:>5}  {row['verifier']:<12}{row['mean_difference']:>10.4f}"
+                f"{row['max_difference']:>10.4f}{row['exact_top1']:>12.3f}"
+                f"{row['sketched_top1']:>15.3f}"
+            )
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classifiers.verifier_registry import (  # noqa: E402
+    VerifierType,
+    get_verifier,
+    score_matrices,
+)
+
+CAPPED_VERIFIERS = [
+    VerifierType.ABSOLUTE,
+    VerifierType.SIMILARITY,
+    VerifierType.ITAD,
+    VerifierType.SCALED_MANHATTAN,
+]
+
+
+def top_k_accuracies(matrix, max_k=5):
+    """
+    Parameters:
+    - matrix (np.ndarray): Enrollment x probe scores of the same users in the same order.
+    - max_k (int): The largest k.
+
+    Returns:
+    - list[float]: The share of probes (columns) whose own user is among the k best scoring
+      enrollments, for k = 1..max_k, as with `top_k_accuracy_score` in the experiments.
+    """
+    own = matrix[np.arange(matrix.shape[1]), np.arange(matrix.shape[1])]
+    # The rank of the own enrollment among all enrollments of a probe, 0 being the best
+    ranks = (matrix > own[np.newaxis, :]).sum(axis=0)
+    return [float(np.mean(ranks < k)) for k in range(1, max_k + 1)]
+
+
+def tradeoff(caps, strategies, platforms=(1, 3), probe_platform=2, kit_feature_type=1):
+    """
+    Score long-lived enrollments (every session of a platform range) against the probes of
+    another platform with templates capped to a number of timings per feature.
+
+    Returns:
+    - list[dict]: Per cap, strategy and verifier, the template building and scoring time, the
+      mean absolute score difference from uncapped templates and the top-1..5 accuracies.
+    """
+    from classifiers.session_templates import session_templates
+    from classifiers.template_generator import all_ids
+    from classifiers.template_store import family_for_kit
+
+    with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
+        config = json.load(f)
+    ids = all_ids()
+    families = ["kht", family_for_kit(kit_feature_type)]
+
+    def template(user_id, platform_id):
+        return session_templates().template(user_id, platform_id, None, families)
+
+    enrollments = [template(user_id, list(platforms)) for user_id in ids]
+    probes = [template(user_id, probe_platform) for user_id in ids]
+    verifiers = [get_verifier(verifier_type) for verifier_type in CAPPED_VERIFIERS]
+    exact = None
+    rows = []
+    for cap in [None] + [cap for cap in caps if cap is not None]:
+        for strategy in strategies if cap is not None else strategies[:1]:
+            start = time.perf_counter()
+            matrices = score_matrices(
+                verifiers,
+                enrollments,
+                probes,
+                dict(config, max_samples_per_feature=cap, sample_cap_strategy=strategy),
+            )
+            seconds = time.perf_counter() - start
+            if exact is None:
+                exact = matrices
+            for index, verifier_type in enumerate(CAPPED_VERIFIERS):
+                rows.append(
+                    {
+                        "cap": cap,
+                        "strategy": strategy if cap is not None else "-",
+                        "verifier": verifier_type.name.lower(),
+                        "seconds": seconds,
+                        "mean_difference": float(
+                            np.abs(exact[index] - matrices[index]).mean()
+                        ),
+                        "top_k": top_k_accuracies(matrices[index]),
+                    }
+                )
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the accuracy and speed of sample capped templates"
+    )
+    parser.add_argument("--caps", type=int, nargs="+", default=[100, 50, 20, 10, 5])
+    parser.add_argument("--strategies", nargs="+", default=["reservoir", "recent"])
+    args = parser.parse_args()
+    print(
+        f"{'cap':>5}  {'strategy':<10}{'verifier':<18}{'seconds':>8}{'mean diff':>10}"
+        + "".join(f"{f'top{k}':>7}" for k in range(1, 6))
+    )
+    for row in tradeoff(args.caps, args.strategies):
+        print(
+            f"{row['cap'] if row['cap'] else '-':>5}  {row['strategy']:<10}"
+            f"{row['verifier']:<18}{row['seconds']:>8.2f}{row['mean_difference']:>10.4f}"
+            + "".join(f"{accuracy:>7.3f}" for accuracy in row["top_k"])
+        )
@@ -1,171 +1,286 @@
 import os
 import json
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 import numpy as np
-from sklearn.ensemble import IsolationForest
-from sklearn.neighbors import LocalOutlierFactor
+from features.compact_timings import timing_scale
+from performance_evaluation.instrumentation import instrumentation
+
+# The outlier detectors "outlier_detector" can select
+OUTLIER_DETECTORS = ("dbod", "lof", "isolation_forest")
+
+# The LOF and Isolation Forest inlier masks of the most recently filtered timings
+_INLIER_MASK_CACHE_SIZE = 65536
+_inlier_mask_cache = OrderedDict()
 
 
 class DistanceBasedKeystrokeFeatureOutlierDetector:
-    def __init__(self, common_features, enrollment_pattern, probe_pattern) -> None:
+    def __init__(
+        self, common_features, enrollment_pattern, probe_pattern, config=None
+    ) -> None:
         # Since our data was in nanoseconds, I changed the r from 100 to 1000000000 to define a bigger range
         # FIXME: we will probably need to adjust the self.r, 100 is definitely too small but 1e9 maybe too big we will have to see what performs the best
         #        100000000 seems to improve performance slightly
-        with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
-            config = json.load(f)
-        self.r = int(config["dbod_r"])
+        if config is None:
+            with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
+                config = json.load(f)
+        # dbod_r is in nanoseconds, like the dataset, and scaled to compact timings
+        self.r = int(config["dbod_r"] / timing_scale(config))
         self.beta = float(config["dbod_beta"])
+        # DBOD unless "outlier_detector" selects LOF or Isolation Forest
+        self.method = config.get("outlier_detector", "dbod")
+        if self.method not in OUTLIER_DETECTORS:
+            raise ValueError(
+                f"Unknown outlier detector {self.method}, expected one of {OUTLIER_DETECTORS}"
+            )
+        self.contamination = float(config.get("outlier_contamination", 0.1))
+        self.n_neighbors = int(config.get("lof_n_neighbors", 20))
         self.common_features = common_features
         self.enrollment_pattern = enrollment_pattern
         self.probe_pattern = probe_pattern
 
     def find_inliers(self):
-        inlier_enrollment_features = defaultdict(list)
-        inlier_probe_features = defaultdict(list)
-        for feature in self.common_features:
-            timings = self.enrollment_pattern[feature]
-            # print("Timings:", list(timings))
-            if len(timings) == 1:
-                inlier_enrollment_features[feature].append(timings[0])
-                continue
-            elif len(timings) == 2:
-                inlier_enrollment_features[feature].append(timings[0])
-                inlier_enrollment_features[feature].append(timings[1])
-                continue
-            elif len(timings) == 3:
-                inlier_enrollment_features[feature].append(timings[0])
-                inlier_enrollment_features[feature].append(timings[1])
-                inlier_enrollment_features[feature].append(timings[2])
-                continue
-
-            # TODO: Maybe another thing that might reduce some of the empty lists is to just force include all timings where len(timings) = 2 as well? It really depends on how frequent it is
-            for timing in timings:
-                # Establish the neighborhood for the current timing, so that all other timings can compare against the neighborhood
-                # Trying a wider range for the neighborhood by making the lower bound negative
-                lower_neighborhood_bound = -(timing - self.r)
-                upper_neighborhood_bound = timing + self.r
-                # Filter the current timing (make a copy of the list to make sure it doesn't get mutated in-place)
-                timings_to_compare_against = []
-                for timing_candidate in timings:
-                    if timing != timing_candidate:
-                        timings_to_compare_against.append(timing_candidate)
-                # Count how many of the remaining timings except the current fall in the neighborhood
-                count = len(
-                    list(
-                        filter(
-                            lambda x: lower_neighborhood_bound
-                            <= x
-                            <= upper_neighborhood_bound,
-                            timings_to_compare_against,
-                        )
-                    )
-                )
-                # print("lower_neighborhood_bound", lower_neighborhood_bound)
-                # print("upper_neighborhood_bound", upper_neighborhood_bound)
-                # input()
-                # print("Timings to compare:", list(timings_to_compare_against))
-                # input()
-                # print("neighborhood count:", count)
-                # input()
-                # See if counts/number of timings - 1 (because we removed 1 timing value) >= the beta param
-                if (count / (len(timings) - 1)) >= self.beta:
-                    inlier_enrollment_features[feature].append(timing)
-
-        for feature in self.common_features:
-            timings = self.probe_pattern[feature]
-            if len(timings) == 1:
-                inlier_probe_features[feature].append(timings[0])
-                continue
-            elif len(timings) == 2:
-                inlier_probe_features[feature].append(timings[0])
-                inlier_probe_features[feature].append(timings[1])
-                continue
-            elif len(timings) == 3:
-                inlier_probe_features[feature].append(timings[0])
-                inlier_probe_features[feature].append(timings[1])
-                inlier_probe_features[feature].append(timings[2])
-                continue
-
-            for timing in timings:
-                # Establish the neighborhood for the current timing, so that all other timings can compare against the neighborhood
-                lower_neighborhood_bound = timing - self.r
-                upper_neighborhood_bound = timing + self.r
-                # Filter the current timing (make a copy of the list to make sure it doesn't get mutated in-place)
-                timings_to_compare_against = filter(lambda x: x != timing, timings)
-                # Count how many of the remaining timings except the current fall in the neighborhood
-                count = len(
-                    list(
-                        filter(
-                            lambda x: lower_neighborhood_bound
-                            <= x
-                            <= upper_neighborhood_bound,
-                            timings_to_compare_against,
-                        )
-                    )
-                )
-                # See if counts/number of timings - 1 (because we removed 1 timing value) >= the beta param
-                if (count / (len(timings) - 1)) >= self.beta:
-                    inlier_probe_features[feature].append(timing)
+        inlier_enrollment_features = self.find_pattern_inliers(
+            self.enrollment_pattern, is_enrollment=True
+        )
+        inlier_probe_features = self.find_pattern_inliers(
+            self.probe_pattern, is_enrollment=False
+        )
         return (inlier_enrollment_features, inlier_probe_features)
 
-    def find_inliers_with_lof(self, contamination=0.1, n_neighbors=20):
-        """Detect inliers using Local Outlier Factor (LOF)."""
-        inlier_enrollment_features = defaultdict(list)
-        inlier_probe_features = defaultdict(list)
-        for feature in self.common_features:
-            timings = self.enrollment_pattern[feature]
-            if len(timings) > 1:
-                timings = np.array(timings).reshape(-1, 1)
-                lof = LocalOutlierFactor(
-                    n_neighbors=n_neighbors, contamination=contamination
-                )
-                inlier_mask = lof.fit_predict(timings) == 1
-                inlier_enrollment_features[feature] = (
-                    timings[inlier_mask].flatten().tolist()
-                )
+    def find_pattern_inliers(self, pattern, is_enrollment, features=None):
+        """
+        Find the inliers of every feature of a single pattern.
+
+        The inliers of a feature only depend on the timings of that feature in this pattern, so the
+        result can be computed once per template and reused for every pair it takes part in. The
+        configured "outlier_detector" decides them: DBOD, LOF or Isolation Forest.
+
+        Parameters:
+        - pattern (dict): A template mapping features to lists of timings.
+        - is_enrollment (bool): Whether the pattern is the enrollment, which uses a wider neighborhood.
+        - features (iterable, optional): The features to filter, defaults to the common features.
+
+        Returns:
+        - dict: A defaultdict(list) with the inlier timings of every feature that has at least one.
+        """
+        inlier_features = defaultdict(list)
+        if features is None:
+            features = self.common_features
+        for feature in features:
+            timings = pattern[feature]
+            if self.method != "dbod":
+                mask = self._model_inlier_mask(timings)
+                inliers = [timing for timing, keep in zip(timings, mask) if keep]
+            elif len(timings) <= 3:
+                # Too few timings to tell outliers apart, so all of them are kept
+                inliers = list(timings)
             else:
-                inlier_enrollment_features[feature] = timings
-        for feature in self.common_features:
-            timings = self.probe_pattern[feature]
-            if len(timings) > 1:
-                timings = np.array(timings).reshape(-1, 1)
-                lof = LocalOutlierFactor(
-                    n_neighbors=n_neighbors, contamination=contamination
-                )
-                inlier_mask = lof.fit_predict(timings) == 1
-                inlier_probe_features[feature] = timings[inlier_mask].flatten().tolist()
+                inliers = self._inlier_timings(timings, is_enrollment)
+            if inliers:
+                inlier_features[feature].extend(inliers)
+        return inlier_features
+
+    def _inlier_timings(self, timings, is_enrollment):
+        inliers = []
+        # TODO: Maybe another thing that might reduce some of the empty lists is to just force include all timings where len(timings) = 2 as well? It really depends on how frequent it is
+        for timing in timings:
+            # Establish the neighborhood for the current timing, so that all other timings can compare against the neighborhood
+            if is_enrollment:
+                # Trying a wider range for the neighborhood by making the lower bound negative
+                lower_neighborhood_bound = -(timing - self.r)
             else:
-                inlier_probe_features[feature] = timings
+                lower_neighborhood_bound = timing - self.r
+            upper_neighborhood_bound = timing + self.r
+            # Filter the current timing (make a copy of the list to make sure it doesn't get mutated in-place)
+            timings_to_compare_against = [
+                timing_candidate
+                for timing_candidate in timings
+                if timing != timing_candidate
+            ]
+            # Count how many of the remaining timings except the current fall in the neighborhood
+            count = len(
+                [
+                    x
+                    for x in timings_to_compare_against
+                    if lower_neighborhood_bound <= x <= upper_neighborhood_bound
+                ]
+            )
+            # See if counts/number of timings - 1 (because we removed 1 timing value) >= the beta param
+            if (count / (len(timings) - 1)) >= self.beta:
+                inliers.append(timing)
+        return inliers
 
-        return (inlier_enrollment_features, inlier_probe_features)
+    def inlier_mask(self, timings, is_enrollment, reference=None):
+        """
+        Decide on every timing like `_inlier_timings`, vectorized with sorted counting.
+
+        The neighborhood density of each timing is measured against `reference` instead of the
+        timings themselves when given, e.g. a sample of a feature's timings, which decides on all
+        of them in O(n log m) for a sample of m timings instead of O(n^2).
+
+        Parameters:
+        - timings (array-like[float]): The timings of one feature.
+        - is_enrollment (bool): Whether the timings are the enrollment's, which uses a wider neighborhood.
+        - reference (array-like[float], optional): The timings to count neighbors among.
+          LOF and Isolation Forest ignore it and always decide on all of the timings.
+
+        Returns:
+        - np.ndarray[bool]: Whether each timing is an inlier.
+        """
+        if self.method != "dbod":
+            return self._model_inlier_mask(timings)
+        timings = np.asarray(timings, dtype=np.float64)
+        reference = np.sort(
+            timings if reference is None else np.asarray(reference, dtype=np.float64)
+        )
+        if len(reference) <= 3:
+            # Too few timings to tell outliers apart, so all of them are kept
+            return np.ones(len(timings), dtype=bool)
+        if is_enrollment:
+            lower = -(timings - self.r)
+        else:
+            lower = timings - self.r
+        upper = timings + self.r
+        count = np.searchsorted(reference, upper, side="right") - np.searchsorted(
+            reference, lower, side="left"
+        )
+        # Timings equal to the current one are not its neighbors
+        count -= np.where(
+            (lower <= timings) & (timings <= upper),
+            np.searchsorted(reference, timings, side="right")
+            - np.searchsorted(reference, timings, side="left"),
+            0,
+        )
+        return np.maximum(count, 0) / (len(reference) - 1) >= self.beta
+
+    def _model_inlier_mask(self, timings):
+        """The inliers by the configured LOF or Isolation Forest, see `model_inlier_mask`"""
+        return model_inlier_mask(
+            self.method, timings, self.contamination, self.n_neighbors
+        )
+
+    def _find_model_inliers(self, method, contamination, n_neighbors):
+        patterns = []
+        for pattern in (self.enrollment_pattern, self.probe_pattern):
+            inlier_features = defaultdict(list)
+            for feature in self.common_features:
+                timings = pattern[feature]
+                mask = model_inlier_mask(method, timings, contamination, n_neighbors)
+                inlier_features[feature] = [
+                    timing for timing, keep in zip(timings, mask) if keep
+                ]
+            patterns.append(inlier_features)
+        return tuple(patterns)
+
+    def find_inliers_with_lof(self, contamination=0.1, n_neighbors=20):
+        """
+        Detect inliers using Local Outlier Factor (LOF). The masks of every template are cached,
+        so a template is only scored once however many pairs it takes part in.
+        """
+        return self._find_model_inliers("lof", contamination, n_neighbors)
 
     def find_inliers_with_isolation_forest(self, contamination=0.1):
-        """Detect inliers using Isolation Forest."""
-        inlier_enrollment_features = defaultdict(list)
-        inlier_probe_features = defaultdict(list)
-        for feature in self.common_features:
-            timings = self.enrollment_pattern[feature]
-            if len(timings) > 1:
-                timings = np.array(timings).reshape(-1, 1)
-                iso_forest = IsolationForest(
-                    contamination=contamination, random_state=42
-                )
-                inlier_mask = iso_forest.fit_predict(timings) == 1
-                inlier_enrollment_features[feature] = (
-                    timings[inlier_mask].flatten().tolist()
-                )
-            else:
-                inlier_enrollment_features[feature] = timings
-        for feature in self.common_features:
-            timings = self.probe_pattern[feature]
-            if len(timings) > 1:
-                timings = np.array(timings).reshape(-1, 1)
-                iso_forest = IsolationForest(
-                    contamination=contamination, random_state=42
-                )
-                inlier_mask = iso_forest.fit_predict(timings) == 1
-                inlier_probe_features[feature] = timings[inlier_mask].flatten().tolist()
-            else:
-                inlier_probe_features[feature] = timings
+        """
+        Detect inliers using Isolation Forest. The masks of every template are cached, so the
+        forests of a template are only fit once however many pairs it takes part in.
+        """
+        return self._find_model_inliers("isolation_forest", contamination, None)
 
-        return (inlier_enrollment_features, inlier_probe_features)
+
+def lof_inlier_mask(timings, contamination=0.1, n_neighbors=20):
+    """
+    The inliers of one feature's timings by Local Outlier Factor, like
+    `LocalOutlierFactor(n_neighbors, contamination=contamination).fit_predict(...) == 1`.
+
+    In one dimension the k nearest neighbors of a timing are among the k timings on either side
+    of it in sorted order, so they are found for all timings at once with one sort and a
+    partition over the 2k candidates, instead of fitting a scikit-learn model. Neighbors at
+    tied distances may be picked differently, which only matters for exactly repeated timings.
+
+    Parameters:
+    - timings (array-like[float]): The timings of one feature.
+    - contamination (float): The share of timings considered outliers.
+    - n_neighbors (int): The number of neighbors, at most the number of other timings.
+
+    Returns:
+    - np.ndarray[bool]: Whether each timing is an inlier.
+    """
+    timings = np.asarray(timings, dtype=np.float64)
+    n = len(timings)
+    if n <= 1:
+        return np.ones(n, dtype=bool)
+    k = max(1, min(n_neighbors, n - 1))
+    order = np.argsort(timings, kind="stable")
+    values = timings[order]
+    offsets = np.concatenate([np.arange(-k, 0), np.arange(1, k + 1)])
+    candidates = np.arange(n)[:, np.newaxis] + offsets
+    valid = (candidates >= 0) & (candidates < n)
+    candidates = np.clip(candidates, 0, n - 1)
+    distances = np.where(
+        valid, np.abs(values[candidates] - values[:, np.newaxis]), np.inf
+    )
+    nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    neighbors = np.take_along_axis(candidates, nearest, axis=1)
+    neighbor_distances = np.take_along_axis(distances, nearest, axis=1)
+    k_distance = neighbor_distances.max(axis=1)
+    reach_distances = np.maximum(neighbor_distances, k_distance[neighbors])
+    density = 1.0 / (reach_distances.mean(axis=1) + 1e-10)
+    lof = (density[neighbors] / density[:, np.newaxis]).mean(axis=1)
+    inliers = np.empty(n, dtype=bool)
+    inliers[order] = -lof >= np.percentile(-lof, 100.0 * contamination)
+    return inliers
+
+
+def isolation_forest_inlier_mask(timings, contamination=0.1):
+    """
+    The inliers of one feature's timings by an Isolation Forest (seeded, so reproducible).
+
+    Returns:
+    - np.ndarray[bool]: Whether each timing is an inlier.
+    """
+    from sklearn.ensemble import IsolationForest
+
+    timings = np.asarray(timings, dtype=np.float64)
+    if len(timings) <= 1:
+        return np.ones(len(timings), dtype=bool)
+    iso_forest = IsolationForest(contamination=contamination, random_state=42)
+    return iso_forest.fit_predict(timings.reshape(-1, 1)) == 1
+
+
+def model_inlier_mask(method, timings, contamination=0.1, n_neighbors=20):
+    """
+    The LOF or Isolation Forest inliers of one feature's timings, cached by their values so
+    that a template's masks are computed once however many pairs it is scored in.
+
+    Parameters:
+    - method (str): "lof" or "isolation_forest".
+    - timings (array-like[float]): The timings of one feature.
+    - contamination (float): The share of timings considered outliers.
+    - n_neighbors (int): The number of LOF neighbors.
+
+    Returns:
+    - np.ndarray[bool]: Whether each timing is an inlier. It is cached and must not be modified.
+    """
+    timings = np.asarray(timings, dtype=np.float64)
+    key = (
+        method,
+        contamination,
+        n_neighbors if method == "lof" else None,
+        timings.tobytes(),
+    )
+    mask = _inlier_mask_cache.get(key)
+    if mask is not None:
+        instrumentation.cache_hit("inlier_masks")
+        _inlier_mask_cache.move_to_end(key)
+        return mask
+    instrumentation.cache_miss("inlier_masks")
+    if method == "lof":
+        mask = lof_inlier_mask(timings, contamination, n_neighbors)
+    elif method == "isolation_forest":
+        mask = isolation_forest_inlier_mask(timings, contamination)
+    else:
+        raise ValueError(f"Unknown outlier detector {method}")
+    _inlier_mask_cache[key] = mask
+    if len(_inlier_mask_cache) > _INLIER_MASK_CACHE_SIZE:
+        _inlier_mask_cache.popitem(last=False)
+    return mask
@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import numpy as np
+
+RANKING_VERSION = 1
+
+# The ranking currently loaded from "feature_ranking_path", keyed by its path and modification
+_ranking_cache = {}
+
+
+class FeatureRanking:
+    """
+    Features ranked by their Fisher score: the ratio of the variance of the per-user mean timings
+    (between users) to the variance of the timings around each user's own mean (within users).
+    Features whose timings tell users apart best come first.
+
+    Usage:
+    >>> ranking = FeatureRanking.from_templates(enrollment_templates, ids)
+    >>> ranking.save("feature_ranking.json")
+    >>> selected = FeatureRanking.load("feature_ranking.json").top(100)
+    """
+
+    def __init__(self, features, scores, users=None, samples=None):
+        self.features = list(features)
+        self.scores = np.asarray(scores, dtype=np.float64)
+        # The number of users and timings every score was computed from
+        self.users = None if users is None else np.asarray(users, dtype=np.int64)
+        self.samples = None if samples is None else np.asarray(samples, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.features)
+
+    @classmethod
+    def from_templates(cls, templates, ids):
+        """
+        Compute the Fisher score of every feature over enrollment templates in one vectorized
+        pass over all of their timings.
+
+        Parameters:
+        - templates (list[dict]): Templates mapping features to timings.
+        - ids (list[int]): The user of every template; templates of the same user are pooled.
+
+        Returns:
+        - FeatureRanking: The features by descending Fisher score. Features timed by a single
+          user, or without any spread within users, score 0.
+        """
+        vocabulary = {}
+        feature_ids, user_ids, values = [], [], []
+        users = {user: index for index, user in enumerate(dict.fromkeys(ids))}
+        for template, user in zip(templates, ids):
+            for feature, timings in template.items():
+                if len(timings) == 0:
+                    continue
+                feature_id = vocabulary.setdefault(feature, len(vocabulary))
+                feature_ids.append(np.full(len(timings), feature_id))
+                user_ids.append(np.full(len(timings), users[user]))
+                values.append(np.asarray(timings, dtype=np.float64))
+        names = list(vocabulary)
+        if not names:
+            return cls([], [])
+        feature_ids = np.concatenate(feature_ids)
+        values = np.concatenate(values)
+        # Every (user, feature) pair is one group of timings
+        groups = np.concatenate(user_ids) * len(names) + feature_ids
+        size = len(users) * len(names)
+        counts = np.bincount(groups, minlength=size).astype(np.float64)
+        user_means = np.bincount(groups, values, size) / np.maximum(counts, 1)
+        means = np.bincount(feature_ids, values, len(names)) / np.bincount(
+            feature_ids, minlength=len(names)
+        )
+        # Deviations from the means instead of sums of squares, which would cancel out at the
+        # magnitude of nanosecond timings
+        within = np.bincount(
+            feature_ids, (values - user_means[groups]) ** 2, len(names)
+        )
+        feature_of_group = np.tile(np.arange(len(names)), len(users))
+        between = np.bincount(
+            feature_of_group,
+            counts * (user_means - means[feature_of_group]) ** 2,
+            len(names),
+        )
+        scores = np.divide(between, within, out=np.zeros(len(names)), where=within > 0)
+        user_counts = np.bincount(feature_of_group, counts > 0, len(names))
+        scores[user_counts < 2] = 0.0
+        order = np.argsort(-scores, kind="stable")
+        return cls(
+            [names[index] for index in order],
+            scores[order],
+            user_counts[order],
+            np.bincount(feature_ids, minlength=len(names))[order],
+        )
+
+    def top(self, m):
+        """
+        Returns:
+        - frozenset: The m best ranked features.
+        """
+        return frozenset(self.features[:m])
+
+    def save(self, path):
+        """Write the ranking to a JSON file"""
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "version": RANKING_VERSION,
+                    "features": self.features,
+                    "scores": self.scores.tolist(),
+                    "users": None if self.users is None else self.users.tolist(),
+                    "samples": None if self.samples is None else self.samples.tolist(),
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a ranking written by `save`.
+
+        Raises:
+        - ValueError: If the file was written by an incompatible version.
+        """
+        with open(path, "r") as f:
+            data = json.load(f)
+        if data.get("version") != RANKING_VERSION:
+            raise ValueError(f"Unsupported feature ranking version in {path}")
+        return cls(data["features"], data["scores"], data["users"], data["samples"])
+
+
+def selected_features(config):
+    """
+    The features verifiers are restricted to, the "top_features" best ranked features of the
+    ranking at "feature_ranking_path". The ranking is read once and reread when it changes.
+
+    Parameters:
+    - config (dict): The classifier configuration.
+
+    Returns:
+    - frozenset or None: The selected features, None to keep all of them.
+    """
+    path = config.get("feature_ranking_path")
+    top = config.get("top_features")
+    if not path or not top:
+        return None
+    path = os.path.join(os.getcwd(), path)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size, int(top))
+    selected = _ranking_cache.get(key)
+    if selected is None:
+        selected = FeatureRanking.load(path).top(int(top))
+        _ranking_cache.clear()
+        _ranking_cache[key] = selected
+    return selected
+
+
+def restrict_template(pattern, features):
+    """
+    Returns:
+    - dict: The template with only the given features, or the template itself if features is None.
+    """
+    if features is None:
+        return pattern
+    return {
+        feature: timings for feature, timings in pattern.items() if feature in features
+    }
+
+
+if __name__ == "__main__":
+    from classifiers.session_templates import session_templates
+    from classifiers.template_generator import all_ids
+    from classifiers.template_store import family_for_kit
+
+    parser = argparse.ArgumentParser(
+        description="Rank the features of the enrollments of a platform by Fisher score"
+    )
+    parser.add_argument("path")
+    parser.add_argument("--platform", type=int, default=1)
+    parser.add_argument("--session", type=int, nargs="+")
+    parser.add_argument("--kit-feature-type", type=int, default=1)
+    parser.add_argument(
+        "--show", type=int, default=20, help="Print this many top features"
+    )
+    args = parser.parse_args()
+    session = args.session
+    if session is not None and len(session) == 1:
+        session = session[0]
+    ids = all_ids()
+    families = ["kht", family_for_kit(args.kit_feature_type)]
+    sessions = session_templates()
+    ranking = FeatureRanking.from_templates(
+        [sessions.template(i, args.platform, session, families) for i in ids], ids
+    )
+    ranking.save(args.path)
+    for feature, score in zip(ranking.features[: args.show], ranking.scores):
+        print(f"{feature:<30}{score:>12.4f}")
@@ -0,0 +1,650 @@
+import numpy as np
+from classifiers.dbod import DistanceBasedKeystrokeFeatureOutlierDetector
+from classifiers.feature_ranking import restrict_template, selected_features
+from classifiers.quantile_sketch import sketch_features
+from features.compact_timings import value_dtype
+from features.keystroke_features import cap_samples
+from performance_evaluation.instrumentation import instrumentation
+
+
+class FeatureVocabulary:
+    """
+    Assigns every feature name (key, digraph, word, ...) a dense integer id, so the templates of a
+    matrix build can be compared with array operations instead of dictionary lookups.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def id_of(self, feature):
+        feature_id = self.ids.get(feature)
+        if feature_id is None:
+            feature_id = len(self.names)
+            self.ids[feature] = feature_id
+            self.names.append(feature)
+        return feature_id
+
+
+def _segments(lengths):
+    """The offsets of consecutive segments with the given lengths, with a leading 0"""
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def _fallback_stdev(values):
+    # Mirrors Verify: a single timing uses a quarter of itself as its spread, none at all uses 0
+    if len(values) >= 2:
+        return float(np.std(values, ddof=1))
+    if len(values) == 1:
+        return float(values[0]) / 4
+    return 0.0
+
+
+# The per-feature statistics a verifier can declare it needs, and how each one is computed
+# from the (outlier filtered) timings of a feature
+STATISTICS = {
+    "median": lambda values: float(np.median(values)) if len(values) else 0.0,
+    "stdev": _fallback_stdev,
+    "mean": lambda values: float(np.mean(values)) if len(values) else 0.0,
+    "norm": lambda values: float(np.sqrt(np.dot(values, values))),
+}
+
+
+def filter_outliers(pattern, is_enrollment, config):
+    """
+    Returns:
+    - dict: The inlier timings of every feature of a template, all of them unless
+      "use_outlier_detection" is configured.
+    """
+    with instrumentation.stage("outlier_filtering"):
+        if not config["use_outlier_detection"]:
+            return pattern
+        outlier_detector = DistanceBasedKeystrokeFeatureOutlierDetector(
+            list(pattern.keys()), pattern, pattern, config
+        )
+        return outlier_detector.find_pattern_inliers(pattern, is_enrollment)
+
+
+def sample_pattern(pattern, config):
+    """
+    Returns:
+    - tuple[dict, dict]: The template restricted to the selected features (see
+      `classifiers.feature_ranking`), and the timings of it that are filtered and scored: all of
+      them, or at most "max_samples_per_feature" of every feature (see `cap_samples`).
+    """
+    pattern = restrict_template(pattern, selected_features(config))
+    max_samples = config.get("max_samples_per_feature")
+    if not max_samples:
+        return pattern, pattern
+    return pattern, cap_samples(
+        pattern, max_samples, config.get("sample_cap_strategy", "reservoir")
+    )
+
+
+class PreparedTemplate:
+    """
+    A template ready to be scored: outlier filtered once, with its features indexed by a shared
+    `FeatureVocabulary` and the per-feature statistics the verifiers need computed once.
+
+    Verify filters outliers and recomputes medians and deviations for every enrollment/probe pair.
+    Since the inliers and statistics of a feature only depend on the template itself (and on whether
+    it is used as the enrollment or the probe), a matrix build prepares each template once instead.
+
+    Attributes:
+    - feature_ids (np.ndarray[int]): The vocabulary ids of the template's features, sorted.
+    - raw_counts (np.ndarray[int]): The number of timings of each feature before outlier filtering,
+      which is what feature selection thresholds on.
+    - values (np.ndarray[float]): The filtered timings of all features, concatenated in feature order,
+      each feature's timings in the order they were typed. They are float32 with compact timings
+      (see `features.compact_timings`), while statistics are always computed in float64.
+    - offsets (np.ndarray[int]): Feature i's timings are values[offsets[i]:offsets[i + 1]].
+    - statistics (dict[str, np.ndarray]): The computed per-feature statistics, aligned with feature_ids.
+    - weights (np.ndarray[float] or None): For a sketched template, the number of timings each of
+      `values` stands for; None when `values` are the timings themselves.
+    """
+
+    def __init__(self, feature_ids, raw_counts, values, offsets, weights=None):
+        self.feature_ids = feature_ids
+        self.raw_counts = raw_counts
+        self.values = values
+        self.offsets = offsets
+        self.weights = weights
+        self.statistics = {}
+        self._sorted_values = None
+        self._dense_positions = None
+
+    @classmethod
+    def from_pattern(cls, pattern, vocabulary, is_enrollment, config):
+        """
+        Prepare a template (a dictionary of feature to timings) for scoring.
+
+        With "quantile_sketch_k" configured, enrollments keep a KLL sketch of every feature's
+        filtered timings instead of all of them, see `from_sketches`.
+
+        With "max_samples_per_feature" configured, outliers are filtered from and the verifiers
+        iterate over at most that many timings of every feature, chosen by "sample_cap_strategy"
+        (see `cap_samples`). The median, mean and standard deviation and the raw counts used by
+        feature selection still cover all of the timings, whose outliers are decided against
+        the kept sample (see `inlier_mask`).
+
+        With "feature_ranking_path" and "top_features" configured, only the top ranked features
+        are kept (see `classifiers.feature_ranking`), so none of the others is filtered or scored.
+
+        Parameters:
+        - pattern (dict): The template, as produced by the feature extractors.
+        - vocabulary (FeatureVocabulary): The vocabulary shared by all templates that are compared.
+        - is_enrollment (bool): Whether the template is used as the enrollment (pattern 1) or the probe.
+        - config (dict): The classifier configuration, deciding whether outliers are removed.
+
+        Returns:
+        - PreparedTemplate: The prepared template.
+        """
+        pattern, sample = sample_pattern(pattern, config)
+        return cls.from_sample(
+            pattern,
+            sample,
+            filter_outliers(sample, is_enrollment, config),
+            vocabulary,
+            is_enrollment,
+            config,
+        )
+
+    @classmethod
+    def from_sample(cls, pattern, sample, filtered, vocabulary, is_enrollment, config):
+        """
+        Prepare a template from the outcome of `sample_pattern`, whose sample's outliers were
+        already filtered by `filter_outliers`.
+
+        Parameters:
+        - pattern (dict): The template, restricted to the selected features.
+        - sample (dict): The timings of the pattern that are scored, `pattern` itself if uncapped.
+        - filtered (dict): The inlier timings of the sample's features.
+        - vocabulary, is_enrollment, config: See `from_pattern`.
+
+        Returns:
+        - PreparedTemplate: The prepared template.
+        """
+        template = cls.from_filtered(
+            pattern, filtered, vocabulary, is_enrollment, config
+        )
+        if sample is not pattern:
+            template.statistics.update(
+                _full_statistics(
+                    template, pattern, sample, vocabulary, is_enrollment, config
+                )
+            )
+        return template
+
+    @classmethod
+    def from_filtered(cls, pattern, filtered, vocabulary, is_enrollment, config):
+        """
+        Prepare a template whose outliers were already filtered by `filter_outliers`.
+
+        Parameters:
+        - pattern (dict): The template, as produced by the feature extractors.
+        - filtered (dict): The inlier timings of the template's features.
+        - vocabulary, is_enrollment, config: See `from_pattern`.
+
+        Returns:
+        - PreparedTemplate: The prepared template.
+        """
+        features = list(pattern.keys())
+        sketch_k = config.get("quantile_sketch_k")
+        if sketch_k and is_enrollment:
+            return cls.from_sketches(
+                sketch_features(
+                    {feature: filtered.get(feature, []) for feature in features},
+                    sketch_k,
+                ),
+                vocabulary,
+                {feature: len(pattern[feature]) for feature in features},
+            )
+        ids = np.array(
+            [vocabulary.id_of(feature) for feature in features], dtype=np.int64
+        )
+        order = np.argsort(ids, kind="stable")
+        features = [features[i] for i in order]
+        dtype = value_dtype(config)
+        per_feature = [
+            np.asarray(filtered.get(feature, []), dtype=dtype) for feature in features
+        ]
+        lengths = np.array([len(timings) for timings in per_feature], dtype=np.int64)
+        values = np.concatenate(per_feature) if per_feature else np.zeros(0, dtype)
+        return cls(
+            ids[order],
+            np.array([len(pattern[feature]) for feature in features], dtype=np.int64),
+            values,
+            _segments(lengths),
+        )
+
+    @classmethod
+    def from_sketches(cls, sketches, vocabulary, raw_counts=None):
+        """
+        Prepare a template from per-feature quantile sketches, e.g. the merged sketches of a
+        long-lived enrollment (see `classifiers.quantile_sketch`).
+
+        The template keeps the timings retained by the sketches, sorted and weighted by the number
+        of timings each one stands for, so its memory is bounded however much was typed. The
+        medians are the sketches' (approximate) medians and the ITAD ECDF is evaluated over the
+        weighted timings, while the means, standard deviations and norms are exact. Verifiers
+        comparing the timing sequences position by position (Cosine) cannot use it.
+
+        Parameters:
+        - sketches (dict[str, KLLSketch]): The sketch of every feature's (filtered) timings.
+        - vocabulary (FeatureVocabulary): The vocabulary shared by all templates that are compared.
+        - raw_counts (dict[str, int], optional): The number of timings of every feature before
+          outlier filtering, defaults to the number of sketched timings.
+
+        Returns:
+        - PreparedTemplate: The prepared template, with every statistic computed.
+        """
+        features = list(sketches.keys())
+        ids = np.array(
+            [vocabulary.id_of(feature) for feature in features], dtype=np.int64
+        )
+        order = np.argsort(ids, kind="stable")
+        features = [features[i] for i in order]
+        weighted = [sketches[feature].weighted_items() for feature in features]
+        lengths = np.array([len(items) for items, _ in weighted], dtype=np.int64)
+        template = cls(
+            ids[order],
+            np.array(
+                [
+                    (
+                        sketches[feature].count
+                        if raw_counts is None
+                        else raw_counts[feature]
+                    )
+                    for feature in features
+                ],
+                dtype=np.int64,
+            ),
+            _concatenate([items for items, _ in weighted], np.float64),
+            _segments(lengths),
+            _concatenate([weights for _, weights in weighted], np.float64),
+        )
+        # The retained timings are sorted within every feature already
+        template._sorted_values = template.values
+        summaries = {
+            "median": lambda sketch: sketch.quantile(0.5),
+            "stdev": lambda sketch: sketch.stdev(),
+            "mean": lambda sketch: sketch.mean,
+            "norm": lambda sketch: sketch.norm(),
+        }
+        for name, summary in summaries.items():
+            template.statistics[name] = np.array(
+                [summary(sketches[feature]) for feature in features], dtype=np.float64
+            )
+        return template
+
+    def __len__(self):
+        return len(self.feature_ids)
+
+    @property
+    def counts(self):
+        """The number of filtered timings of each feature"""
+        return np.diff(self.offsets)
+
+    def feature_values(self, position):
+        return self.values[self.offsets[position] : self.offsets[position + 1]]
+
+    def value_weights(self):
+        """
+        Returns:
+        - np.ndarray[float]: The number of timings each of `values` stands for, 1 unless sketched.
+        """
+        if self.weights is None:
+            return np.ones(len(self.values))
+        return self.weights
+
+    def prepare(self, required):
+        """
+        Compute the named statistics (see STATISTICS) that have not been computed yet.
+
+        Parameters:
+        - required (iterable[str]): The statistics needed, e.g. a verifier's `requires`.
+        """
+        missing = [name for name in required if name not in self.statistics]
+        if not missing:
+            return
+        with instrumentation.stage("template_statistics"):
+            for name in missing:
+                if name == "sorted":
+                    self.sorted_values()
+                    continue
+                self.statistics[name] = np.array(
+                    [
+                        STATISTICS[name](
+                            self.feature_values(position).astype(np.float64, copy=False)
+                        )
+                        for position in range(len(self))
+                    ],
+                    dtype=np.float64,
+                )
+
+    def sorted_values(self):
+        """
+        Returns:
+        - np.ndarray[float]: `values` with the timings of every feature sorted, using the same offsets.
+        """
+        if self._sorted_values is None:
+            segment = np.repeat(np.arange(len(self)), self.counts)
+            self._sorted_values = self.values[np.lexsort((self.values, segment))]
+        return self._sorted_values
+
+    def dense_positions(self, vocabulary_size):
+        """
+        Returns:
+        - np.ndarray[int]: For every vocabulary id, the position of that feature in this template or -1.
+        """
+        if (
+            self._dense_positions is None
+            or len(self._dense_positions) < vocabulary_size
+        ):
+            positions = np.full(vocabulary_size, -1, dtype=np.int64)
+            positions[self.feature_ids] = np.arange(len(self))
+            self._dense_positions = positions
+        return self._dense_positions
+
+
+def _full_statistics(template, pattern, capped, vocabulary, is_enrollment, config):
+    """
+    The median, mean and standard deviation of every feature of a template prepared from capped
+    samples, over all of the pattern's timings
+    """
+    if config["use_outlier_detection"]:
+        outlier_detector = DistanceBasedKeystrokeFeatureOutlierDetector(
+            [], pattern, pattern, config
+        )
+    statistics = {name: np.zeros(len(template)) for name in ("median", "stdev", "mean")}
+    with instrumentation.stage("template_statistics"):
+        for position, feature_id in enumerate(template.feature_ids):
+            feature = vocabulary.names[feature_id]
+            timings = np.asarray(pattern[feature], dtype=np.float64)
+            if config["use_outlier_detection"]:
+                timings = timings[
+                    outlier_detector.inlier_mask(
+                        timings, is_enrollment, capped[feature]
+                    )
+                ]
+            for name in statistics:
+                statistics[name][position] = STATISTICS[name](timings)
+    return statistics
+
+
+# The packed arrays holding one entry per slot, besides the statistics
+PACKED_SLOT_ARRAYS = ("feature_ids", "raw_counts")
+
+
+def pack_templates(templates, statistics=()):
+    """
+    Concatenate prepared templates into one flat layout, the form in which they are batched and shared.
+
+    Parameters:
+    - templates (list[PreparedTemplate]): The templates, already prepared with `statistics`.
+    - statistics (iterable[str]): The computed per-feature statistics to include.
+
+    Returns:
+    - dict[str, np.ndarray]: "template_offsets" (template i owns slots template_offsets[i] to
+      template_offsets[i + 1]), the per-slot "feature_ids", "raw_counts" and "value_offsets"
+      (with a trailing end offset), the concatenated "values" in the templates' dtype (and their
+      "weights" if any template is sketched), and one per-slot array per statistic.
+    """
+    feature_counts = np.array([len(template) for template in templates], dtype=np.int64)
+    slot_counts = _concatenate([template.counts for template in templates], np.int64)
+    packed = {
+        "template_offsets": _segments(feature_counts),
+        "feature_ids": _concatenate([t.feature_ids for t in templates], np.int64),
+        "raw_counts": _concatenate([t.raw_counts for t in templates], np.int64),
+        "value_offsets": _segments(slot_counts),
+        "values": _concatenate(
+            [t.values for t in templates],
+            np.result_type(np.float32, *[t.values.dtype for t in templates]),
+        ),
+    }
+    if any(template.weights is not None for template in templates):
+        packed["weights"] = _concatenate(
+            [template.value_weights() for template in templates], np.float64
+        )
+    for name in statistics:
+        if name == "sorted":
+            continue
+        packed[name] = _concatenate(
+            [template.statistics[name] for template in templates], np.float64
+        )
+    return packed
+
+
+# Every packed array written to a shared block or a file starts at a multiple of this many bytes
+ARRAY_ALIGNMENT = 64
+
+
+def layout_arrays(arrays, start=0):
+    """
+    Place arrays one after the other in a flat buffer, each aligned to ARRAY_ALIGNMENT bytes.
+
+    Parameters:
+    - arrays (dict[str, np.ndarray]): The arrays to place.
+    - start (int): The first free byte of the buffer.
+
+    Returns:
+    - tuple[dict, int]: The (offset, dtype string, shape) of every array, and the end of the last one.
+    """
+    layout = {}
+    end = start
+    for name, array in arrays.items():
+        end = -(-end // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+        layout[name] = (end, array.dtype.str, list(array.shape))
+        end += array.nbytes
+    return layout, end
+
+
+def view_arrays(buffer, layout):
+    """
+    Returns:
+    - dict[str, np.ndarray]: Views of the arrays placed in `buffer` by `layout_arrays`.
+    """
+    return {
+        name: np.ndarray(
+            tuple(shape), dtype=np.dtype(dtype), buffer=buffer, offset=offset
+        )
+        for name, (offset, dtype, shape) in layout.items()
+    }
+
+
+class PackedTemplates:
+    """
+    Read access to templates laid out by `pack_templates`, for stores whose arrays live outside of
+    the Python heap (shared memory, a memory mapped file). Templates and batches are views of the
+    packed arrays, so nothing is copied.
+
+    Attributes:
+    - ids (list[int]): The user id of every template.
+    - arrays (dict[str, np.ndarray]): The packed arrays.
+    """
+
+    def __init__(self, ids, arrays):
+        self.ids = ids
+        self.arrays = arrays
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _packed_range(self, start, stop):
+        arrays = self.arrays
+        first_slot, last_slot = arrays["template_offsets"][[start, stop]]
+        first_value, last_value = arrays["value_offsets"][[first_slot, last_slot]]
+        packed = {"template_offsets": arrays["template_offsets"][start : stop + 1]}
+        for name in PACKED_SLOT_ARRAYS + tuple(STATISTICS):
+            if name in arrays:
+                packed[name] = arrays[name][first_slot:last_slot]
+        packed["value_offsets"] = arrays["value_offsets"][first_slot : last_slot + 1]
+        packed["values"] = arrays["values"][first_value:last_value]
+        if "weights" in arrays:
+            packed["weights"] = arrays["weights"][first_value:last_value]
+        return packed
+
+    def template(self, index):
+        """
+        Returns:
+        - PreparedTemplate: A view of the index-th template.
+        """
+        packed = self._packed_range(index, index + 1)
+        template = PreparedTemplate(
+            packed["feature_ids"],
+            packed["raw_counts"],
+            packed["values"],
+            packed["value_offsets"] - packed["value_offsets"][0],
+            packed.get("weights"),
+        )
+        if template.weights is not None:
+            # Sketched templates are packed with their timings sorted within every feature
+            template._sorted_values = template.values
+        for name in packed:
+            if name in STATISTICS:
+                template.statistics[name] = packed[name]
+        return template
+
+    def batch(self, start=0, stop=None):
+        """
+        Returns:
+        - TemplateBatch: The templates start to stop (exclusive), batched over views of the arrays.
+        """
+        if stop is None:
+            stop = len(self)
+        stop = min(stop, len(self))
+        return TemplateBatch(
+            [self.template(index) for index in range(start, stop)],
+            self._packed_range(start, stop),
+        )
+
+
+class TemplateBatch:
+    """
+    Several prepared templates (typically all the probes of a tile) concatenated into flat arrays,
+    so that one enrollment can be scored against all of them with a handful of array operations.
+
+    A "slot" is one feature of one template; slots are numbered consecutively across templates.
+    The flat arrays are built with `pack_templates` unless already `packed` ones are given, for
+    instance views of a shared memory store.
+    """
+
+    def __init__(self, templates, packed=None):
+        self.templates = templates
+        if packed is None:
+            packed = pack_templates(templates)
+        self.slot_offsets = packed["template_offsets"] - packed["template_offsets"][0]
+        self.slot_template = np.repeat(
+            np.arange(len(templates)), np.diff(self.slot_offsets)
+        )
+        self.slot_feature = packed["feature_ids"]
+        self.slot_raw_count = packed["raw_counts"]
+        self.slot_count = np.diff(packed["value_offsets"])
+        self.values = packed["values"]
+        self.value_slot = np.repeat(np.arange(len(self.slot_feature)), self.slot_count)
+        # The position of every value inside its own feature's timings
+        self.value_rank = np.arange(len(self.values)) - np.repeat(
+            _segments(self.slot_count)[:-1], self.slot_count
+        )
+        self.statistics = {
+            name: values for name, values in packed.items() if name in STATISTICS
+        }
+
+    def __len__(self):
+        return len(self.templates)
+
+    def prepare(self, required):
+        """Compute the named statistics for every template and concatenate them per slot"""
+        missing = [
+            name
+            for name in required
+            if name not in self.statistics and name != "sorted"
+        ]
+        if not missing and "sorted" not in required:
+            return
+        for template in self.templates:
+            template.prepare(required)
+        for name in missing:
+            self.statistics[name] = _concatenate(
+                [template.statistics[name] for template in self.templates], np.float64
+            )
+
+
+def _concatenate(arrays, dtype):
+    if not arrays:
+        return np.zeros(0, dtype=dtype)
+    return np.concatenate(arrays).astype(dtype, copy=False)
+
+
+class CommonFeatures:
+    """
+    The features an enrollment shares with each template of a batch, as parallel arrays with one
+    entry per shared (template, feature) pair.
+
+    Attributes:
+    - template (np.ndarray[int]): The batch template of each entry.
+    - enrollment_position (np.ndarray[int]): The position of the feature in the enrollment.
+    - slot (np.ndarray[int]): The slot of the feature in the batch.
+    """
+
+    def __init__(self, template, enrollment_position, slot, batch_size):
+        self.template = template
+        self.enrollment_position = enrollment_position
+        self.slot = slot
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return len(self.slot)
+
+    def per_template(self, weights=None):
+        """Sum `weights` (or count the entries) per batch template"""
+        return np.bincount(self.template, weights=weights, minlength=self.batch_size)
+
+    def value_entries(self, batch):
+        """
+        Map the values of the batch onto the shared entries.
+
+        Returns:
+        - tuple[np.ndarray, np.ndarray]: The indices of the batch values belonging to a shared
+          feature, and the entry each of them belongs to.
+        """
+        slot_entry = np.full(len(batch.slot_feature), -1, dtype=np.int64)
+        slot_entry[self.slot] = np.arange(len(self))
+        entry = slot_entry[batch.value_slot]
+        selected = np.flatnonzero(entry >= 0)
+        return selected, entry[selected]
+
+
+def find_common_features(enrollment, batch, use_feature_selection, thresholds=(10, 10)):
+    """
+    Select the features shared by an enrollment and every template of a batch, like Verify does per pair.
+
+    Parameters:
+    - enrollment (PreparedTemplate): The enrollment (pattern 1).
+    - batch (TemplateBatch): The probes (pattern 2), indexed by the same vocabulary.
+    - use_feature_selection (bool): Only keep features with enough timings in both templates.
+    - thresholds (tuple[int, int]): The minimum raw number of timings in the enrollment and the probe.
+
+    Returns:
+    - CommonFeatures: The shared features.
+    """
+    with instrumentation.stage("common_feature_selection"):
+        vocabulary_size = 1 + max(
+            enrollment.feature_ids.max(initial=-1), batch.slot_feature.max(initial=-1)
+        )
+        positions = enrollment.dense_positions(vocabulary_size)[batch.slot_feature]
+        shared = positions >= 0
+        if use_feature_selection:
+            shared &= batch.slot_raw_count >= thresholds[1]
+            shared[shared] &= enrollment.raw_counts[positions[shared]] >= thresholds[0]
+        slots = np.flatnonzero(shared)
+        common = CommonFeatures(
+            batch.slot_template[slots], positions[slots], slots, len(batch)
+        )
+    instrumentation.count("common_features", len(common))
+    return common
@@ -0,0 +1,241 @@
+from collections import OrderedDict, defaultdict
+import numpy as np
+from classifiers.template_generator import read_compact_format
+from classifiers.template_store import (
+    TEMPLATE_FAMILIES,
+    matches_selector,
+    ngraph_family_parameters,
+)
+from features.compact_timings import is_compact
+from features.keystroke_features import (
+    NGraphVocabulary,
+    group_samples_by_feature,
+    kht_samples,
+    kit_samples,
+    timing_array,
+)
+from performance_evaluation.instrumentation import instrumentation
+
+# The cache of the compact format DataFrame currently returned by `read_compact_format`
+_session_templates = None
+
+
+def merge_templates(*templates):
+    """
+    Merge templates by concatenating the timings of every feature, in the order of the templates.
+
+    Parameters:
+    - *templates (dict): Templates mapping features to lists of timings.
+
+    Returns:
+    - dict: A defaultdict(list) with the features in order of first occurrence. Features with
+      compact timing arrays get one concatenated array instead of a list.
+    """
+    parts = defaultdict(list)
+    for template in templates:
+        for feature, timings in template.items():
+            parts[feature].append(timings)
+    merged = defaultdict(list)
+    for feature, timings in parts.items():
+        if is_compact(timings[0]):
+            merged[feature] = np.concatenate(timings)
+        else:
+            merged[feature] = [timing for part in timings for timing in part]
+    return merged
+
+
+class SessionTemplateCache:
+    """
+    The KHT and KIT templates of every (user, platform, session) of a compact format DataFrame,
+    extracted once and merged for any selector.
+
+    The rows of every session are located with a single groupby over the whole DataFrame. The
+    samples of a session and family are only extracted the first time a selector needs them, and
+    the sessions of the most recently used `cache_size` users are kept. Assembling a multi-session
+    or multi-platform template then only concatenates the cached samples and groups them by
+    feature once, so e.g. the overlapping session sets of the cross validation folds are never
+    sliced or extracted twice.
+
+    The samples of a session are kept as two flat arrays, int32 feature ids into a vocabulary
+    shared by the cache and the timings in the dtype of the DataFrame's times, rather than as a
+    template with a list per feature. That is 8 bytes per sample with compact int32 timings (see
+    `features.compact_timings`) and 12 with float64 ones.
+
+    KIT digraphs are extracted per session and so never span the boundary between two sessions,
+    like in `TemplateStore`. So are the n-graphs of the families made by `family_for_ngraph`,
+    whose vocabulary is counted over the whole DataFrame once and pruned to the frequent ones.
+
+    Usage:
+    >>> cache = SessionTemplateCache(read_compact_format())
+    >>> template = cache.template(1, 1, [1, 2, 4, 5, 6], ["kht", "kit1"])
+    """
+
+    def __init__(self, df, cache_size=1024):
+        self.df = df
+        self.cache_size = cache_size
+        self._keys = df["key"].to_numpy(dtype=object)
+        self._press = timing_array(df["press_time"])
+        self._release = timing_array(df["release_time"])
+        with instrumentation.stage("slicing"):
+            groups = df.groupby(
+                ["user_ids", "platform_id", "session_id"], sort=False
+            ).indices
+        # user -> (platform, session) -> the rows of the session, in typing order
+        self._rows = defaultdict(dict)
+        for (user_id, platform, session), rows in groups.items():
+            self._rows[int(user_id)][(int(platform), int(session))] = rows
+        # user -> (platform, session, family) -> extracted (feature ids, timings)
+        self._loaded = OrderedDict()
+        self._feature_ids = {}
+        self._feature_names = []
+        # (n, min_count) -> NGraphVocabulary
+        self._ngraph_vocabularies = {}
+
+    def sessions(self, user_id):
+        """
+        Returns:
+        - list[tuple[int, int]]: The sorted (platform, session) pairs recorded for the user.
+        """
+        return sorted(self._rows.get(user_id, {}))
+
+    def ngraph_vocabulary(self, n, min_count):
+        """
+        Returns:
+        - NGraphVocabulary: The n-graphs typed at least min_count times within the sessions of
+          the DataFrame, counted in one pass the first time they are needed.
+        """
+        vocabulary = self._ngraph_vocabularies.get((n, min_count))
+        if vocabulary is None:
+            with instrumentation.stage("ngraph_vocabulary"):
+                sessions = np.zeros(len(self._keys), dtype=np.int64)
+                for index, rows in enumerate(
+                    rows for user in self._rows.values() for rows in user.values()
+                ):
+                    sessions[rows] = index
+                vocabulary = NGraphVocabulary.from_keystrokes(
+                    self._keys, n, min_count, sessions
+                )
+            self._ngraph_vocabularies[(n, min_count)] = vocabulary
+        return vocabulary
+
+    def _user_atoms(self, user_id):
+        atoms = self._loaded.get(user_id)
+        if atoms is not None:
+            self._loaded.move_to_end(user_id)
+            return atoms
+        atoms = {}
+        self._loaded[user_id] = atoms
+        if len(self._loaded) > self.cache_size:
+            self._loaded.popitem(last=False)
+        return atoms
+
+    def _encode(self, names):
+        unique_names, inverse = np.unique(names, return_inverse=True)
+        ids = np.empty(len(unique_names), dtype=np.int32)
+        for index, name in enumerate(unique_names):
+            feature_id = self._feature_ids.get(name)
+            if feature_id is None:
+                feature_id = len(self._feature_names)
+                self._feature_ids[name] = feature_id
+                self._feature_names.append(name)
+            ids[index] = feature_id
+        return ids[inverse.reshape(-1)]
+
+    def _group(self, feature_ids, values):
+        template = defaultdict(list)
+        grouped = group_samples_by_feature(feature_ids, values)
+        for feature_id, timings in grouped.items():
+            template[self._feature_names[feature_id]] = timings
+        return template
+
+    def session_template(self, user_id, platform, session, family):
+        """
+        Parameters:
+        - user_id, platform, session (int): The session.
+        - family (str): One of `TEMPLATE_FAMILIES`, or an n-graph family.
+
+        Returns:
+        - dict: The template of the family extracted from the session alone.
+        """
+        return self._group(*self.session_samples(user_id, platform, session, family))
+
+    def session_samples(self, user_id, platform, session, family):
+        """
+        Parameters:
+        - user_id, platform, session (int): The session.
+        - family (str): One of `TEMPLATE_FAMILIES`, or an n-graph family.
+
+        Returns:
+        - tuple[np.ndarray, np.ndarray]: The feature id and timing of every sample of the family
+          in the session, in typing order. They are cached and must not be modified.
+        """
+        atoms = self._user_atoms(user_id)
+        samples = atoms.get((platform, session, family))
+        if samples is not None:
+            instrumentation.cache_hit("session_templates")
+            return samples
+        instrumentation.cache_miss("session_templates")
+        ngraph = ngraph_family_parameters(family)
+        if family not in TEMPLATE_FAMILIES and ngraph is None:
+            raise ValueError(f"Unknown template family {family}")
+        rows = self._rows[user_id][(platform, session)]
+        arrays = (self._keys[rows], self._press[rows], self._release[rows])
+        if ngraph is not None:
+            vocabulary = self.ngraph_vocabulary(*ngraph)
+            with instrumentation.stage("ngraph_extraction"):
+                names, values = vocabulary.samples(*arrays)
+        elif family == "kht":
+            with instrumentation.stage("kht_extraction"):
+                names, values = kht_samples(*arrays)
+        else:
+            with instrumentation.stage("kit_extraction"):
+                names, values = kit_samples(*arrays, int(family[len("kit") :]))
+        samples = (self._encode(names), values.astype(self._press.dtype, copy=False))
+        atoms[(platform, session, family)] = samples
+        return samples
+
+    def template(self, user_id, platform_id, session_id=None, families=("kht",)):
+        """
+        Assemble the template of a user from the sessions matching the selector.
+
+        Parameters:
+        - user_id (int): The user.
+        - platform_id, session_id: A selector with the semantics of `get_user_by_platform`.
+        - families (list[str]): The template families to combine, e.g. ["kht", "kit1"].
+
+        Returns:
+        - dict: A defaultdict(list) mapping every feature to its timings, with the features of
+          each family in turn (like `create_kht_data_from_df(df) | create_kit_data_from_df(...)`)
+          and the timings concatenated over the selected sessions in (platform, session) order.
+        """
+        selected = [
+            (platform, session)
+            for platform, session in self.sessions(user_id)
+            if matches_selector(platform, session, platform_id, session_id)
+        ]
+        samples = [
+            self.session_samples(user_id, platform, session, family)
+            for family in families
+            for platform, session in selected
+        ]
+        with instrumentation.stage("template_merging"):
+            if not samples:
+                return defaultdict(list)
+            # Grouping the concatenated samples once orders the features and timings exactly
+            # like merging the template of every session in turn
+            return self._group(
+                np.concatenate([feature_ids for feature_ids, _ in samples]),
+                np.concatenate([values for _, values in samples]),
+            )
+
+
+def session_templates():
+    """
+    Returns:
+    - SessionTemplateCache: The cache of the configured dataset, rebuilt when the dataset changes.
+    """
+    global _session_templates
+    df = read_compact_format()
+    if _session_templates is None or _session_templates.df is not df:
+        _session_templates = SessionTemplateCache(df)
+    return _session_templates
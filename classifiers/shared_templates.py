@@ -0,0 +1,191 @@
+import sys
+from multiprocessing import Pool, resource_tracker, shared_memory
+import numpy as np
+from classifiers.prepared_templates import (
+    FeatureVocabulary,
+    PackedTemplates,
+    PreparedTemplate,
+    layout_arrays,
+    pack_templates,
+    view_arrays,
+)
+from classifiers.verifier_registry import (
+    DEFAULT_THRESHOLDS,
+    ProbeSet,
+    get_verifier,
+    required_statistics,
+)
+
+
+class SharedTemplateStore(PackedTemplates):
+    """
+    Prepared templates of many users packed into a single `multiprocessing.shared_memory` block,
+    so that worker processes can read them without any pickling or copying.
+
+    The producing process builds the store once with `create` and hands the small, picklable
+    `descriptor` to its workers, which `attach` to the block by name and get zero-copy views of
+    the concatenated timings, offsets and statistics. Templates are prepared (outlier filtered
+    and summarized) in the role they are stored for, the enrollment or the probe.
+
+    Usage:
+    >>> vocabulary = FeatureVocabulary()
+    >>> store = SharedTemplateStore.create(templates, ids, False, config, ["median"], vocabulary)
+    >>> worker_store = SharedTemplateStore.attach(store.descriptor)  # in a worker
+    >>> batch = worker_store.batch(0, 256)
+    >>> store.close(); store.unlink()
+    """
+
+    def __init__(self, memory, descriptor):
+        self.memory = memory
+        self.descriptor = descriptor
+        super().__init__(
+            descriptor["ids"], view_arrays(memory.buf, descriptor["arrays"])
+        )
+
+    @classmethod
+    def create(cls, templates, ids, is_enrollment, config, required, vocabulary):
+        """
+        Prepare templates and copy them into a new shared memory block.
+
+        Parameters:
+        - templates (list[dict]): The templates, as produced by the feature extractors.
+        - ids (list[int]): The user id of every template.
+        - is_enrollment (bool): Whether the templates are used as enrollments or as probes.
+        - config (dict): The classifier configuration, deciding whether outliers are removed.
+        - required (iterable[str]): The statistics to precompute, e.g. a verifier's `requires`.
+        - vocabulary (FeatureVocabulary): The vocabulary shared with the stores compared against.
+
+        Returns:
+        - SharedTemplateStore: The store, owned by the calling process which must `unlink` it.
+        """
+        prepared = []
+        for template in templates:
+            prepared_template = PreparedTemplate.from_pattern(
+                template, vocabulary, is_enrollment, config
+            )
+            prepared_template.prepare(required)
+            prepared.append(prepared_template)
+        packed = pack_templates(prepared, required)
+        layout, size = layout_arrays(packed)
+        memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        descriptor = {
+            "name": memory.name,
+            "ids": list(ids),
+            "is_enrollment": is_enrollment,
+            "arrays": layout,
+        }
+        store = cls(memory, descriptor)
+        for name, array in packed.items():
+            store.arrays[name][...] = array
+        return store
+
+    @classmethod
+    def attach(cls, descriptor):
+        """Open the store published by another process through its `descriptor`"""
+        # Only the creating process may unlink the block, so attaching must not track it
+        if sys.version_info >= (3, 13):
+            memory = shared_memory.SharedMemory(name=descriptor["name"], track=False)
+        else:
+            # Before 3.13 every SharedMemory registers with the resource tracker, which forked
+            # workers share with the creator, so registration is skipped while attaching
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                memory = shared_memory.SharedMemory(name=descriptor["name"])
+            finally:
+                resource_tracker.register = register
+        return cls(memory, descriptor)
+
+    def close(self):
+        """Release this process' mapping of the block, invalidating all of its views"""
+        self.arrays = {}
+        self.memory.close()
+
+    def unlink(self):
+        """Free the block, to be called once by the creating process after every worker is done"""
+        self.memory.unlink()
+
+
+# The stores attached by a worker process, and what it scores with
+_worker_state = {}
+
+
+def _attach_worker(
+    enrollment_descriptor, probe_descriptor, verifier_types, config, thresholds
+):
+    enrollments = SharedTemplateStore.attach(enrollment_descriptor)
+    probes = SharedTemplateStore.attach(probe_descriptor)
+    verifiers = [get_verifier(verifier_type) for verifier_type in verifier_types]
+    _worker_state["enrollments"] = enrollments
+    _worker_state["probe_set"] = ProbeSet(verifiers, probes.batch(), config, thresholds)
+    _worker_state["probes"] = probes
+
+
+def _score_rows(rows):
+    enrollments = _worker_state["enrollments"]
+    probe_set = _worker_state["probe_set"]
+    start, stop = rows
+    return start, np.stack(
+        [probe_set.score(enrollments.template(row)) for row in range(start, stop)],
+        axis=1,
+    )
+
+
+def score_matrices_in_processes(
+    verifier_types,
+    enrollments,
+    probes,
+    config,
+    thresholds=DEFAULT_THRESHOLDS,
+    processes=None,
+    rows_per_task=16,
+):
+    """
+    Score every enrollment against every probe with several verifiers, in a pool of worker
+    processes that read the templates from shared memory instead of receiving pickled copies.
+
+    Parameters:
+    - verifier_types (list[VerifierType]): The verifiers to score with.
+    - enrollments, probes (list[dict]): The templates.
+    - config (dict): The classifier configuration.
+    - thresholds (tuple[int, int]): The feature selection thresholds of the enrollment and the probe.
+    - processes (int, optional): The number of workers, defaults to the number of CPUs.
+    - rows_per_task (int): The number of enrollments scored per task.
+
+    Returns:
+    - np.ndarray: The verifier x enrollment x probe scores.
+    """
+    required = required_statistics(
+        [get_verifier(verifier_type) for verifier_type in verifier_types]
+    )
+    vocabulary = FeatureVocabulary()
+    probe_store = SharedTemplateStore.create(
+        probes, range(len(probes)), False, config, required, vocabulary
+    )
+    enrollment_store = SharedTemplateStore.create(
+        enrollments, range(len(enrollments)), True, config, required, vocabulary
+    )
+    matrices = np.zeros((len(verifier_types), len(enrollments), len(probes)))
+    tasks = [
+        (start, min(start + rows_per_task, len(enrollments)))
+        for start in range(0, len(enrollments), rows_per_task)
+    ]
+    try:
+        with Pool(
+            processes,
+            initializer=_attach_worker,
+            initargs=(
+                enrollment_store.descriptor,
+                probe_store.descriptor,
+                list(verifier_types),
+                config,
+                thresholds,
+            ),
+        ) as pool:
+            for start, block in pool.imap_unordered(_score_rows, tasks):
+                matrices[:, start : start + block.shape[1]] = block
+    finally:
+        for store in (enrollment_store, probe_store):
+            store.close()
+            store.unlink()
+    return matrices
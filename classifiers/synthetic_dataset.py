@@ -0,0 +1,322 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from classifiers.template_generator import (
+    COMPACT_FORMAT_COLUMNS,
+    read_compact_format_file,
+)
+
+# Parametric defaults, in milliseconds, used when no real data is available to fit.
+# They roughly follow published free-text keystroke timings: holds around 100ms and
+# press-to-press intervals around 200ms, both log-normally distributed
+DEFAULT_KEYS = [f"'{letter}'" for letter in "etaoinshrdlcumwfgypbvkjxqz"] + [
+    "Key.space",
+    "Key.backspace",
+    "Key.shift",
+    "'.'",
+    "','",
+]
+DEFAULT_HOLD_MS = 100.0
+DEFAULT_HOLD_SIGMA = 0.3
+DEFAULT_INTERVAL_MS = 200.0
+DEFAULT_INTERVAL_SIGMA = 0.5
+
+# Our recordings are in nanoseconds, so that is what the generator emits by default
+NANOSECONDS_PER_MILLISECOND = 1e6
+
+
+class UserTypingProfile:
+    """
+    The typing behaviour of a single (real or synthetic) user.
+
+    Attributes:
+    - keys (np.ndarray[str]): The key vocabulary of the user.
+    - key_probabilities (np.ndarray[float]): How often each key is typed.
+    - hold_log_mean, hold_log_sigma (np.ndarray[float]): Per key log-normal parameters of the KHT.
+    - interval_log_mean, interval_log_sigma (float): Log-normal parameters of the press-to-press
+      interval between consecutive keys, from which every KIT flight follows.
+    """
+
+    def __init__(
+        self,
+        keys,
+        key_probabilities,
+        hold_log_mean,
+        hold_log_sigma,
+        interval_log_mean,
+        interval_log_sigma,
+    ):
+        self.keys = np.asarray(keys, dtype=object)
+        self.key_probabilities = np.asarray(key_probabilities, dtype=np.float64)
+        self.key_probabilities /= self.key_probabilities.sum()
+        self.hold_log_mean = np.asarray(hold_log_mean, dtype=np.float64)
+        self.hold_log_sigma = np.asarray(hold_log_sigma, dtype=np.float64)
+        self.interval_log_mean = float(interval_log_mean)
+        self.interval_log_sigma = float(interval_log_sigma)
+
+    def jittered(self, rng, scale=0.1):
+        """
+        Returns:
+        - UserTypingProfile: A new profile whose timing parameters are perturbed by `scale`
+          (in log space) and whose key frequencies are resampled, so that many synthetic users
+          derived from one real user remain distinguishable.
+        """
+        return UserTypingProfile(
+            self.keys,
+            rng.dirichlet(self.key_probabilities * 200 + 0.1),
+            self.hold_log_mean + rng.normal(0, scale, len(self.keys)),
+            self.hold_log_sigma,
+            self.interval_log_mean + rng.normal(0, scale),
+            self.interval_log_sigma,
+        )
+
+    def sample_session(self, rng, num_keystrokes, start_time, time_scale):
+        """
+        Draw one session of keystrokes.
+
+        Parameters:
+        - rng (np.random.Generator): The random source.
+        - num_keystrokes (int): The number of keystrokes in the session.
+        - start_time (float): The press time of the first keystroke.
+        - time_scale (float): How many time units make up a millisecond.
+
+        Returns:
+        - tuple[np.ndarray, np.ndarray, np.ndarray]: The keys, press times and release times.
+        """
+        key_indices = rng.choice(
+            len(self.keys), size=num_keystrokes, p=self.key_probabilities
+        )
+        holds = np.exp(
+            rng.normal(
+                self.hold_log_mean[key_indices], self.hold_log_sigma[key_indices]
+            )
+        )
+        intervals = np.exp(
+            rng.normal(self.interval_log_mean, self.interval_log_sigma, num_keystrokes)
+        )
+        intervals[0] = 0
+        press = start_time + np.cumsum(intervals) * time_scale
+        release = press + holds * time_scale
+        return self.keys[key_indices], press, release
+
+
+class KeystrokeDistributionModel:
+    """
+    A pool of per-user typing profiles from which an arbitrary number of synthetic users is drawn.
+
+    Fit it on the compact format with `fit`, or use `parametric` when no real data is available.
+    """
+
+    def __init__(self, profiles, time_scale=NANOSECONDS_PER_MILLISECOND):
+        if len(profiles) == 0:
+            raise ValueError("A distribution model needs at least one user profile")
+        self.profiles = profiles
+        self.time_scale = time_scale
+
+    @classmethod
+    def parametric(cls, time_scale=NANOSECONDS_PER_MILLISECOND):
+        """
+        Returns:
+        - KeystrokeDistributionModel: A single profile model built from the parametric defaults.
+        """
+        num_keys = len(DEFAULT_KEYS)
+        # Zipf-like key frequencies, with the space bar as frequent as the most common letter
+        probabilities = 1 / np.arange(1, num_keys + 1)
+        probabilities[DEFAULT_KEYS.index("Key.space")] = probabilities[0]
+        profile = UserTypingProfile(
+            DEFAULT_KEYS,
+            probabilities,
+            np.full(num_keys, np.log(DEFAULT_HOLD_MS)),
+            np.full(num_keys, DEFAULT_HOLD_SIGMA),
+            np.log(DEFAULT_INTERVAL_MS),
+            DEFAULT_INTERVAL_SIGMA,
+        )
+        return cls([profile], time_scale)
+
+    @classmethod
+    def fit(cls, df, time_scale=NANOSECONDS_PER_MILLISECOND, min_samples=5):
+        """
+        Fit one profile per user of a compact format DataFrame.
+
+        Hold times are fit per key with a log-normal; keys with fewer than `min_samples`
+        samples share the user's overall hold distribution. The press-to-press interval is
+        fit per user over consecutive keystrokes of the same session, ignoring pauses longer
+        than five seconds.
+
+        Parameters:
+        - df (pandas.DataFrame): Keystrokes in the compact format.
+        - time_scale (float): How many time units of `df` make up a millisecond.
+        - min_samples (int): The minimum number of samples to fit a per key distribution.
+
+        Returns:
+        - KeystrokeDistributionModel: A model with a profile for every user in `df`.
+        """
+        profiles = []
+        for _, user_df in df.groupby("user_ids", sort=True):
+            holds_ms = (
+                user_df["release_time"].to_numpy() - user_df["press_time"].to_numpy()
+            ) / time_scale
+            valid = holds_ms > 0
+            if valid.sum() < min_samples:
+                continue
+            keys = user_df["key"].to_numpy()[valid]
+            log_holds = np.log(holds_ms[valid])
+            overall_mean, overall_sigma = log_holds.mean(), max(log_holds.std(), 1e-3)
+            vocabulary, inverse, counts = np.unique(
+                keys, return_inverse=True, return_counts=True
+            )
+            sums = np.bincount(inverse, weights=log_holds)
+            squares = np.bincount(inverse, weights=log_holds**2)
+            means = sums / counts
+            sigmas = np.sqrt(np.maximum(squares / counts - means**2, 1e-6))
+            sparse = counts < min_samples
+            means[sparse] = overall_mean
+            sigmas[sparse] = overall_sigma
+
+            intervals = []
+            for _, session_df in user_df.groupby(
+                ["platform_id", "session_id"], sort=False
+            ):
+                gaps = np.diff(session_df["press_time"].to_numpy()) / time_scale
+                intervals.append(gaps[(gaps > 0) & (gaps < 5000)])
+            intervals = np.concatenate(intervals) if intervals else np.array([])
+            if len(intervals) >= min_samples:
+                log_intervals = np.log(intervals)
+                interval_mean = log_intervals.mean()
+                interval_sigma = max(log_intervals.std(), 1e-3)
+            else:
+                interval_mean = np.log(DEFAULT_INTERVAL_MS)
+                interval_sigma = DEFAULT_INTERVAL_SIGMA
+            profiles.append(
+                UserTypingProfile(
+                    vocabulary, counts, means, sigmas, interval_mean, interval_sigma
+                )
+            )
+        return cls(profiles, time_scale)
+
+
+def generate_compact_dataset(
+    output_path,
+    num_users,
+    model=None,
+    num_platforms=3,
+    num_sessions=6,
+    keystrokes_per_session=400,
+    seed=0,
+    chunk_rows=1_000_000,
+):
+    """
+    Write a synthetic dataset in the compact format, streaming it to disk in chunks.
+
+    Every synthetic user is a jittered copy of a profile of `model`, cycling through its profiles,
+    and types `keystrokes_per_session` keys (Poisson distributed) in each session of each platform.
+    At most `chunk_rows` rows are held in memory at once, so arbitrarily large files can be written.
+
+    Parameters:
+    - output_path (str): The CSV file to (over)write.
+    - num_users (int): The number of users to generate, with ids 1 to num_users.
+    - model (KeystrokeDistributionModel, optional): The model to draw users from.
+      Defaults to `KeystrokeDistributionModel.parametric()`.
+    - num_platforms (int): The number of platforms per user.
+    - num_sessions (int): The number of sessions per user and platform.
+    - keystrokes_per_session (int): The mean number of keystrokes in a session.
+    - seed (int): The seed of the random generator, making the output reproducible.
+    - chunk_rows (int): The number of buffered rows after which a chunk is flushed.
+
+    Returns:
+    - int: The number of rows written.
+    """
+    if model is None:
+        model = KeystrokeDistributionModel.parametric()
+    rng = np.random.default_rng(seed)
+    # Give every session of a user its own hour so they never overlap in time
+    session_spacing = 3_600_000 * model.time_scale
+    start_of_recording = 1.6e12 * model.time_scale
+    rows_written = 0
+    buffered_rows = 0
+    buffer = []
+    header = True
+    if os.path.exists(output_path):
+        os.remove(output_path)
+
+    def flush():
+        nonlocal header, rows_written, buffered_rows, buffer
+        if not buffer:
+            return
+        chunk = pd.DataFrame(
+            {
+                column: np.concatenate([part[column] for part in buffer])
+                for column in COMPACT_FORMAT_COLUMNS
+            }
+        )
+        chunk.to_csv(output_path, mode="a", header=header, index=False)
+        header = False
+        rows_written += len(chunk)
+        buffered_rows = 0
+        buffer = []
+
+    for user_id in range(1, num_users + 1):
+        profile = model.profiles[(user_id - 1) % len(model.profiles)].jittered(rng)
+        session_index = 0
+        for platform_id in range(1, num_platforms + 1):
+            for session_id in range(1, num_sessions + 1):
+                num_keystrokes = max(2, rng.poisson(keystrokes_per_session))
+                keys, press, release = profile.sample_session(
+                    rng,
+                    num_keystrokes,
+                    start_of_recording + session_index * session_spacing,
+                    model.time_scale,
+                )
+                session_index += 1
+                buffer.append(
+                    {
+                        "key": keys,
+                        "press_time": press,
+                        "release_time": release,
+                        "platform_id": np.full(num_keystrokes, platform_id),
+                        "session_id": np.full(num_keystrokes, session_id),
+                        "user_ids": np.full(num_keystrokes, user_id),
+                    }
+                )
+                buffered_rows += num_keystrokes
+                if buffered_rows >= chunk_rows:
+                    flush()
+    flush()
+    return rows_written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic keystroke dataset in the compact format"
+    )
+    parser.add_argument("output", help="The CSV file to write")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--platforms", type=int, default=3)
+    parser.add_argument("--sessions", type=int, default=6)
+    parser.add_argument("--keystrokes-per-session", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000)
+    parser.add_argument(
+        "--fit",
+        help="A compact format CSV to fit the per-user distributions on, "
+        "instead of using the parametric defaults",
+    )
+    args = parser.parse_args()
+    if args.fit:
+        distribution_model = KeystrokeDistributionModel.fit(
+            read_compact_format_file(args.fit)
+        )
+    else:
+        distribution_model = KeystrokeDistributionModel.parametric()
+    written = generate_compact_dataset(
+        args.output,
+        args.users,
+        model=distribution_model,
+        num_platforms=args.platforms,
+        num_sessions=args.sessions,
+        keystrokes_per_session=args.keystrokes_per_session,
+        seed=args.seed,
+        chunk_rows=args.chunk_rows,
+    )
+    print(f"Wrote {written} keystrokes for {args.users} users to {args.output}")
@@ -1,7 +1,25 @@
 import os
 import json
+import logging
 import pandas as pd
 import numpy as np
+from features.compact_timings import compact_timing_unit, to_session_offsets
+from features.preprocessing import clean_keystrokes, normalize_keys
+from performance_evaluation.instrumentation import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Parsed compact format files keyed by (path, modification time, size, cleaning settings)
+_compact_format_cache = {}
+
+# The configuration of the cleaning done once at load time, see `clean_keystrokes`, and of the
+# compact timings the cleaned times are then turned into, see `to_session_offsets`
+CLEANING_CONFIG_KEYS = (
+    "clean_keystrokes",
+    "max_hold_time",
+    "max_flight_time",
+    "compact_timing_unit",
+)
 
 
 class Genders:
@@ -59,29 +77,236 @@ class Genders:
         return "other"
 
 
+# The self reported genders of the participants of our original 25 user study.
+# Used when no gender map is configured, restricted to the ids present in the data
+_STUDY_GENDERS = {
+    **{_id: Genders.MALE() for _id in [9, 12, 14, 15, 16, 17, 18, 20, 21, 26, 27]},
+    **{_id: Genders.FEMALE() for _id in [1, 3, 4, 5, 6, 8, 10, 11, 13, 19, 22, 23, 24]},
+    **{_id: Genders.OTHER() for _id in [2, 7, 25]},
+}
+
+# The column types of the compact format. The ids are wide enough for
+# synthetic datasets with far more than 255 users, platforms or sessions
+COMPACT_FORMAT_DTYPES = {
+    "key": str,
+    "press_time": np.float64,
+    "release_time": np.float64,
+    "platform_id": np.uint16,
+    "session_id": np.uint16,
+    "user_ids": np.uint32,
+}
+COMPACT_FORMAT_COLUMNS = list(COMPACT_FORMAT_DTYPES)
+
+
+def _load_config():
+    with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
+        return json.load(f)
+
+
+def dataset_path():
+    """
+    Returns:
+    - str: The compact format CSV to use, either the optional "dataset_path" from the
+      configuration file or dataset/cleansed_50.csv in the current working directory.
+    """
+    configured = _load_config().get("dataset_path")
+    if configured:
+        return os.path.join(os.getcwd(), configured)
+    return os.path.join(os.getcwd(), "dataset", "cleansed_50.csv")
+
+
+def cleaning_config(config=None):
+    """
+    Returns:
+    - dict: The settings of the cleaning done at load time, see `read_compact_format`.
+    """
+    if config is None:
+        config = _load_config()
+    return {key: config.get(key) for key in CLEANING_CONFIG_KEYS}
+
+
 def read_compact_format():
-    df = pd.read_csv(
-        os.path.join(os.getcwd(), "dataset", "cleansed_50.csv"),
-        dtype={
-            "key": str,
-            "press_time": np.float64,
-            "release_time": np.float64,
-            "platform_id": np.uint8,
-            "session_id": np.uint8,
-            "user_ids": np.uint8,
-        },
+    """
+    Read the compact keystroke CSV from the dataset directory.
+
+    Unless "clean_keystrokes" is turned off, the keystrokes are cleaned once here (see
+    `features.preprocessing.clean_keystrokes`) and what was removed is kept in
+    `df.attrs["cleaning_report"]`, so nothing downstream has to clean them again. With a
+    "compact_timing_unit", the press and release times are then int32 offsets from the start of
+    their session in that unit instead of float64 nanoseconds.
+
+    The parsed DataFrame is cached for as long as the file on disk does not change,
+    so callers must treat it as read-only and filter or copy it before mutating.
+
+    Returns:
+    - DataFrame: All keystrokes of the dataset.
+    """
+    path = dataset_path()
+    stat = os.stat(path)
+    config = _load_config()
+    cleaning = cleaning_config(config)
+    cache_key = (
+        path,
+        stat.st_mtime_ns,
+        stat.st_size,
+        tuple(sorted(cleaning.items())),
     )
+    df = _compact_format_cache.get(cache_key)
+    if df is not None:
+        instrumentation.cache_hit("compact_format")
+        return df
+    instrumentation.cache_miss("compact_format")
+    with instrumentation.stage("data_loading"):
+        df = read_compact_format_file(path)
+    with instrumentation.stage("data_cleaning"):
+        if cleaning["clean_keystrokes"] is False:
+            # The key labels are still normalized, which the feature extractors rely on
+            df["key"] = normalize_keys(df["key"])
+        else:
+            df, report = clean_keystrokes(df, config)
+            df.attrs["cleaning_report"] = report
+    unit = compact_timing_unit(config)
+    if unit:
+        with instrumentation.stage("timing_compaction"):
+            df = to_session_offsets(df, unit)
+    _compact_format_cache.clear()
+    _compact_format_cache[cache_key] = df
+    return df
+
+
+def read_compact_format_file(path):
+    """
+    Parse a compact format CSV without going through the cache.
+
+    Parameters:
+    - path (str): The CSV file to read.
+
+    Returns:
+    - DataFrame: All keystrokes in the file.
+    """
+    df = pd.read_csv(path, dtype=COMPACT_FORMAT_DTYPES)
     # print(df.head())
     return df
 
 
+def get_user_by_platform(user_id, platform_id, session_id=None):
+    """
+    Retrieve data for a given user and platform, with an optional session_id filter.
+
+    Parameters:
+    - user_id (int): Identifier for the user.
+    - platform_id (int or list[int]): Identifier for the platform.
+      If provided as a list, it should contain two integers specifying
+      an inclusive range to search between.
+    - session_id (int or list[int], optional): Identifier for the session.
+      If provided as a list, it can either specify an inclusive range with
+      two integers or provide multiple session IDs to filter by.
+
+    Returns:
+    - DataFrame: Filtered data matching the given criteria.
+
+    Notes:
+    - When providing a list for platform_id or session_id to specify a range,
+      the order of the two integers does not matter.
+    - When providing a list with more than two integers for session_id,
+      it will filter by those exact session IDs.
+
+    Raises:
+    - AssertionError: If platform_id or session_id list does not follow the expected format.
+
+    Examples:
+    >>> df = get_user_by_platform(123, 1)
+    >>> df = get_user_by_platform(123, [1, 5])
+    >>> df = get_user_by_platform(123, 1, [2, 6])
+    >>> df = get_user_by_platform(123, 1, [2, 3, 4])
+
+    """
+    # Get all of the data for a user amd platform with am optional session_id
+    df = read_compact_format()
+    with instrumentation.stage("slicing"):
+        return _slice_user_rows(df, user_id, platform_id, session_id)
+
+
+def _slice_user_rows(df, user_id, platform_id, session_id):
+    if session_id is None:
+        if isinstance(platform_id, list):
+            # Should only contain an inclusive range of the starting id and ending id
+            assert len(platform_id) == 2
+            low, high = min(platform_id), max(platform_id)
+            selected = df[
+                (df["user_ids"] == user_id) & (df["platform_id"].between(low, high))
+            ]
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "user_id: %s, platform range %s, sessions: %s",
+                    user_id,
+                    platform_id,
+                    set(selected["session_id"].unique().tolist()),
+                )
+            return selected
+
+        return df[(df["user_ids"] == user_id) & (df["platform_id"] == platform_id)]
+    if isinstance(session_id, list):
+        # Should only contain an inclusive range of the starting id and ending id
+        if len(session_id) == 2:
+            return df[
+                (df["user_ids"] == user_id)
+                & (df["platform_id"] == platform_id)
+                & (df["session_id"].between(session_id[0], session_id[1]))
+            ]
+        elif len(session_id) > 2:
+            return df[
+                (df["user_ids"] == user_id)
+                & (df["platform_id"] == platform_id)
+                & (df["session_id"].isin(session_id))
+            ]
+    return df[
+        (df["user_ids"] == user_id)
+        & (df["platform_id"] == platform_id)
+        & (df["session_id"] == session_id)
+    ]
+
+
+def user_genders():
+    """
+    Map every user id in the dataset to its gender category.
+
+    If the configuration file names a "gender_map_path" CSV (with the columns "user_ids" and "gender")
+    it is used, otherwise the genders of our original study are used. Users without a known
+    gender are left out.
+
+    Returns:
+    - dict[int, str]: The gender category of each user id present in the dataset.
+    """
+    ids = dataset_ids()
+    gender_map_path = _load_config().get("gender_map_path")
+    if gender_map_path:
+        mapping = pd.read_csv(os.path.join(os.getcwd(), gender_map_path))
+        genders = dict(
+            zip(mapping["user_ids"].astype(int), mapping["gender"].str.lower())
+        )
+    else:
+        genders = _STUDY_GENDERS
+    return {_id: genders[_id] for _id in ids if _id in genders}
+
+
+def dataset_ids():
+    """
+    Returns:
+    - list[int]: The sorted, distinct user ids present in the compact format dataset.
+    """
+    df = read_compact_format()
+    return sorted(int(_id) for _id in df["user_ids"].unique())
+
+
 def all_ids():
     """
     Retrieve a list of IDs based on the gender type specified in the configuration file.
 
     This function reads a configuration file named 'classifier_config.json' located in the current
     working directory. It then extracts the gender type from the file and returns a corresponding list
-    of IDs. The IDs are assigned based on predefined gender categories.
+    of IDs. The IDs are derived from the user ids present in the dataset; for a gender other than
+    "all" only the ids with that gender in `user_genders` are kept.
 
     Returns:
     - list[int]: A list of IDs corresponding to the specified gender type.
@@ -93,20 +318,15 @@ def all_ids():
     - The 'classifier_config.json' file should be present in the current working directory.
     - The file should contain a valid JSON structure with a 'gender' field.
     """
-    with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
-        config = json.load(f)
-    gender_type = str(config["gender"])
-    if gender_type.lower() == Genders.ALL().lower():
-        # df = read_compact_format()
-        # print(set(df["user_ids"].tolist()))
-        # input()
-        # return list(set(df["user_ids"].tolist()))
-        return [num for num in range(1, 26) if num != 22]
-    elif gender_type.lower() == Genders.MALE().lower():
-        return [9, 12, 14, 15, 16, 17, 18, 20, 21, 26, 27]
-    elif gender_type.lower() == Genders.FEMALE().lower():
-        return [1, 3, 4, 5, 6, 8, 10, 11, 13, 19, 22, 23, 24]
-    elif gender_type.lower() == Genders.OTHER().lower():
-        return [2, 7, 25]
+    config = _load_config()
+    gender_type = str(config["gender"]).lower()
+    if gender_type == Genders.ALL().lower():
+        return dataset_ids()
+    elif gender_type in (
+        Genders.MALE().lower(),
+        Genders.FEMALE().lower(),
+        Genders.OTHER().lower(),
+    ):
+        return [_id for _id, gender in user_genders().items() if gender == gender_type]
     else:
         raise ValueError(f"Unknown gender type {gender_type}")
@@ -0,0 +1,364 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import numpy as np
+from classifiers.prepared_templates import (
+    ARRAY_ALIGNMENT,
+    STATISTICS,
+    FeatureVocabulary,
+    PackedTemplates,
+    PreparedTemplate,
+    filter_outliers,
+    layout_arrays,
+    pack_templates,
+    sample_pattern,
+    view_arrays,
+)
+from features.compact_timings import value_dtype
+from performance_evaluation.instrumentation import instrumentation
+
+SNAPSHOT_VERSION = 1
+_MAGIC = b"KDSNAP\x00\x01"
+_HEADER_LENGTH = struct.Struct("<Q")
+# The configuration keys that change the prepared templates, and so invalidate a snapshot
+TEMPLATE_CONFIG_KEYS = (
+    "use_outlier_detection",
+    "outlier_detector",
+    "outlier_contamination",
+    "lof_n_neighbors",
+    "dbod_r",
+    "dbod_beta",
+    "quantile_sketch_k",
+    "max_samples_per_feature",
+    "sample_cap_strategy",
+    "feature_ranking_path",
+    "top_features",
+    "clean_keystrokes",
+    "max_hold_time",
+    "max_flight_time",
+    "compact_timing_unit",
+)
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def template_config(config):
+    """
+    Returns:
+    - dict: The configuration keys the prepared templates depend on and, when features are
+      selected from a ranking, the hash of the ranking file's content, so that re-ranking into
+      the same "feature_ranking_path" invalidates a snapshot as well.
+    """
+    relevant = {key: config.get(key) for key in TEMPLATE_CONFIG_KEYS}
+    path = config.get("feature_ranking_path")
+    if path and config.get("top_features"):
+        relevant["feature_ranking_sha256"] = _file_sha256(
+            os.path.join(os.getcwd(), path)
+        )
+    return relevant
+
+
+def config_fingerprint(config):
+    """
+    Returns:
+    - str: A hash of `template_config`.
+    """
+    return hashlib.sha256(
+        json.dumps(template_config(config), sort_keys=True).encode()
+    ).hexdigest()
+
+
+def dataset_fingerprint(path):
+    """
+    Returns:
+    - dict: The size, modification time and content hash of a dataset file.
+    """
+    stat = os.stat(path)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": _file_sha256(path),
+    }
+
+
+def matches_dataset(fingerprint, path):
+    """
+    Check whether a dataset file is the one a fingerprint was taken of.
+
+    The content is only hashed again when the size matches but the modification time does not,
+    so checking an untouched dataset costs a single stat.
+
+    Returns:
+    - bool: True if the file has the fingerprinted content.
+    """
+    stat = os.stat(path)
+    if stat.st_size != fingerprint["size"]:
+        return False
+    if stat.st_mtime_ns == fingerprint["mtime_ns"]:
+        return True
+    return _file_sha256(path) == fingerprint["sha256"]
+
+
+class TemplateSnapshot(PackedTemplates):
+    """
+    A versioned binary file with the prepared templates of many users, loaded with mmap so that a
+    verifier is ready to score without reading the dataset or extracting a single feature.
+
+    Besides the packed layout of `pack_templates` (the outlier filtered timings and every statistic
+    in STATISTICS), a snapshot holds the feature vocabulary, the raw timings of every feature and
+    the DBOD inlier mask over them. Its header records the dataset and the configuration it was
+    built from, and `load` rejects it when either has changed since.
+
+    File layout: an 8 byte magic, the little endian length of the JSON header, the header, then
+    the arrays, each aligned to ARRAY_ALIGNMENT bytes from the start of the data section.
+
+    Usage:
+    >>> TemplateSnapshot.write("enrollments.snap", templates, config, "dataset/cleansed_50.csv")
+    >>> snapshot = TemplateSnapshot.load("enrollments.snap", config, "dataset/cleansed_50.csv")
+    >>> enrollments = snapshot.templates()
+    """
+
+    def __init__(self, memory, header, arrays):
+        self.memory = memory
+        self.header = header
+        self.selector = header["selector"]
+        self.is_enrollment = header["is_enrollment"]
+        super().__init__(header["ids"], arrays)
+
+    @staticmethod
+    def write(path, templates, config, dataset, is_enrollment=True, selector=None):
+        """
+        Prepare templates and write them to a snapshot file, replacing any file at `path`.
+
+        Parameters:
+        - path (str): The snapshot file.
+        - templates (dict[int, dict]): The template of every user id, as produced by the feature extractors.
+        - config (dict): The classifier configuration, deciding whether outliers are removed.
+        - dataset (str): The compact format CSV the templates were extracted from.
+        - is_enrollment (bool): Whether the templates are used as enrollments or as probes.
+        - selector (dict, optional): How the templates were extracted (platform, session, KIT
+          flight, ...), stored for the readers of the snapshot.
+        """
+        vocabulary = FeatureVocabulary()
+        prepared = []
+        raw_values = []
+        dtype = value_dtype(config)
+        with instrumentation.stage("snapshot_preparation"):
+            for template in templates.values():
+                # Restricted and capped like `PreparedTemplate.from_pattern`, so a snapshot
+                # scores like templates prepared from the dataset
+                pattern, sample = sample_pattern(template, config)
+                filtered = filter_outliers(sample, is_enrollment, config)
+                prepared_template = PreparedTemplate.from_sample(
+                    pattern, sample, filtered, vocabulary, is_enrollment, config
+                )
+                prepared_template.prepare(STATISTICS)
+                prepared.append(prepared_template)
+                for feature_id in prepared_template.feature_ids:
+                    feature = vocabulary.names[feature_id]
+                    raw_values.append(
+                        (
+                            np.asarray(sample[feature], dtype=dtype),
+                            np.asarray(filtered.get(feature, []), dtype=dtype),
+                        )
+                    )
+        arrays = pack_templates(prepared, STATISTICS)
+        arrays["raw_offsets"] = np.concatenate(
+            [[0], np.cumsum([len(timings) for timings, _ in raw_values])]
+        ).astype(np.int64)
+        arrays["raw_values"] = (
+            np.concatenate([timings for timings, _ in raw_values])
+            if raw_values
+            else np.zeros(0, dtype)
+        )
+        # DBOD decides on a timing by its value alone, so a timing is an inlier iff its value is
+        arrays["inlier_mask"] = (
+            np.concatenate(
+                [np.isin(timings, inliers) for timings, inliers in raw_values]
+            )
+            if raw_values
+            else np.zeros(0, bool)
+        )
+        layout, size = layout_arrays(arrays)
+        header = json.dumps(
+            {
+                "version": SNAPSHOT_VERSION,
+                "dataset": dataset_fingerprint(dataset),
+                "config": config_fingerprint(config),
+                "template_config": template_config(config),
+                "is_enrollment": is_enrollment,
+                "selector": selector or {},
+                "ids": [int(user_id) for user_id in templates],
+                "vocabulary": vocabulary.names,
+                "statistics": list(STATISTICS),
+                "arrays": layout,
+            }
+        ).encode()
+        data_start = _data_start(len(header))
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(_MAGIC + _HEADER_LENGTH.pack(len(header)) + header)
+            for name, (offset, _, _) in layout.items():
+                f.seek(data_start + offset)
+                f.write(np.ascontiguousarray(arrays[name]).tobytes())
+            f.truncate(data_start + size)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path, config, dataset):
+        """
+        Map a snapshot file into memory, after checking that it is still valid.
+
+        Parameters:
+        - path (str): The snapshot file.
+        - config (dict): The current classifier configuration.
+        - dataset (str): The compact format CSV the snapshot must have been built from.
+
+        Returns:
+        - TemplateSnapshot: The snapshot, whose arrays are read-only views of the mapped file.
+
+        Raises:
+        - ValueError: If the file is not a snapshot, has another version, is truncated, or was
+          built from another dataset or configuration.
+        """
+        with instrumentation.stage("snapshot_loading"):
+            with open(path, "rb") as f:
+                memory = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            prefix_length = len(_MAGIC) + _HEADER_LENGTH.size
+            if len(memory) < prefix_length or memory[: len(_MAGIC)] != _MAGIC:
+                memory.close()
+                raise ValueError(f"{path} is not a template snapshot")
+            (header_length,) = _HEADER_LENGTH.unpack(
+                memory[len(_MAGIC) : prefix_length]
+            )
+            try:
+                header = json.loads(
+                    memory[prefix_length : prefix_length + header_length]
+                )
+            except ValueError:
+                memory.close()
+                raise ValueError(f"{path} has a corrupt header") from None
+            problem = _validate(header, header_length, len(memory), config, dataset)
+            if problem is not None:
+                memory.close()
+                raise ValueError(f"Template snapshot {path} {problem}")
+            data = memoryview(memory)[_data_start(header_length) :]
+            arrays = view_arrays(data, header["arrays"])
+        return cls(memory, header, arrays)
+
+    def vocabulary(self):
+        """
+        Returns:
+        - FeatureVocabulary: The vocabulary the feature ids of the snapshot refer to.
+        """
+        vocabulary = FeatureVocabulary()
+        for feature in self.header["vocabulary"]:
+            vocabulary.id_of(feature)
+        return vocabulary
+
+    def templates(self):
+        """
+        Returns:
+        - dict[int, PreparedTemplate]: A view of the prepared template of every user id.
+        """
+        return {user_id: self.template(index) for index, user_id in enumerate(self.ids)}
+
+    def raw_template(self, index):
+        """
+        Returns:
+        - tuple[dict, dict]: The raw timings of every feature of the index-th template (the
+          capped sample with "max_samples_per_feature"), and the DBOD inlier mask over them.
+        """
+        first_slot, last_slot = self.arrays["template_offsets"][[index, index + 1]]
+        names = self.header["vocabulary"]
+        raw_offsets = self.arrays["raw_offsets"]
+        timings, masks = {}, {}
+        for slot in range(first_slot, last_slot):
+            feature = names[self.arrays["feature_ids"][slot]]
+            start, stop = raw_offsets[slot], raw_offsets[slot + 1]
+            timings[feature] = self.arrays["raw_values"][start:stop]
+            masks[feature] = self.arrays["inlier_mask"][start:stop]
+        return timings, masks
+
+    def close(self):
+        """Unmap the file, invalidating all of the snapshot's views"""
+        self.arrays = {}
+        self.memory.close()
+
+
+def _data_start(header_length):
+    end = len(_MAGIC) + _HEADER_LENGTH.size + header_length
+    return -(-end // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+
+def _validate(header, header_length, file_size, config, dataset):
+    """The reason a snapshot cannot be used, or None"""
+    if header.get("version") != SNAPSHOT_VERSION:
+        return f"has version {header.get('version')}, expected {SNAPSHOT_VERSION}"
+    end = max(
+        (
+            offset + np.dtype(dtype).itemsize * int(np.prod(shape))
+            for offset, dtype, shape in header["arrays"].values()
+        ),
+        default=0,
+    )
+    if file_size < _data_start(header_length) + end:
+        return "is truncated"
+    if header["config"] != config_fingerprint(config):
+        built_with = header.get("template_config", {})
+        current = template_config(config)
+        changed = sorted(
+            key
+            for key in set(built_with) | set(current)
+            if built_with.get(key) != current.get(key)
+        )
+        if not built_with or not changed:
+            return "was built with other template settings"
+        return f"was built with other {', '.join(changed)} settings"
+    if not matches_dataset(header["dataset"], dataset):
+        return "was built from another dataset"
+    return None
+
+
+if __name__ == "__main__":
+    from classifiers.session_templates import session_templates
+    from classifiers.template_generator import all_ids, dataset_path
+    from classifiers.template_store import family_for_kit
+
+    parser = argparse.ArgumentParser(
+        description="Snapshot the combined KHT and KIT enrollment templates of the dataset"
+    )
+    parser.add_argument("path")
+    parser.add_argument("--platform", type=int, default=1)
+    parser.add_argument("--session", type=int)
+    parser.add_argument("--kit-feature-type", type=int, default=1)
+    args = parser.parse_args()
+    with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
+        config = json.load(f)
+    families = ["kht", family_for_kit(args.kit_feature_type)]
+    enrollments = {
+        user_id: session_templates().template(
+            user_id, args.platform, args.session, families
+        )
+        for user_id in all_ids()
+    }
+    TemplateSnapshot.write(
+        args.path,
+        enrollments,
+        config,
+        dataset_path(),
+        selector={
+            "platform_id": args.platform,
+            "session_id": args.session,
+            "kit_feature_type": args.kit_feature_type,
+        },
+    )
@@ -0,0 +1,381 @@
+import json
+import os
+import re
+import shutil
+from collections import OrderedDict, defaultdict
+import numpy as np
+import pandas as pd
+from classifiers.template_generator import COMPACT_FORMAT_DTYPES
+from features.keystroke_features import kht_samples, kit_samples
+from features.compact_timings import compact_timing_unit, to_compact_durations
+from features.preprocessing import clean_events, normalize_keys
+from performance_evaluation.instrumentation import instrumentation
+
+# The feature families kept for every (user, platform, session): the KHT and the four KIT flights
+TEMPLATE_FAMILIES = ["kht", "kit1", "kit2", "kit3", "kit4"]
+STORE_VERSION = 2
+
+# One spilled timing sample, tagged with everything needed to route it to its template
+_SPILL_DTYPE = np.dtype(
+    [
+        ("user", "<u4"),
+        ("platform", "<u2"),
+        ("session", "<u2"),
+        ("family", "u1"),
+        ("feature", "<u4"),
+        ("value", "<f8"),
+    ]
+)
+# The same with int32 compact timings, see `features.compact_timings`
+_COMPACT_SPILL_DTYPE = np.dtype(
+    [
+        ("user", "<u4"),
+        ("platform", "<u2"),
+        ("session", "<u2"),
+        ("family", "u1"),
+        ("feature", "<u4"),
+        ("value", "<i4"),
+    ]
+)
+
+
+def family_for_kit(kit_feature_type):
+    """
+    Returns:
+    - str: The template family holding the KIT flight `kit_feature_type` (1-4)
+    """
+    if not 1 <= kit_feature_type <= 4:
+        raise ValueError("KIT feature type must be between 1 and 4")
+    return f"kit{kit_feature_type}"
+
+
+def family_for_ngraph(n, min_count):
+    """
+    Returns:
+    - str: The template family holding the latencies of the n-graphs typed at least
+      `min_count` times in the dataset, e.g. "ngraph3_min5". Only `SessionTemplateCache`
+      extracts these families.
+    """
+    if n < 3:
+        raise ValueError("n-graphs must be at least trigraphs, digraphs are KIT")
+    return f"ngraph{n}_min{min_count}"
+
+
+def ngraph_family_parameters(family):
+    """
+    Returns:
+    - tuple[int, int] or None: The n and minimum count of an n-graph family, None for the other
+      families.
+    """
+    match = re.fullmatch(r"ngraph(\d+)_min(\d+)", family)
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def matches_selector(platform, session, platform_id, session_id=None):
+    """
+    Check whether a (platform, session) pair is selected by the platform and session arguments
+    of `get_user_by_platform`, with the same semantics.
+
+    Parameters:
+    - platform, session (int): The platform and session to check.
+    - platform_id (int or list[int]): A platform, or an inclusive range of two platforms in any order.
+    - session_id (int or list[int], optional): A session, an inclusive range of two sessions,
+      or a list of more than two sessions.
+
+    Returns:
+    - bool: True if the pair is selected.
+    """
+    if session_id is None:
+        if isinstance(platform_id, list):
+            assert len(platform_id) == 2
+            return min(platform_id) <= platform <= max(platform_id)
+        return platform == platform_id
+    if platform != platform_id:
+        return False
+    if isinstance(session_id, list):
+        if len(session_id) == 2:
+            return session_id[0] <= session <= session_id[1]
+        return session in session_id
+    return session == session_id
+
+
+class StreamingTemplateBuilder:
+    """
+    Builds the KHT and KIT templates of every (user, platform, session) of a compact format CSV
+    without ever holding the whole file, or all of its templates, in memory.
+
+    The CSV is read in chunks. The rows of each chunk are routed to their (user, platform, session)
+    and turned into timing samples, carrying the last keystroke of every session over to the next
+    chunk so that the KIT digraph straddling a chunk boundary is not lost. The samples are spilled
+    to disk in buckets of users, and finally every bucket is grouped into per-user template files
+    that `TemplateStore` loads lazily.
+
+    Every chunk gets the row by row part of the load time cleaning (`clean_events`) with the
+    cleaning settings of `config`. Sorting sessions and clipping flights need whole sessions and
+    are left to `read_compact_format`, so the CSV is expected to be sorted already. With a
+    "compact_timing_unit" in `config`, the samples are spilled and stored as int32 durations in
+    that unit, which halves the size of the store and of the templates loaded from it.
+
+    Usage:
+    >>> store = StreamingTemplateBuilder("dataset/cleansed_50.csv", "templates").build()
+    >>> template = store.template(1, 1, None, ["kht", "kit1"])
+    """
+
+    def __init__(
+        self,
+        csv_path,
+        store_path,
+        chunksize=1_000_000,
+        num_buckets=64,
+        config=None,
+    ):
+        self.csv_path = csv_path
+        self.config = config or {}
+        self.timing_unit = compact_timing_unit(self.config)
+        self.spill_dtype = _COMPACT_SPILL_DTYPE if self.timing_unit else _SPILL_DTYPE
+        self.store_path = store_path
+        self.chunksize = chunksize
+        self.num_buckets = num_buckets
+        self.vocabulary = {}
+        # (user, platform, session) -> (key, press_time, release_time) of its last keystroke so far
+        self.carries = {}
+
+    def _spill_path(self, bucket):
+        return os.path.join(self.store_path, "spill", f"{bucket}.bin")
+
+    def build(self):
+        """
+        Run the build, replacing any store previously written at `store_path`.
+
+        Returns:
+        - TemplateStore: The freshly written store.
+        """
+        if os.path.exists(self.store_path):
+            shutil.rmtree(self.store_path)
+        os.makedirs(os.path.join(self.store_path, "spill"))
+        os.makedirs(os.path.join(self.store_path, "users"))
+        for chunk in pd.read_csv(
+            self.csv_path, dtype=COMPACT_FORMAT_DTYPES, chunksize=self.chunksize
+        ):
+            with instrumentation.stage("data_cleaning"):
+                if self.config.get("clean_keystrokes") is False:
+                    chunk["key"] = normalize_keys(chunk["key"])
+                else:
+                    chunk, _ = clean_events(chunk, self.config)
+            with instrumentation.stage("template_routing"):
+                self._route(chunk)
+        user_ids = []
+        for bucket in range(self.num_buckets):
+            with instrumentation.stage("template_consolidation"):
+                user_ids.extend(self._consolidate(bucket))
+        shutil.rmtree(os.path.join(self.store_path, "spill"))
+        vocabulary = sorted(self.vocabulary, key=self.vocabulary.get)
+        with open(os.path.join(self.store_path, "manifest.json"), "w") as f:
+            json.dump(
+                {
+                    "version": STORE_VERSION,
+                    "source": os.path.abspath(self.csv_path),
+                    "families": TEMPLATE_FAMILIES,
+                    "timing_unit": self.timing_unit,
+                    "user_ids": sorted(user_ids),
+                    "vocabulary": vocabulary,
+                },
+                f,
+            )
+        return TemplateStore(self.store_path)
+
+    def _feature_ids(self, names):
+        unique_names, inverse = np.unique(names, return_inverse=True)
+        ids = np.empty(len(unique_names), dtype=np.uint32)
+        for index, name in enumerate(unique_names):
+            ids[index] = self.vocabulary.setdefault(name, len(self.vocabulary))
+        return ids[inverse]
+
+    def _route(self, chunk):
+        keys = chunk["key"].to_numpy(dtype=object)
+        press = chunk["press_time"].to_numpy(dtype=np.float64)
+        release = chunk["release_time"].to_numpy(dtype=np.float64)
+        records = []
+        groups = chunk.groupby(
+            ["user_ids", "platform_id", "session_id"], sort=False
+        ).indices
+        for atom, rows in groups.items():
+            atom = tuple(int(part) for part in atom)
+            atom_keys, atom_press, atom_release = keys[rows], press[rows], release[rows]
+            families = [kht_samples(atom_keys, atom_press, atom_release)]
+            carry = self.carries.get(atom)
+            if carry is not None:
+                atom_keys = np.concatenate([[carry[0]], atom_keys])
+                atom_press = np.concatenate([[carry[1]], atom_press])
+                atom_release = np.concatenate([[carry[2]], atom_release])
+            for kit_feature_type in range(1, 5):
+                families.append(
+                    kit_samples(atom_keys, atom_press, atom_release, kit_feature_type)
+                )
+            self.carries[atom] = (atom_keys[-1], atom_press[-1], atom_release[-1])
+            for family, (names, values) in enumerate(families):
+                if len(names) == 0:
+                    continue
+                part = np.empty(len(names), dtype=self.spill_dtype)
+                part["user"], part["platform"], part["session"] = atom
+                part["family"] = family
+                part["feature"] = self._feature_ids(names)
+                if self.timing_unit:
+                    values = to_compact_durations(values, self.timing_unit)
+                part["value"] = values
+                records.append(part)
+        if not records:
+            return
+        records = np.concatenate(records)
+        buckets = records["user"] % self.num_buckets
+        for bucket in np.unique(buckets):
+            with open(self._spill_path(bucket), "ab") as f:
+                records[buckets == bucket].tofile(f)
+
+    def _consolidate(self, bucket):
+        path = self._spill_path(bucket)
+        if not os.path.exists(path):
+            return []
+        records = np.fromfile(path, dtype=self.spill_dtype)
+        # lexsort is stable, so samples keep the order in which they were typed
+        records = records[
+            np.lexsort(
+                (
+                    records["feature"],
+                    records["family"],
+                    records["session"],
+                    records["platform"],
+                    records["user"],
+                )
+            )
+        ]
+        user_bounds = np.flatnonzero(np.diff(records["user"])) + 1
+        user_ids = []
+        for user_records in np.split(records, user_bounds):
+            user_id = int(user_records["user"][0])
+            entry_keys = np.stack(
+                [
+                    user_records["platform"],
+                    user_records["session"],
+                    user_records["family"],
+                    user_records["feature"],
+                ]
+            )
+            starts = np.concatenate(
+                [[0], np.flatnonzero(np.any(np.diff(entry_keys, axis=1), axis=0)) + 1]
+            )
+            np.savez(
+                os.path.join(self.store_path, "users", f"{user_id}.npz"),
+                platform=user_records["platform"][starts],
+                session=user_records["session"][starts],
+                family=user_records["family"][starts],
+                feature=user_records["feature"][starts],
+                offsets=np.append(starts, len(user_records)).astype(np.int64),
+                values=user_records["value"],
+            )
+            user_ids.append(user_id)
+        return user_ids
+
+
+class TemplateStore:
+    """
+    Read access to the per-user templates written by `StreamingTemplateBuilder`.
+
+    User files are only read when a template of that user is requested, and the most recently
+    used `cache_size` users are kept in memory.
+    """
+
+    def __init__(self, store_path, cache_size=1024):
+        self.store_path = store_path
+        self.cache_size = cache_size
+        with open(os.path.join(store_path, "manifest.json"), "r") as f:
+            manifest = json.load(f)
+        if manifest["version"] != STORE_VERSION:
+            raise ValueError(
+                f"Template store version {manifest['version']} is not supported"
+            )
+        self.source = manifest["source"]
+        self.families = manifest["families"]
+        # The unit of int32 compact timings, None for float64 nanoseconds
+        self.timing_unit = manifest.get("timing_unit")
+        self.vocabulary = manifest["vocabulary"]
+        self._user_ids = manifest["user_ids"]
+        self._loaded = OrderedDict()
+
+    def user_ids(self):
+        """
+        Returns:
+        - list[int]: The sorted ids of all users in the store.
+        """
+        return list(self._user_ids)
+
+    def _load_user(self, user_id):
+        atoms = self._loaded.get(user_id)
+        if atoms is not None:
+            instrumentation.cache_hit("template_store")
+            self._loaded.move_to_end(user_id)
+            return atoms
+        instrumentation.cache_miss("template_store")
+        atoms = defaultdict(lambda: defaultdict(dict))
+        path = os.path.join(self.store_path, "users", f"{user_id}.npz")
+        if os.path.exists(path):
+            with instrumentation.stage("template_store_loading"):
+                with np.load(path) as data:
+                    offsets = data["offsets"]
+                    values = data["values"]
+                    for index, (platform, session, family, feature) in enumerate(
+                        zip(
+                            data["platform"].tolist(),
+                            data["session"].tolist(),
+                            data["family"].tolist(),
+                            data["feature"].tolist(),
+                        )
+                    ):
+                        atoms[(platform, session)][self.families[family]][
+                            self.vocabulary[feature]
+                        ] = values[offsets[index] : offsets[index + 1]]
+        self._loaded[user_id] = atoms
+        if len(self._loaded) > self.cache_size:
+            self._loaded.popitem(last=False)
+        return atoms
+
+    def sessions(self, user_id):
+        """
+        Returns:
+        - list[tuple[int, int]]: The sorted (platform, session) pairs recorded for the user.
+        """
+        return sorted(self._load_user(user_id))
+
+    def template(self, user_id, platform_id, session_id=None, families=("kht",)):
+        """
+        Assemble the template of a user from the stored sessions matching the selector.
+
+        Parameters:
+        - user_id (int): The user.
+        - platform_id, session_id: A selector with the semantics of `get_user_by_platform`.
+        - families (list[str]): The template families to combine, e.g. ["kht", "kit1"].
+
+        Returns:
+        - dict: A defaultdict(list) mapping every feature to its samples, concatenated over the
+          selected sessions in (platform, session) order. KIT digraphs never span two sessions.
+          The samples of a store with compact timings are int32 arrays instead of lists.
+        """
+        atoms = self._load_user(user_id)
+        parts = defaultdict(list)
+        for platform, session in sorted(atoms):
+            if not matches_selector(platform, session, platform_id, session_id):
+                continue
+            for family in families:
+                for feature, values in atoms[(platform, session)][family].items():
+                    parts[feature].append(values)
+        template = defaultdict(list)
+        for feature, values in parts.items():
+            if self.timing_unit:
+                template[feature] = np.concatenate(values)
+            else:
+                template[feature] = [
+                    value for part in values for value in part.tolist()
+                ]
+        return template
@@ -0,0 +1,505 @@
+import enum
+import numpy as np
+from classifiers.prepared_templates import (
+    FeatureVocabulary,
+    PreparedTemplate,
+    TemplateBatch,
+    find_common_features,
+)
+from performance_evaluation.instrumentation import instrumentation
+
+# The feature selection thresholds of the enrollment and the probe that Verify defaults to
+DEFAULT_THRESHOLDS = (10, 10)
+
+
+class VerifierType(enum.Enum):
+    """Enum class representing the different types of verifiers available."""
+
+    RELATIVE = 1
+    SIMILARITY = 2
+    SIMILARITY_UNWEIGHTED = 3
+    ABSOLUTE = 4
+    ITAD = 5
+    COSINE = 6
+    SCALED_MANHATTAN = 7
+
+
+class Verifier:
+    """
+    The interface of a registered verifier.
+
+    A verifier declares the per-feature statistics it reads in `requires` (see
+    `classifiers.prepared_templates.STATISTICS`, plus "sorted" for sorted timings) and implements
+    `score_batch`, scoring one enrollment against a whole batch of probes at once. `score` scores a
+    single pair with the same kernel, so both always agree.
+
+    The scores follow the matching methods of `classifiers.verifiers_library.Verify`. Verifiers
+    that only read statistics and the (weighted) distribution of the enrollment timings can score
+    sketched enrollments (see `PreparedTemplate.from_sketches`), the others set `sketchable` False.
+    """
+
+    name = None
+    requires = frozenset()
+    sketchable = True
+
+    def score_batch(self, enrollment, batch, common):
+        """
+        Parameters:
+        - enrollment (PreparedTemplate): The enrollment, prepared with `requires`.
+        - batch (TemplateBatch): The probes, prepared with `requires`.
+        - common (CommonFeatures): The features the enrollment shares with every probe.
+
+        Returns:
+        - np.ndarray[float]: The score of the enrollment against every probe of the batch.
+        """
+        raise NotImplementedError
+
+    def score(self, enrollment, probe, config, thresholds=DEFAULT_THRESHOLDS):
+        """
+        Score a single pair of templates.
+
+        Parameters:
+        - enrollment, probe (dict): Templates mapping features to timings.
+        - config (dict): The classifier configuration.
+        - thresholds (tuple[int, int]): The feature selection thresholds of the enrollment and the probe.
+
+        Returns:
+        - float: The score.
+        """
+        return float(
+            score_matrix(self, [enrollment], [probe], config, thresholds)[0][0]
+        )
+
+
+_REGISTRY = {}
+
+
+def register_verifier(verifier_type):
+    """
+    Class decorator registering a `Verifier` implementation for a `VerifierType`.
+
+    Usage:
+    >>> @register_verifier(VerifierType.ABSOLUTE)
+    ... class AbsoluteVerifier(Verifier):
+    ...     ...
+    """
+
+    def decorator(cls):
+        instance = cls()
+        instance.name = verifier_type.name.lower()
+        _REGISTRY[verifier_type] = instance
+        return cls
+
+    return decorator
+
+
+def get_verifier(verifier_type):
+    """
+    Returns:
+    - Verifier: The verifier registered for `verifier_type`.
+
+    Raises:
+    - ValueError: If no verifier is registered for it.
+    """
+    try:
+        return _REGISTRY[verifier_type]
+    except KeyError:
+        raise ValueError("Unknown VerifierType {}".format(verifier_type)) from None
+
+
+def registered_verifier_types():
+    """
+    Returns:
+    - list[VerifierType]: The verifier types with a registered implementation.
+    """
+    return list(_REGISTRY)
+
+
+def _ratio(numerator, denominator):
+    """Element-wise numerator / denominator, with 0 wherever the denominator is 0"""
+    return np.divide(
+        numerator,
+        denominator,
+        out=np.zeros(len(denominator), dtype=np.float64),
+        where=denominator != 0,
+    )
+
+
+def _within_one_stdev(enrollment, batch, common):
+    """
+    For every shared entry, count the probe timings lying strictly within one standard deviation
+    of the enrollment median, as the Similarity verifiers do.
+
+    Returns:
+    - tuple[np.ndarray, np.ndarray]: The matching and the total number of probe timings per entry.
+    """
+    median = enrollment.statistics["median"][common.enrollment_position]
+    stdev = enrollment.statistics["stdev"][common.enrollment_position]
+    selected, entry = common.value_entries(batch)
+    values = batch.values[selected]
+    inside = (median[entry] - stdev[entry] < values) & (
+        values < median[entry] + stdev[entry]
+    )
+    matches = np.bincount(entry, weights=inside, minlength=len(common))
+    totals = batch.slot_count[common.slot]
+    return matches, totals
+
+
+def grouped_average_ranks(groups, values):
+    """
+    Rank values within their groups, from 0, giving tied values the average of their ranks so the
+    result does not depend on the order of the input.
+
+    Parameters:
+    - groups (np.ndarray[int]): The group of every value.
+    - values (np.ndarray[float]): The values to rank.
+
+    Returns:
+    - np.ndarray[float]: The rank of every value within its group.
+    """
+    groups = np.asarray(groups)
+    values = np.asarray(values)
+    ranks = np.zeros(len(values), dtype=np.float64)
+    if len(values) == 0:
+        return ranks
+    order = np.lexsort((values, groups))
+    sorted_groups, sorted_values = groups[order], values[order]
+    index = np.arange(len(values))
+    new_group = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]
+    new_run = new_group | np.r_[True, sorted_values[1:] != sorted_values[:-1]]
+    position = index - np.maximum.accumulate(np.where(new_group, index, 0))
+    run = np.cumsum(new_run) - 1
+    run_first = position[new_run]
+    run_length = np.bincount(run)
+    ranks[order] = run_first[run] + (run_length[run] - 1) / 2
+    return ranks
+
+
+def max_disorder(num_features):
+    """The largest possible disorder of num_features ranks, floor(n^2 / 2)"""
+    return np.asarray(num_features) ** 2 // 2
+
+
+@register_verifier(VerifierType.ABSOLUTE)
+class AbsoluteVerifier(Verifier):
+    """The share of common features whose medians are within a ratio of 1.5, see Verify.get_abs_match_score"""
+
+    requires = frozenset({"median"})
+
+    def score_batch(self, enrollment, batch, common):
+        enrollment_median = enrollment.statistics["median"][common.enrollment_position]
+        probe_median = batch.statistics["median"][common.slot]
+        smaller = np.minimum(enrollment_median, probe_median)
+        larger = np.maximum(enrollment_median, probe_median)
+        zero = smaller == 0
+        ratio = np.divide(larger, smaller, out=np.zeros_like(larger), where=~zero)
+        matches = common.per_template((ratio <= 1.5) & ~zero)
+        # A zero median anywhere makes the whole comparison score 0
+        has_zero = common.per_template(zero) > 0
+        scores = _ratio(matches, common.per_template())
+        scores[has_zero] = 0
+        return scores
+
+
+@register_verifier(VerifierType.SIMILARITY)
+class WeightedSimilarityVerifier(Verifier):
+    """The share of all probe timings within one stdev of the enrollment median, see Verify.get_weighted_similarity_score"""
+
+    requires = frozenset({"median", "stdev"})
+
+    def score_batch(self, enrollment, batch, common):
+        matches, totals = _within_one_stdev(enrollment, batch, common)
+        return _ratio(common.per_template(matches), common.per_template(totals))
+
+
+@register_verifier(VerifierType.SIMILARITY_UNWEIGHTED)
+class SimilarityVerifier(Verifier):
+    """The share of features with most probe timings within one stdev of the enrollment median, see Verify.get_similarity_score"""
+
+    requires = frozenset({"median", "stdev"})
+
+    def score_batch(self, enrollment, batch, common):
+        matches, totals = _within_one_stdev(enrollment, batch, common)
+        counted = totals > 0
+        key_matches = counted & (_ratio(matches, totals) > 0.5)
+        return _ratio(common.per_template(key_matches), common.per_template(counted))
+
+
+@register_verifier(VerifierType.RELATIVE)
+class RelativeVerifier(Verifier):
+    """
+    The R measure of Gunetti and Picardi: order the shared features by their median timing in
+    the enrollment and in the probe and score 1 minus the normalized disorder between the two
+    orderings, see Verify.get_relative_score
+    """
+
+    requires = frozenset({"median"})
+
+    def score_batch(self, enrollment, batch, common):
+        # Only features with timings on both sides have a median to order by
+        usable = (enrollment.counts[common.enrollment_position] > 0) & (
+            batch.slot_count[common.slot] > 0
+        )
+        template = common.template[usable]
+        enrollment_ranks = grouped_average_ranks(
+            template,
+            enrollment.statistics["median"][common.enrollment_position[usable]],
+        )
+        probe_ranks = grouped_average_ranks(
+            template, batch.statistics["median"][common.slot[usable]]
+        )
+        disorder = np.bincount(
+            template,
+            weights=np.abs(enrollment_ranks - probe_ranks),
+            minlength=len(batch),
+        )
+        maximum = max_disorder(np.bincount(template, minlength=len(batch)))
+        # Fewer than two shared features have no ordering to compare and score 0
+        scores = np.zeros(len(batch))
+        ordered = maximum > 0
+        scores[ordered] = 1 - disorder[ordered] / maximum[ordered]
+        return scores
+
+
+@register_verifier(VerifierType.ITAD)
+class ITADVerifier(Verifier):
+    """The mean ECDF based similarity of the probe timings to the enrollment, see Verify.itad_similarity"""
+
+    requires = frozenset({"median", "sorted"})
+
+    def score_batch(self, enrollment, batch, common):
+        # Features without any enrollment timing are skipped altogether
+        usable = enrollment.counts[common.enrollment_position] > 0
+        selected, entry = common.value_entries(batch)
+        keep = usable[entry]
+        selected, entry = selected[keep], entry[keep]
+        probe_values = batch.values[selected]
+        feature = common.enrollment_position[entry]
+
+        # Count the enrollment timings <= each probe timing within its feature by sorting both
+        # together, enrollment timings first on ties. A sketched enrollment timing counts for
+        # as many timings as it stands for.
+        sorted_values = enrollment.sorted_values()
+        weights = enrollment.value_weights()
+        enrollment_feature = np.repeat(np.arange(len(enrollment)), enrollment.counts)
+        all_features = np.concatenate([enrollment_feature, feature])
+        all_values = np.concatenate([sorted_values, probe_values])
+        is_probe = np.concatenate(
+            [np.zeros(len(sorted_values), bool), np.ones(len(probe_values), bool)]
+        )
+        all_weights = np.concatenate([weights, np.zeros(len(probe_values))])
+        order = np.lexsort((is_probe, all_values, all_features))
+        enrollment_seen = np.cumsum(all_weights[order])
+        feature_weights = np.bincount(
+            enrollment_feature, weights=weights, minlength=len(enrollment)
+        ).astype(np.float64)
+        feature_offsets = np.concatenate([[0.0], np.cumsum(feature_weights)])
+        probe_order = order[is_probe[order]] - len(sorted_values)
+        counts = np.empty(len(probe_values), dtype=np.float64)
+        counts[probe_order] = (
+            enrollment_seen[is_probe[order]] - feature_offsets[feature[probe_order]]
+        )
+
+        # Evaluate the ECDF exactly like classifiers.ecdf.ECDF does, via np.linspace(1 / n, 1, n)
+        n = feature_weights[feature]
+        step = np.divide(1 - 1 / n, n - 1, out=np.zeros_like(n), where=n > 1)
+        cdf = (counts - 1) * step + 1 / n
+        cdf[counts == n] = 1.0
+        cdf[counts == 0] = 0.0
+
+        median = enrollment.statistics["median"][feature]
+        similarity = np.where(probe_values <= median, cdf, 1 - cdf)
+        template = common.template[entry]
+        return _ratio(
+            np.bincount(template, weights=similarity, minlength=len(batch)),
+            np.bincount(template, minlength=len(batch)),
+        )
+
+
+@register_verifier(VerifierType.COSINE)
+class CosineVerifier(Verifier):
+    """The share of features whose zero padded timing sequences have a cosine similarity >= 0.7, see Verify.get_euclidean_knn_similarity"""
+
+    requires = frozenset({"norm"})
+    # The timing sequences are compared position by position, which a sketch does not keep
+    sketchable = False
+
+    def score_batch(self, enrollment, batch, common):
+        selected, entry = common.value_entries(batch)
+        rank = batch.value_rank[selected]
+        position = common.enrollment_position[entry]
+        # Zero padding means only the overlapping prefix of the two sequences contributes
+        overlapping = rank < enrollment.counts[position]
+        products = np.zeros(len(selected))
+        # Multiplied in float64, which float32 compact timings would lose precision in
+        products[overlapping] = np.multiply(
+            batch.values[selected[overlapping]],
+            enrollment.values[
+                enrollment.offsets[position[overlapping]] + rank[overlapping]
+            ],
+            dtype=np.float64,
+        )
+        dot = np.bincount(entry, weights=products, minlength=len(common))
+        norms = (
+            enrollment.statistics["norm"][common.enrollment_position]
+            * batch.statistics["norm"][common.slot]
+        )
+        similarity = _ratio(dot, norms)
+        both_empty = (enrollment.counts[common.enrollment_position] == 0) & (
+            batch.slot_count[common.slot] == 0
+        )
+        similarity[both_empty] = 1
+        matches = common.per_template(similarity >= 0.7)
+        return _ratio(matches, common.per_template())
+
+
+@register_verifier(VerifierType.SCALED_MANHATTAN)
+class ScaledManhattanVerifier(Verifier):
+    """
+    The scaled Manhattan distance of the probe timings to the enrollment means, turned into a
+    similarity as 1 / (1 + distance), see Verify.get_scaled_manhattan_similarity
+    """
+
+    requires = frozenset({"mean", "stdev"})
+
+    def score_batch(self, enrollment, batch, common):
+        mean = enrollment.statistics["mean"][common.enrollment_position]
+        stdev = enrollment.statistics["stdev"][common.enrollment_position]
+        # Features without enrollment timings, or without any spread, cannot scale a distance
+        usable = (enrollment.counts[common.enrollment_position] > 0) & (stdev > 0)
+        selected, entry = common.value_entries(batch)
+        keep = usable[entry]
+        selected, entry = selected[keep], entry[keep]
+        distances = np.abs(mean[entry] - batch.values[selected]) / stdev[entry]
+        template = common.template[entry]
+        compared = np.bincount(template, minlength=len(batch))
+        distance = _ratio(
+            np.bincount(template, weights=distances, minlength=len(batch)), compared
+        )
+        return np.where(compared > 0, 1 / (1 + distance), 0.0)
+
+
+def required_statistics(verifiers):
+    """
+    Returns:
+    - set[str]: The statistics any of the verifiers needs prepared.
+    """
+    required = set()
+    for verifier in verifiers:
+        required |= verifier.requires
+    return required
+
+
+class ProbeSet:
+    """
+    The probes of a matrix build (or of one tile of it), prepared once for one or more verifiers
+    so that any number of enrollments can then be scored against all of them with `score`.
+
+    Everything but the verifier kernels themselves (outlier filtering, statistics and common
+    feature selection) is shared by the verifiers, so scoring with several of them at once only
+    costs the extra kernels.
+
+    Usage:
+    >>> probes = ProbeSet([get_verifier(VerifierType.ITAD)], probe_templates, config)
+    >>> itad_scores = probes.score(enrollment_template)[0]
+    """
+
+    def __init__(
+        self, verifiers, probes, config, thresholds=DEFAULT_THRESHOLDS, vocabulary=None
+    ):
+        """
+        Parameters:
+        - verifiers (list[Verifier]): The verifiers to score with.
+        - probes (list[dict] or TemplateBatch): The probe templates, or an already prepared batch
+          of them indexed by `vocabulary`.
+        - config (dict): The classifier configuration.
+        - thresholds (tuple[int, int]): The feature selection thresholds of the enrollment and the probe.
+        - vocabulary (FeatureVocabulary, optional): The vocabulary to index templates with.
+        """
+        self.verifiers = list(verifiers)
+        self.config = config
+        self.thresholds = thresholds
+        self.required = required_statistics(self.verifiers)
+        self.vocabulary = FeatureVocabulary() if vocabulary is None else vocabulary
+        if isinstance(probes, TemplateBatch):
+            self.batch = probes
+        else:
+            self.batch = TemplateBatch(
+                [
+                    PreparedTemplate.from_pattern(probe, self.vocabulary, False, config)
+                    for probe in probes
+                ]
+            )
+        self.batch.prepare(self.required)
+
+    def __len__(self):
+        return len(self.batch)
+
+    def score(self, enrollment):
+        """
+        Parameters:
+        - enrollment (dict or PreparedTemplate): An enrollment template mapping features to
+          timings, or one already prepared in the enrollment role with the same vocabulary.
+
+        Returns:
+        - np.ndarray: The scores of the enrollment against every probe, one row per verifier.
+        """
+        if isinstance(enrollment, PreparedTemplate):
+            prepared = enrollment
+        else:
+            prepared = PreparedTemplate.from_pattern(
+                enrollment, self.vocabulary, True, self.config
+            )
+        prepared.prepare(self.required)
+        if prepared.weights is not None:
+            for verifier in self.verifiers:
+                if not verifier.sketchable:
+                    raise ValueError(
+                        f"The {verifier.name} verifier cannot score sketched enrollments"
+                    )
+        common = find_common_features(
+            prepared,
+            self.batch,
+            self.config["use_feature_selection"],
+            self.thresholds,
+        )
+        scores = np.zeros((len(self.verifiers), len(self.batch)))
+        for index, verifier in enumerate(self.verifiers):
+            with instrumentation.stage(f"verifier.{verifier.name}"):
+                scores[index] = verifier.score_batch(prepared, self.batch, common)
+        return scores
+
+
+def score_matrices(
+    verifiers, enrollments, probes, config, thresholds=DEFAULT_THRESHOLDS
+):
+    """
+    Score every enrollment template against every probe template with the batched kernels of
+    several verifiers at once.
+
+    Every template is outlier filtered and summarized once, instead of once per pair and verifier.
+
+    Parameters:
+    - verifiers (list[Verifier]): The verifiers.
+    - enrollments, probes (list[dict]): Templates mapping features to timings.
+    - config (dict): The classifier configuration.
+    - thresholds (tuple[int, int]): The feature selection thresholds of the enrollment and the probe.
+
+    Returns:
+    - np.ndarray: The verifier x enrollment x probe scores.
+    """
+    probe_set = ProbeSet(verifiers, probes, config, thresholds)
+    matrices = np.zeros((len(probe_set.verifiers), len(enrollments), len(probes)))
+    for row, enrollment in enumerate(enrollments):
+        matrices[:, row] = probe_set.score(enrollment)
+    return matrices
+
+
+def score_matrix(verifier, enrollments, probes, config, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Score every enrollment template against every probe template with a verifier's batched kernel.
+
+    Returns:
+    - np.ndarray: The enrollment x probe scores.
+    """
+    return score_matrices([verifier], enrollments, probes, config, thresholds)[0]
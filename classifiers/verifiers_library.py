@@ -3,31 +3,43 @@ import statistics
 import json
 from classifiers.dbod import DistanceBasedKeystrokeFeatureOutlierDetector
 from classifiers.ecdf import ECDF
+from classifiers.feature_ranking import selected_features
+from classifiers.verifier_registry import grouped_average_ranks, max_disorder
+from features.compact_timings import timing_lists
+from performance_evaluation.instrumentation import instrumentation
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 
 
 def cosine_similarity_with_padding(s1, s2):
+    """
+    The cosine similarity of two timing sequences, the shorter one padded with zeros.
+
+    Returns:
+    - float: 1 if both sequences are empty, 0 if either one is all zeros (or empty).
+    """
     if len(s1) == 0 and len(s2) == 0:
         return 1
-    s1 = np.array(s1)
-    s2 = np.array(s2)
-    # Determine the length of the longer sequence
-    max_len = max(len(s1), len(s2))
-
-    # Pad the shorter sequence with zeros (or you could use np.nan or the mean of the sequence)
-    if len(s1) < max_len:
-        s1 = np.pad(s1, (0, max_len - len(s1)), "constant")
-    if len(s2) < max_len:
-        s2 = np.pad(s2, (0, max_len - len(s2)), "constant")
+    s1 = np.asarray(s1, dtype=np.float64)
+    s2 = np.asarray(s2, dtype=np.float64)
+    norms = np.sqrt(np.dot(s1, s1)) * np.sqrt(np.dot(s2, s2))
+    if norms == 0:
+        return 0.0
+    # Zero padding means only the overlapping prefix contributes to the dot product
+    overlap = min(len(s1), len(s2))
+    return float(np.dot(s1[:overlap], s2[:overlap]) / norms)
 
-    # Reshape both sequences to be 2D arrays (required for sklearn cosine_similarity)
-    s1 = s1.reshape(1, -1)
-    s2 = s2.reshape(1, -1)
 
-    # Compute and return the cosine similarity
-    similarity = cosine_similarity(s1, s2)[0][0]
-    return similarity
+def _fallback_stdev(timings):
+    """
+    The sample standard deviation of some timings. A single timing uses a quarter of itself as
+    its spread, and no timings at all have a spread of 0.
+    """
+    try:
+        return statistics.stdev(timings)
+    except statistics.StatisticsError:
+        if len(timings) == 1:
+            return timings[0] / 4
+        return 0
 
 
 class Verify:
@@ -43,6 +55,8 @@ class Verify:
         # feature names could also mean pair of letters for KIT or diagraphs
         # feature names could also mean pair of sequence of three letters for trigraphs
         # feature names can be extended to any features that we can extract from keystrokes
+        # The statistics module cannot compute over numpy int32 compact timings
+        p1, p2 = timing_lists(p1), timing_lists(p2)
         self.pattern1 = p1
         self.pattern2 = p2
         self.pattern1threshold = (
@@ -54,25 +68,34 @@ class Verify:
         with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
             config = json.load(f)
         self.common_features = []
-        if config["use_feature_selection"]:
-            for feature in self.pattern1.keys():
-                if feature in self.pattern2.keys():
-                    if (
-                        len(self.pattern1[feature]) >= self.pattern1threshold
-                        and len(self.pattern2[feature]) >= self.pattern2threshold
-                    ):
-                        self.common_features.append(feature)
-        else:
-            self.common_features = set(self.pattern1.keys()).intersection(
-                set(self.pattern2.keys())
-            )
+        with instrumentation.stage("common_feature_selection"):
+            if config["use_feature_selection"]:
+                for feature in self.pattern1.keys():
+                    if feature in self.pattern2.keys():
+                        if (
+                            len(self.pattern1[feature]) >= self.pattern1threshold
+                            and len(self.pattern2[feature]) >= self.pattern2threshold
+                        ):
+                            self.common_features.append(feature)
+            else:
+                self.common_features = set(self.pattern1.keys()).intersection(
+                    set(self.pattern2.keys())
+                )
+        # Only the top ranked features, when a feature ranking is configured
+        selected = selected_features(config)
+        if selected is not None:
+            self.common_features = [
+                feature for feature in self.common_features if feature in selected
+            ]
+        instrumentation.count("common_features", len(self.common_features))
         if config["print_feature_distribution"]:
             self.write_feature_pattern_distribution("FI_feat_pattern_dist.txt")
         if config["use_outlier_detection"]:
-            outlier_detector = DistanceBasedKeystrokeFeatureOutlierDetector(
-                self.common_features, p1, p2
-            )
-            self.pattern1, self.pattern2 = outlier_detector.find_inliers()
+            with instrumentation.stage("outlier_filtering"):
+                outlier_detector = DistanceBasedKeystrokeFeatureOutlierDetector(
+                    self.common_features, p1, p2
+                )
+                self.pattern1, self.pattern2 = outlier_detector.find_inliers()
 
         # print(f"comparing {len(self.common_features)} common_features")
 
@@ -136,6 +159,39 @@ class Verify:
                 matches += 1
         return matches / len(self.common_features)
 
+    def get_relative_score(self):  # R verifier
+        """
+        Computes the relative (R) score between two patterns based on their common features.
+
+        The common features are ranked by their median time in each pattern, tied medians sharing
+        the average of their ranks. The disorder is the sum of the differences between the two
+        ranks of every feature, and the score is 1 minus the disorder normalized by the largest
+        possible disorder, so identical orderings score 1 and reversed orderings score 0.
+
+        Returns:
+        - float: The relative score.
+
+        Notes:
+        Only features with time values in both patterns are ranked. With fewer than two such
+        features there is no ordering to compare and the function returns a score of 0.
+        """
+        features = [
+            feature
+            for feature in self.common_features
+            if len(self.pattern1[feature]) > 0 and len(self.pattern2[feature]) > 0
+        ]
+        if len(features) < 2:
+            return 0
+        groups = np.zeros(len(features), dtype=np.int64)
+        pattern1_ranks = grouped_average_ranks(
+            groups, [statistics.median(self.pattern1[feature]) for feature in features]
+        )
+        pattern2_ranks = grouped_average_ranks(
+            groups, [statistics.median(self.pattern2[feature]) for feature in features]
+        )
+        disorder = np.sum(np.abs(pattern1_ranks - pattern2_ranks))
+        return float(1 - disorder / max_disorder(len(features)))
+
     def get_similarity_score(self):  # S verifier, each key same weight
         """
         Computes the similarity score between two patterns based on their common features.
@@ -170,18 +226,7 @@ class Verify:
                 pattern1_median = statistics.median(list(self.pattern1[feature]))
             except statistics.StatisticsError:
                 pattern1_median = 0
-            try:
-                pattern1_stdev = statistics.stdev(self.pattern1[feature])
-            except statistics.StatisticsError:
-                print("In error: ", self.pattern1[feature])
-                if len(self.pattern1[feature]) == 1:
-                    pattern1_stdev = self.pattern1[feature][0] / 4
-                elif len(self.pattern1[feature]) == 0:
-                    pattern1_stdev = 0
-                else:
-                    pattern1_stdev = (
-                        self.pattern1[feature] / 4
-                    )  # this will always be one value that is when exception would occur
+            pattern1_stdev = _fallback_stdev(self.pattern1[feature])
 
             value_matches, total_values = 0, 0
             for time in self.pattern2[feature]:
@@ -196,6 +241,8 @@ class Verify:
                 key_matches += 1
             total_features += 1
 
+        if total_features == 0:
+            return 0
         return key_matches / total_features
 
     def get_weighted_similarity_score(
@@ -236,18 +283,8 @@ class Verify:
             try:
                 enroll_mean = statistics.median(list(self.pattern1[feature]))
             except statistics.StatisticsError:
-                print("In bad median case")
                 enroll_mean = 0
-            try:
-                template_stdev = statistics.stdev(self.pattern1[feature])
-            except statistics.StatisticsError:
-                # print("In error: ", self.pattern1[feature], len(self.pattern1[feature]))
-                if len(self.pattern1[feature]) == 1:
-                    template_stdev = self.pattern1[feature][0] / 4
-                elif len(self.pattern1[feature]) == 0:
-                    template_stdev = 0
-                else:
-                    template_stdev = self.pattern1[feature] / 4
+            template_stdev = _fallback_stdev(self.pattern1[feature])
 
             for time in self.pattern2[feature]:
                 if (enroll_mean - template_stdev) < time and time < (
@@ -255,6 +292,8 @@ class Verify:
                 ):
                     matches += 1
                 total += 1
+        if total == 0:
+            return 0
         return matches / total
 
     def get_cdf_xi(self, distribution, sample):
@@ -311,8 +350,33 @@ class Verify:
                     similarities.append(
                         1 - self.get_cdf_xi(self.pattern1[feature], x_i)
                     )
+        if len(similarities) == 0:
+            return 0
         return statistics.mean(similarities)
 
+    def _scaled_manhattan_terms(self):
+        """
+        The sum of the scaled distances of every pattern 2 value to the mean of its feature in
+        pattern 1, and the number of values compared.
+
+        Features without pattern 1 values are skipped, a single pattern 1 value uses a quarter of
+        itself as the standard deviation (like the similarity verifiers), and features whose
+        pattern 1 values have no spread at all are skipped since they cannot scale a distance.
+        """
+        grand_sum = 0
+        number_of_instances_compared = 0
+        for feature in self.common_features:
+            if len(self.pattern1[feature]) == 0:
+                continue
+            mu_g = statistics.mean(self.pattern1[feature])
+            std_g = _fallback_stdev(self.pattern1[feature])
+            if std_g <= 0:
+                continue
+            for x_i in self.pattern2[feature]:
+                grand_sum = grand_sum + abs(mu_g - x_i) / std_g
+                number_of_instances_compared = number_of_instances_compared + 1
+        return grand_sum, number_of_instances_compared
+
     def scaled_manhattan_distance(self):
         """
         Computes the Scaled Manhattan Distance between two typing patterns based on their shared features.
@@ -330,44 +394,44 @@ class Verify:
         Returns:
         - float: The averaged scaled manhattan distance for all shared features.
 
+        Notes:
+        If no values can be compared (see `_scaled_manhattan_terms`), the function returns 0.
         """
-        if (
-            len(self.common_features) == 0
-        ):  # this needs to be checked further when and why and for which users or cases it might hapens at all
-            # print("dig deeper: there is no common feature to match!")
+        grand_sum, number_of_instances_compared = self._scaled_manhattan_terms()
+        if number_of_instances_compared == 0:
             return 0
-        grand_sum = 0
-        number_of_instances_compared = 0
-        for feature in self.common_features:
-            # print('comparing the feature:', feature)
-            mu_g = statistics.mean(self.pattern1[feature])
-            std_g = statistics.stdev(self.pattern1[feature])
-            # print(f'mu_g:{mu_g}, and std_g:{std_g}')
-            for x_i in self.pattern2[feature]:
-                # print('x_i:', x_i)
-                current_dist = abs(mu_g - x_i) / std_g
-                # print('current_dist:', current_dist)
-                grand_sum = grand_sum + current_dist
-                # print('grand_sum:', grand_sum)
-                number_of_instances_compared = number_of_instances_compared + 1
-        # print('number_of_instances_compared', number_of_instances_compared)
         return grand_sum / number_of_instances_compared
 
+    def get_scaled_manhattan_similarity(self):
+        """
+        Turns the scaled manhattan distance into a similarity score, 1 / (1 + distance), so that
+        higher is better like the other verifiers.
+
+        Returns:
+        - float: The similarity, between 0 and 1. It is 0 if no values could be compared.
+        """
+        grand_sum, number_of_instances_compared = self._scaled_manhattan_terms()
+        if number_of_instances_compared == 0:
+            return 0
+        return 1 / (1 + grand_sum / number_of_instances_compared)
+
     def get_euclidean_knn_similarity(self):
+        """
+        Computes the share of common features whose timing sequences in both patterns have a
+        cosine similarity of at least 0.7, the shorter sequence being padded with zeros.
+
+        Returns:
+        - float: The ratio of matched features to total common features, 0 without common features.
+        """
         if len(self.common_features) == 0:  # if there exist no common features,
             return 0
             # raise ValueError("No common features to compare!")
         matches, total = 0, 0
         for feature in self.common_features:
-            print("Probe:")
-            probe = self.pattern2[feature]
-            print(probe)
-            print("Enrollment:")
-            enroll = self.pattern1[feature]
-            print(enroll)
-            distance = cosine_similarity_with_padding(enroll, probe)
-            print(distance)
-            if distance >= 0.7:
+            similarity = cosine_similarity_with_padding(
+                self.pattern1[feature], self.pattern2[feature]
+            )
+            if similarity >= 0.7:
                 matches += 1
             total += 1
         return matches / total
@@ -8,11 +8,30 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 from sklearn.metrics import top_k_accuracy_score
 from classifiers.template_generator import Genders, all_ids
+from experiments import scenario_name
 from performance_evaluation.heatmap import HeatMap, VerifierType
+from performance_evaluation.results_store import ResultsStore
 from tabulate import tabulate
 
 
-def six_fold_validation(platform, ids, verifier_type: VerifierType):
+def cross_validation_scenario(platform, gender=Genders.ALL()):
+    """
+    Returns:
+    - str: The results store scenario of the cross validation of a platform, e.g. "F-CV" (for
+      Facebook), or "F-CV-male" for the users of one gender.
+    """
+    scenario = f"{scenario_name(platform)}-CV"
+    return scenario if gender == Genders.ALL() else f"{scenario}-{gender}"
+
+
+def six_fold_validation(
+    platform, ids, verifier_type: VerifierType, run=None, gender=Genders.ALL()
+):
+    """
+    The mean top-1..4 accuracy of a verifier over six session folds of a platform, recording
+    the accuracy of every fold and k into a results store run under the scenario of
+    `cross_validation_scenario` when given.
+    """
     heatmap = HeatMap(verifier_type)
     cv = []
 
@@ -26,13 +45,23 @@ def six_fold_validation(platform, ids, verifier_type: VerifierType):
         (platform, platform, [1, 2, 3, 4, 6], 5),
     ]
 
-    for config in configurations:
+    for fold, config in enumerate(configurations, start=1):
         platform, session, key_order, user = config
         matrix = heatmap.combined_keystroke_matrix(
             platform, session, key_order, user, 1
         )
-        for i in range(1, 5):
-            cv.append(top_k_accuracy_score(np.array(ids), np.array(matrix), k=i))
+        accuracies = [
+            top_k_accuracy_score(np.array(ids), np.array(matrix), k=i)
+            for i in range(1, 5)
+        ]
+        cv.extend(accuracies)
+        if run is not None:
+            run.record_top_k(
+                cross_validation_scenario(platform, gender),
+                accuracies,
+                verifier=verifier_type.name.lower(),
+                fold=fold,
+            )
 
     return statistics.mean(cv)
 
@@ -50,30 +79,30 @@ def heatmap_table(matrix):
     plt.savefig("cross_validation.png")
 
 
-def make_validation_matrix(id_set):
+def make_validation_matrix(id_set, run=None, gender=Genders.ALL()):
     rows = []
     rows.append(
         [
             "Facebook",
-            six_fold_validation(1, id_set, VerifierType.ITAD),
-            six_fold_validation(1, id_set, VerifierType.SIMILARITY),
-            six_fold_validation(1, id_set, VerifierType.ABSOLUTE),
+            six_fold_validation(1, id_set, VerifierType.ITAD, run, gender),
+            six_fold_validation(1, id_set, VerifierType.SIMILARITY, run, gender),
+            six_fold_validation(1, id_set, VerifierType.ABSOLUTE, run, gender),
         ]
     )
     rows.append(
         [
             "Instagram",
-            six_fold_validation(2, id_set, VerifierType.ITAD),
-            six_fold_validation(2, id_set, VerifierType.SIMILARITY),
-            six_fold_validation(2, id_set, VerifierType.ABSOLUTE),
+            six_fold_validation(2, id_set, VerifierType.ITAD, run, gender),
+            six_fold_validation(2, id_set, VerifierType.SIMILARITY, run, gender),
+            six_fold_validation(2, id_set, VerifierType.ABSOLUTE, run, gender),
         ]
     )
     rows.append(
         [
             "Twitter",
-            six_fold_validation(3, id_set, VerifierType.ITAD),
-            six_fold_validation(3, id_set, VerifierType.SIMILARITY),
-            six_fold_validation(3, id_set, VerifierType.ABSOLUTE),
+            six_fold_validation(3, id_set, VerifierType.ITAD, run, gender),
+            six_fold_validation(3, id_set, VerifierType.SIMILARITY, run, gender),
+            six_fold_validation(3, id_set, VerifierType.ABSOLUTE, run, gender),
         ]
     )
     return rows
@@ -84,12 +113,17 @@ def main():
     with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
         config = json.load(f)
     gender = str(config["gender"])
+    store = ResultsStore()
+    # Only record a run when the matrix is computed, not when it is read from the cache
+    title = f"six fold cross validation ({gender})"
     if gender == Genders.ALL():
         if os.path.exists("all_cross_validation.obj"):
             with open("all_fs_cross_validation.obj", "rb") as f:
                 rows = pickle.load(f)
         else:
-            rows = make_validation_matrix(id_set)
+            rows = make_validation_matrix(
+                id_set, store.start_run(title, config), gender
+            )
             with open("all_cross_validation.obj", "wb") as f:
                 pickle.dump(rows, f)
     elif gender == Genders.MALE():
@@ -97,7 +131,9 @@ def main():
             with open("male_fs_cross_validation.obj", "rb") as f:
                 rows = pickle.load(f)
         else:
-            rows = make_validation_matrix(id_set)
+            rows = make_validation_matrix(
+                id_set, store.start_run(title, config), gender
+            )
             with open("male_fs_cross_validation.obj", "wb") as f:
                 pickle.dump(rows, f)
     elif gender == Genders.FEMALE():
@@ -105,7 +141,9 @@ def main():
             with open("female_fs_cross_validation.obj", "rb") as f:
                 rows = pickle.load(f)
         else:
-            rows = make_validation_matrix(id_set)
+            rows = make_validation_matrix(
+                id_set, store.start_run(title, config), gender
+            )
             with open("female_fs_cross_validation.obj", "wb") as f:
                 pickle.dump(rows, f)
     elif gender == Genders.OTHER():
@@ -113,7 +151,9 @@ def main():
             with open("other_cross_validation.obj", "rb") as f:
                 rows = pickle.load(f)
         else:
-            rows = make_validation_matrix(id_set)
+            rows = make_validation_matrix(
+                id_set, store.start_run(title, config), gender
+            )
             with open("other_cross_validation.obj", "wb") as f:
                 pickle.dump(rows, f)
 
@@ -122,6 +162,7 @@ def main():
     )
     heatmap_table(rows)
     print(table)
+    store.close()
 
 
 if __name__ == "__main__":
@@ -1,41 +1,189 @@
+import json
 import math
+import os
 from decimal import Decimal, ROUND_HALF_UP
-from classifiers.template_generator import read_compact_format
+import numpy as np
+from classifiers.template_generator import (
+    cleaning_config,
+    dataset_path,
+    read_compact_format,
+)
+from classifiers.template_snapshot import dataset_fingerprint, matches_dataset
 from tabulate import tabulate
 
+REPORT_VERSION = 2
+# The percentiles of the KHT and KIT timing distributions kept in the report
+SUMMARY_PERCENTILES = (5, 25, 50, 75, 95)
+
 
 def force_round_up(value):
     return Decimal(value).to_integral_value(rounding=ROUND_HALF_UP)
 
 
-def mean_samples_for_user(user_id):
+def report_path():
+    """
+    Returns:
+    - str: Where the statistics report of the configured dataset is cached, next to the dataset.
+    """
+    return dataset_path() + ".stats.json"
+
+
+def _counts(values):
+    unique, counts = np.unique(values, return_counts=True)
+    return {str(value): int(count) for value, count in zip(unique.tolist(), counts)}
+
+
+def _summary(timings):
+    """The count, mean, standard deviation, extremes and percentiles of some timings"""
+    if len(timings) == 0:
+        return {"count": 0}
+    percentiles = np.percentile(timings, SUMMARY_PERCENTILES)
+    return {
+        "count": int(len(timings)),
+        "mean": float(np.mean(timings)),
+        "stdev": float(np.std(timings, ddof=1)) if len(timings) > 1 else 0.0,
+        "min": float(np.min(timings)),
+        "max": float(np.max(timings)),
+        **{f"p{q}": float(value) for q, value in zip(SUMMARY_PERCENTILES, percentiles)},
+    }
+
+
+def compute_report(df):
+    """
+    Compute the statistics of a compact format dataset in one pass over its columns.
+
+    Keystrokes are counted per user, platform, session and (user, platform, session), features
+    per KHT key and KIT digraph, and the KHT and KIT (flights 1-4) timings are summarized
+    overall and per platform. Like the templates, KIT digraphs never span two sessions.
+
+    Parameters:
+    - df (DataFrame): The keystrokes, see `read_compact_format`.
+
+    Returns:
+    - dict: The JSON serializable report, with every id as a string key.
+    """
+    users = df["user_ids"].to_numpy()
+    platforms = df["platform_id"].to_numpy()
+    sessions = df["session_id"].to_numpy()
+    keys = df["key"].to_numpy(dtype=object)
+    press = df["press_time"].to_numpy(dtype=np.float64)
+    release = df["release_time"].to_numpy(dtype=np.float64)
+    # A stable sort keeps the typing order within every session
+    order = np.lexsort((sessions, platforms, users))
+    users, platforms, sessions = users[order], platforms[order], sessions[order]
+    keys, press, release = keys[order], press[order], release[order]
+    same_session = (
+        (users[1:] == users[:-1])
+        & (platforms[1:] == platforms[:-1])
+        & (sessions[1:] == sessions[:-1])
+    )
+    atom_starts = np.concatenate([[0], np.flatnonzero(~same_session) + 1])
+    atom_sizes = np.diff(np.append(atom_starts, len(users)))
+    flights = {
+        "kht": release - press,
+        "kit1": (press[1:] - release[:-1])[same_session],
+        "kit2": (release[1:] - release[:-1])[same_session],
+        "kit3": (press[1:] - press[:-1])[same_session],
+        "kit4": (release[1:] - press[:-1])[same_session],
+    }
+    flight_platforms = {
+        family: platforms if family == "kht" else platforms[1:][same_session]
+        for family in flights
+    }
+    digraphs = (keys[:-1] + keys[1:])[same_session] if len(keys) else keys
+    return {
+        "version": REPORT_VERSION,
+        "keystrokes": int(len(users)),
+        "users": _counts(users),
+        "platforms": _counts(platforms),
+        "sessions": _counts(sessions),
+        "user_platform_sessions": (
+            [
+                [
+                    int(users[start]),
+                    int(platforms[start]),
+                    int(sessions[start]),
+                    int(size),
+                ]
+                for start, size in zip(atom_starts.tolist(), atom_sizes.tolist())
+            ]
+            if len(users)
+            else []
+        ),
+        "features": {"kht": _counts(keys), "kit": _counts(digraphs)},
+        "timings": {family: _summary(values) for family, values in flights.items()},
+        "timings_per_platform": {
+            str(platform): {
+                family: _summary(values[flight_platforms[family] == platform])
+                for family, values in flights.items()
+            }
+            for platform in np.unique(platforms).tolist()
+        },
+    }
+
+
+def dataset_report(refresh=False):
+    """
+    The statistics report of the configured dataset, read from its cache when neither the dataset
+    nor the cleaning settings have changed since it was written, and computed and cached
+    otherwise. It includes what the cleaning at load time removed.
+
+    Parameters:
+    - refresh (bool): Recompute the report even if the cached one is up to date.
+
+    Returns:
+    - dict: The report, see `compute_report`.
+    """
+    path = report_path()
+    if not refresh and os.path.exists(path):
+        with open(path, "r") as f:
+            report = json.load(f)
+        if (
+            report.get("version") == REPORT_VERSION
+            and report.get("cleaning") == cleaning_config()
+            and matches_dataset(report["dataset"], dataset_path())
+        ):
+            return report
     df = read_compact_format()
+    report = {
+        "dataset": dataset_fingerprint(dataset_path()),
+        "cleaning": cleaning_config(),
+        "cleaning_report": df.attrs.get("cleaning_report"),
+        **compute_report(df),
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1)
+    return report
+
+
+def mean_samples_for_user(user_id, report=None):
+    report = dataset_report() if report is None else report
     # A "keystroke" is a press and release event together, so we want to divide
     # final answer by 2 because we get both press and release events
-    return math.ceil(len(df[df["user_ids"] == user_id]) / 3) / 2
+    return math.ceil(report["users"].get(str(user_id), 0) / 3) / 2
 
 
-def mean_samples_for_platform(platform):
-    df = read_compact_format()
+def mean_samples_for_platform(platform, report=None):
+    report = dataset_report() if report is None else report
     # A "keystroke" is a press and release event together, so we want to divide
     # final answer by 2 because we get both press and release events
-    return math.ceil(len(df[df["platform_id"] == platform])) / 2
+    return math.ceil(report["platforms"].get(str(platform), 0)) / 2
 
 
-def mean_samples_per_session(session_id):
-    df = read_compact_format()
+def mean_samples_per_session(session_id, report=None):
+    report = dataset_report() if report is None else report
     # A "keystroke" is a press and release event together, so we want to divide
     # final answer by 2 because we get both press and release events
-    return math.ceil(len(df[df["session_id"] == session_id]) / 6) / 2
+    return math.ceil(report["sessions"].get(str(session_id), 0) / 6) / 2
 
 
 def keystrokes_per_platform():
     rows = []
-    df = read_compact_format()
-    ids = sorted(list(df["platform_id"].unique()))
+    report = dataset_report()
+    ids = sorted(int(_id) for _id in report["platforms"])
     for _id in ids:
         # The decimal conversion here is to force round to the nearest integer
-        rows.append([_id, force_round_up(mean_samples_for_platform(_id))])
+        rows.append([_id, force_round_up(mean_samples_for_platform(_id, report))])
     table = tabulate(
         rows,
         headers=["ID", "Mean Sample Count Across all Platforms"],
@@ -46,13 +194,13 @@ def keystrokes_per_platform():
 
 def keystrokes_per_user():
     rows = []
-    df = read_compact_format()
-    ids = sorted(list(df["user_ids"].unique()))
+    report = dataset_report()
+    ids = sorted(int(_id) for _id in report["users"])
     keystroke_count = []
     for _id in ids:
-        keystroke_count.append(force_round_up(mean_samples_for_user(_id)))
         # The decimal conversion here is to force round to the nearest integer
-        rows.append([_id, force_round_up(mean_samples_for_user(_id))])
+        keystroke_count.append(force_round_up(mean_samples_for_user(_id, report)))
+        rows.append([_id, keystroke_count[-1]])
     table = tabulate(
         rows,
         headers=["ID", "Mean Sample Count Across per User"],
@@ -70,9 +218,10 @@ def keystrokes_per_session():
     # NOTE: There seems to be an extra session 7 that occurs for one user, since its only 52 raw samples (press+ released)
     # executive decision to just ignore it
     ids = [i for i in range(1, 7)]
+    report = dataset_report()
     for _id in ids:
         # The decimal conversion here is to force round to the nearest integer
-        rows.append([_id, force_round_up(mean_samples_per_session(_id))])
+        rows.append([_id, force_round_up(mean_samples_per_session(_id, report))])
     table = tabulate(
         rows,
         headers=["ID", "Mean Sample Count Across all Sessions"],
@@ -82,8 +231,9 @@ def keystrokes_per_session():
 
 
 def user_platform_count():
-    df = read_compact_format()
-    mapping = df.groupby("user_ids")["platform_id"].apply(set).to_dict()
+    mapping = {}
+    for user_id, platform, _, _ in dataset_report()["user_platform_sessions"]:
+        mapping.setdefault(user_id, set()).add(platform)
     print(mapping)
 
 
@@ -1,10 +1,18 @@
+import argparse
 import sys
 import os
 import json
 import numpy as np
 from sklearn.metrics import top_k_accuracy_score
 from classifiers.template_generator import all_ids
+from fusion.score_fusion import FusionAlgorithm, ScoreFuser
 from performance_evaluation.heatmap import HeatMap, VerifierType
+from performance_evaluation.results_store import ResultsStore
+from performance_evaluation.score_matrix import (
+    TiledScoreMatrix,
+    TopKScores,
+    top_k_accuracy_blockwise,
+)
 from tabulate import tabulate
 
 
@@ -39,15 +47,148 @@ def query_yes_no(question, default="yes"):
             sys.stdout.write("Please respond with 'yes' or 'no' " "(or 'y' or 'n').\n")
 
 
-def print_k_table(matrix, ids):
+def print_k_table(matrix, ids, run=None, **result_key):
+    """
+    Print the top-1..5 accuracies of a matrix, and record them into a results store run.
+
+    Parameters:
+    - matrix: The score matrix, `TiledScoreMatrix` or `TopKScores` of the users in ids.
+    - ids (list[int]): The user ids of the rows (enrollments). Every path ranks the probes of
+      each enrollment, so dense matrices and candidate lists of the same scenario agree.
+    - run (ResultsRun, optional): The run to record the accuracies into.
+    - result_key: The scenario and optionally the verifier, fusion rule and fold of the
+      accuracies, see `ResultsRun.record_top_k`.
+    """
     rows = []
-    rows.append([1, top_k_accuracy_score(np.array(ids), np.array(matrix), k=1)])
-    rows.append([2, top_k_accuracy_score(np.array(ids), np.array(matrix), k=2)])
-    rows.append([3, top_k_accuracy_score(np.array(ids), np.array(matrix), k=3)])
-    rows.append([4, top_k_accuracy_score(np.array(ids), np.array(matrix), k=4)])
-    rows.append([5, top_k_accuracy_score(np.array(ids), np.array(matrix), k=5)])
+    if isinstance(matrix, TopKScores):
+        # The candidate lists of an identification run carry their own query ids
+        assert list(matrix.query_ids) == list(ids)
+        for k in range(1, min(5, matrix.k) + 1):
+            rows.append([k, matrix.top_k_accuracy(k)])
+    elif isinstance(matrix, TiledScoreMatrix):
+        # Large matrices are evaluated band by band instead of being loaded whole
+        for k in range(1, 6):
+            rows.append([k, top_k_accuracy_blockwise(matrix, ids, k=k)])
+    else:
+        rows.append([1, top_k_accuracy_score(np.array(ids), np.array(matrix), k=1)])
+        rows.append([2, top_k_accuracy_score(np.array(ids), np.array(matrix), k=2)])
+        rows.append([3, top_k_accuracy_score(np.array(ids), np.array(matrix), k=3)])
+        rows.append([4, top_k_accuracy_score(np.array(ids), np.array(matrix), k=4)])
+        rows.append([5, top_k_accuracy_score(np.array(ids), np.array(matrix), k=5)])
     table = tabulate(rows, headers=["K", "Score"], tablefmt="plain")
     print(table)
+    if run is not None:
+        run.record_top_k(accuracies=[score for _, score in rows], **result_key)
+
+
+# The platforms by the letter a scenario names them with, e.g. "F-I" or "FI-T"
+PLATFORM_LETTERS = {1: "F", 2: "I", 3: "T"}
+
+# The verifiers and fusion rules every scenario of a sweep is scored with, the verifiers
+# being the three that are fused
+SWEEP_VERIFIERS = [VerifierType.ABSOLUTE, VerifierType.SIMILARITY, VerifierType.ITAD]
+SWEEP_FUSIONS = [FusionAlgorithm.MEAN, FusionAlgorithm.MEDIAN]
+
+
+def scenario_name(enroll_platform_id, probe_platform_id=None):
+    """
+    Returns:
+    - str: "F" for a single platform, "F-I" for Facebook enrollments and Instagram probes, or
+      "FI-T" for enrollments of both Facebook and Instagram.
+    """
+    name = "".join(
+        PLATFORM_LETTERS[platform_id]
+        for platform_id in np.atleast_1d(enroll_platform_id)
+    )
+    if probe_platform_id is None:
+        return name
+    return f"{name}-{PLATFORM_LETTERS[probe_platform_id]}"
+
+
+def record_scenario(
+    run,
+    scenario,
+    enroll_platform_id,
+    probe_platform_id,
+    enroll_session_id=None,
+    probe_session_id=None,
+):
+    """
+    Score one scenario with every sweep verifier and fusion rule in a single pass, and record
+    their top-k accuracies into a results store run.
+    """
+    heatmap = HeatMap(VerifierType.SIMILARITY)
+    matrices = heatmap.multi_verifier_matrices(
+        SWEEP_VERIFIERS,
+        enroll_platform_id,
+        probe_platform_id,
+        enroll_session_id,
+        probe_session_id,
+        1,
+    )
+    ids = all_ids()
+    for verifier_type in SWEEP_VERIFIERS:
+        print(scenario, verifier_type.name)
+        print_k_table(
+            matrices[verifier_type],
+            ids,
+            run,
+            scenario=scenario,
+            verifier=verifier_type.name.lower(),
+        )
+    fuser = ScoreFuser.from_matrices(matrices)
+    for fusion_algorithm in SWEEP_FUSIONS:
+        print(scenario, fusion_algorithm.name)
+        print_k_table(
+            fuser.find_matrix(fusion_algorithm),
+            ids,
+            run,
+            scenario=scenario,
+            fusion=fusion_algorithm.name.lower(),
+        )
+
+
+def same_platform_sweep(run):
+    """The even session split of every platform, for plots/same-platform-violin.py"""
+    for platform_id in PLATFORM_LETTERS:
+        record_scenario(
+            run, scenario_name(platform_id), platform_id, platform_id, [1, 3], [4, 6]
+        )
+
+
+def cross_platform_sweep(run):
+    """Every pair of platforms, for plots/cross-platform-violin.py"""
+    for enroll_platform_id in PLATFORM_LETTERS:
+        for probe_platform_id in PLATFORM_LETTERS:
+            if enroll_platform_id != probe_platform_id:
+                record_scenario(
+                    run,
+                    scenario_name(enroll_platform_id, probe_platform_id),
+                    enroll_platform_id,
+                    probe_platform_id,
+                )
+
+
+def combined_cross_platform_sweep(run):
+    """Enrollments of two platforms against the third, for plots/combine-cross-platform.py"""
+    for first in PLATFORM_LETTERS:
+        for second in PLATFORM_LETTERS:
+            if first == second:
+                continue
+            (probe_platform_id,) = set(PLATFORM_LETTERS) - {first, second}
+            record_scenario(
+                run,
+                scenario_name([first, second], probe_platform_id),
+                [first, second],
+                probe_platform_id,
+            )
+
+
+SWEEPS = {
+    "same-platform": same_platform_sweep,
+    "cross-platform": cross_platform_sweep,
+    "combined-cross-platform": combined_cross_platform_sweep,
+}
 
 
 def same_platform_even_split():
@@ -143,8 +284,23 @@ def cross_platform_2v1():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sweep",
+        choices=list(SWEEPS),
+        nargs="+",
+        help="Record these sweeps into the results store instead",
+    )
+    args = parser.parse_args()
     with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
         config = json.load(f)
     print("Using feature selection is: ", config["use_feature_selection"])
     query_yes_no("Proceed?")
-    cross_platform_2v1()
+    if args.sweep:
+        store = ResultsStore()
+        run = store.start_run(" ".join(args.sweep), config)
+        for sweep in args.sweep:
+            SWEEPS[sweep](run)
+        store.close()
+    else:
+        cross_platform_2v1()
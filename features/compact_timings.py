@@ -0,0 +1,138 @@
+from collections import defaultdict
+import numpy as np
+from features.preprocessing import SESSION_COLUMNS
+
+# The dataset records timings in nanoseconds. Compact timings count whole ticks of one of these
+# units instead, keyed by the "compact_timing_unit" that selects them.
+NANOSECONDS_PER_UNIT = {"us": 1_000, "ms": 1_000_000}
+
+# The dtype of raw compact timings, and of the timings of prepared templates built from them
+COMPACT_TIMING_DTYPE = np.int32
+COMPACT_VALUE_DTYPE = np.float32
+
+_INT32_MAX = np.iinfo(np.int32).max
+
+
+def compact_timing_unit(config):
+    """
+    Returns:
+    - str or None: The configured "compact_timing_unit", None when timings stay float64.
+
+    Raises:
+    - ValueError: If the unit is not one of `NANOSECONDS_PER_UNIT`.
+    """
+    unit = config.get("compact_timing_unit")
+    if unit and unit not in NANOSECONDS_PER_UNIT:
+        raise ValueError(
+            f"Unknown compact_timing_unit {unit}, expected one of {list(NANOSECONDS_PER_UNIT)}"
+        )
+    return unit or None
+
+
+def timing_scale(config):
+    """
+    Returns:
+    - int: How many nanoseconds one tick of the configured timings stands for, 1 without compact
+      timings. Settings given in nanoseconds (like "dbod_r") are divided by it.
+    """
+    unit = compact_timing_unit(config)
+    return NANOSECONDS_PER_UNIT[unit] if unit else 1
+
+
+def value_dtype(config):
+    """
+    Returns:
+    - type: The dtype of the timings of prepared templates, float32 with compact timings.
+    """
+    return COMPACT_VALUE_DTYPE if compact_timing_unit(config) else np.float64
+
+
+def _check_int32(ticks, what):
+    if len(ticks) == 0:
+        return
+    if not np.isfinite(ticks).all():
+        raise ValueError(f"Missing {what} cannot be stored as compact timings")
+    largest = np.abs(ticks).max()
+    if largest > _INT32_MAX:
+        raise OverflowError(
+            f"{what.capitalize()} of {largest:.0f} ticks overflow int32 compact timings, "
+            "use a coarser compact_timing_unit"
+        )
+
+
+def to_session_offsets(df, unit):
+    """
+    Replace the press and release times of a compact format dataset by int32 offsets from the
+    start of their session (its first press or release), counted in whole ticks of `unit`.
+
+    Since every offset lies in [0, 2^31), every hold and flight computed from them (the
+    difference of two offsets of the same session) fits in an int32 as well. Absolute times are
+    not kept.
+
+    Parameters:
+    - df (pandas.DataFrame): A compact format dataset, with times in nanoseconds.
+    - unit (str): One of `NANOSECONDS_PER_UNIT`.
+
+    Returns:
+    - pandas.DataFrame: The dataset with int32 "press_time" and "release_time" columns.
+
+    Raises:
+    - OverflowError: If a session lasts longer than an int32 offset can hold, about 35 minutes
+      in microseconds and 24 days in milliseconds.
+    - ValueError: If a press or release time is missing (they are dropped by `clean_keystrokes`).
+    """
+    scale = NANOSECONDS_PER_UNIT[unit]
+    press = df["press_time"].to_numpy(dtype=np.float64)
+    release = df["release_time"].to_numpy(dtype=np.float64)
+    sessions = df.groupby(SESSION_COLUMNS, sort=False).ngroup().to_numpy()
+    starts = np.full(sessions.max(initial=-1) + 1, np.inf)
+    np.minimum.at(starts, sessions, np.fmin(press, release))
+    start = starts[sessions]
+    # Offsets are rounded to whole ticks relative to the start rather than to the epoch, so
+    # a session's first keystroke sits exactly at 0
+    press = np.rint((press - start) / scale)
+    release = np.rint((release - start) / scale)
+    _check_int32(press, "press times")
+    _check_int32(release, "release times")
+    df = df.copy()
+    df["press_time"] = press.astype(COMPACT_TIMING_DTYPE)
+    df["release_time"] = release.astype(COMPACT_TIMING_DTYPE)
+    return df
+
+
+def to_compact_durations(values, unit):
+    """
+    Convert holds, flights or latencies in nanoseconds to int32 ticks of `unit`.
+
+    Returns:
+    - np.ndarray[int32]: The rounded durations.
+
+    Raises:
+    - OverflowError: If a duration does not fit in an int32.
+    """
+    ticks = np.rint(np.asarray(values, dtype=np.float64) / NANOSECONDS_PER_UNIT[unit])
+    _check_int32(ticks, "durations")
+    return ticks.astype(COMPACT_TIMING_DTYPE)
+
+
+def is_compact(timings):
+    """Whether timings are a compact (int32 or float32) array rather than a list or float64 array"""
+    return isinstance(timings, np.ndarray) and timings.dtype in (
+        COMPACT_TIMING_DTYPE,
+        COMPACT_VALUE_DTYPE,
+    )
+
+
+def timing_lists(pattern):
+    """
+    Returns:
+    - dict: The template as a defaultdict(list) with every compact timing array turned into a
+      list of Python numbers, the form the pairwise `Verify` computes its statistics over.
+      Templates without compact timings are returned as they are.
+    """
+    if not any(is_compact(timings) for timings in pattern.values()):
+        return pattern
+    converted = defaultdict(list)
+    for feature, timings in pattern.items():
+        converted[feature] = timings.tolist() if is_compact(timings) else timings
+    return converted
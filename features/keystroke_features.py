@@ -1,4 +1,222 @@
+import zlib
+import numpy as np
 from collections import defaultdict
+from features.compact_timings import is_compact
+
+
+def group_samples_by_feature(features, values):
+    """
+    Group timing samples by their feature name, keeping the order in which they occurred.
+
+    Parameters:
+    - features (np.ndarray[str]): The feature name of every sample.
+    - values (np.ndarray[float]): The timing of every sample.
+
+    Returns:
+    - dict: A defaultdict(list) mapping every feature, in order of first occurrence,
+      to the list of its samples in order of occurrence. Compact timings (int32 or float32,
+      see `features.compact_timings`) are kept as array views of one sorted copy of `values`
+      instead of lists of Python numbers.
+    """
+    grouped = defaultdict(list)
+    if len(features) == 0:
+        return grouped
+    vocabulary, first_index, inverse = np.unique(
+        features, return_index=True, return_inverse=True
+    )
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(vocabulary)))[:-1]
+    per_feature = np.split(values[order], bounds)
+    for feature_index in np.argsort(first_index, kind="stable"):
+        timings = per_feature[feature_index]
+        grouped[vocabulary[feature_index]] = (
+            timings if is_compact(timings) else timings.tolist()
+        )
+    return grouped
+
+
+def kht_samples(keys, press_times, release_times):
+    """
+    Vectorized Key Hold Time (KHT) extraction over aligned keystroke arrays.
+
+    Parameters:
+    - keys (np.ndarray[str]): The key of every keystroke, in typing order.
+    - press_times, release_times (np.ndarray[float]): The press and release time of every keystroke.
+
+    Returns:
+    - tuple[np.ndarray, np.ndarray]: The feature name (the key) and KHT of every keystroke.
+    """
+    return keys, release_times - press_times
+
+
+def kit_samples(keys, press_times, release_times, kit_feature_type):
+    """
+    Vectorized Key Interval Time (KIT) extraction over aligned keystroke arrays.
+
+    Parameters:
+    - keys (np.ndarray[str]): The key of every keystroke, in typing order.
+    - press_times, release_times (np.ndarray[float]): The press and release time of every keystroke.
+    - kit_feature_type (int): The KIT flight (1-4), see `create_kit_data_from_df`.
+
+    Returns:
+    - tuple[np.ndarray, np.ndarray]: The feature name (the digraph) and KIT of every pair of
+      consecutive keystrokes.
+    """
+    if len(keys) < 2:
+        return np.array([], dtype=object), np.array([], dtype=np.float64)
+    digraphs = keys[:-1].astype(object) + keys[1:].astype(object)
+    if kit_feature_type == 1:
+        values = press_times[1:] - release_times[:-1]
+    elif kit_feature_type == 2:
+        values = release_times[1:] - release_times[:-1]
+    elif kit_feature_type == 3:
+        values = press_times[1:] - press_times[:-1]
+    elif kit_feature_type == 4:
+        values = release_times[1:] - press_times[:-1]
+    else:
+        raise ValueError("KIT feature type must be between 1 and 4")
+    return digraphs, values
+
+
+# The n-graphs kept by default are those typed at least this often in the whole dataset
+DEFAULT_NGRAPH_MIN_COUNT = 5
+
+
+def ngraph_windows(codes, n, segments=None):
+    """
+    The start of every window of n consecutive keystrokes, as a strided view over the key codes.
+
+    Parameters:
+    - codes (np.ndarray[int]): The key code of every keystroke, -1 for keys to skip.
+    - n (int): The length of the windows.
+    - segments (np.ndarray[int], optional): The session of every keystroke; windows spanning two
+      sessions are dropped.
+
+    Returns:
+    - tuple[np.ndarray, np.ndarray]: The key codes of every kept window (windows x n) and the
+      index of its first keystroke.
+    """
+    if len(codes) < n:
+        return np.empty((0, n), dtype=np.int64), np.empty(0, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(codes, n)
+    kept = np.all(windows >= 0, axis=1)
+    if segments is not None:
+        kept &= segments[: len(windows)] == segments[n - 1 :]
+    starts = np.flatnonzero(kept)
+    return windows[starts], starts
+
+
+class NGraphVocabulary:
+    """
+    The dictionary encoding of the n-graphs (sequences of n keys, e.g. trigraphs for n = 3) of a
+    dataset, pruned to those typed at least `min_count` times.
+
+    Keys are encoded as integer codes and every n-graph as the base-k number of its codes, so
+    extraction only ever handles integer arrays; feature names are only built for the n-graphs
+    that survive pruning, and then only once.
+
+    Usage:
+    >>> vocabulary = NGraphVocabulary.from_keystrokes(keys, 3, min_count=5, segments=sessions)
+    >>> names, latencies = vocabulary.samples(keys, press_times, release_times)
+    """
+
+    def __init__(self, n, keys, ids, names):
+        self.n = n
+        # The known keys, sorted so that a key's code is its position, and the kept n-graph ids
+        # (sorted) with their names
+        self.keys = np.asarray(keys, dtype=str)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.names = np.asarray(names, dtype=object)
+        if len(self.keys) ** n >= 2**62:
+            raise ValueError(f"Too many distinct keys to encode {n}-graphs")
+
+    @classmethod
+    def from_keystrokes(
+        cls, keys, n, min_count=DEFAULT_NGRAPH_MIN_COUNT, segments=None
+    ):
+        """
+        Count every n-graph of a sequence of keystrokes in one vectorized pass and keep the
+        frequent ones.
+
+        Parameters:
+        - keys (np.ndarray[str]): The key of every keystroke, in typing order.
+        - n (int): The length of the n-graphs, at least 3 since the digraphs are the KIT features.
+        - min_count (int): The number of times an n-graph must occur to be kept.
+        - segments (np.ndarray[int], optional): The session of every keystroke, so that no
+          n-graph spans two sessions.
+
+        Returns:
+        - NGraphVocabulary: The vocabulary of the frequent n-graphs.
+        """
+        if n < 3:
+            raise ValueError("n-graphs must be at least trigraphs, digraphs are KIT")
+        vocabulary, codes = np.unique(np.asarray(keys, dtype=str), return_inverse=True)
+        ngraphs = cls(n, vocabulary, [], [])
+        windows, _ = ngraph_windows(codes.astype(np.int64), n, segments)
+        ids, first, counts = np.unique(
+            ngraphs._encode(windows), return_index=True, return_counts=True
+        )
+        kept = counts >= min_count
+        ngraphs.ids = ids[kept]
+        ngraphs.names = np.array(
+            ["".join(ngraphs.keys[window].tolist()) for window in windows[first[kept]]],
+            dtype=object,
+        )
+        return ngraphs
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _encode(self, windows):
+        powers = len(self.keys) ** np.arange(self.n - 1, -1, -1, dtype=np.int64)
+        return windows @ powers
+
+    def samples(self, keys, press_times, release_times):
+        """
+        Vectorized n-graph latency extraction: the time from pressing the first key of every
+        kept n-graph to pressing its last key.
+
+        Parameters:
+        - keys (np.ndarray[str]): The key of every keystroke, in typing order.
+        - press_times, release_times (np.ndarray[float]): The press and release time of every
+          keystroke. Release times are not used, but taken like the other extractors.
+
+        Returns:
+        - tuple[np.ndarray, np.ndarray]: The feature name (the n-graph) and latency of every
+          window of n consecutive keystrokes whose n-graph is in the vocabulary.
+        """
+        if len(self.ids) == 0:
+            return np.array([], dtype=object), np.array([], dtype=np.float64)
+        keys = np.asarray(keys, dtype=str)
+        codes = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        # Keys the vocabulary has never seen cannot be part of a kept n-graph
+        codes[self.keys[codes] != keys] = -1
+        windows, starts = ngraph_windows(codes.astype(np.int64), self.n)
+        ids = self._encode(windows)
+        positions = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        known = self.ids[positions] == ids
+        starts = starts[known]
+        latencies = press_times[starts + self.n - 1] - press_times[starts]
+        return self.names[positions[known]], latencies
+
+
+def timing_array(times):
+    """
+    Returns:
+    - np.ndarray: The press or release times of a Series, int32 compact timings as they are
+      (see `features.compact_timings.to_session_offsets`) and anything else as float64.
+    """
+    if times.dtype == np.int32:
+        return times.to_numpy()
+    return times.to_numpy(dtype=np.float64)
+
+
+def _keystroke_arrays(df):
+    return (
+        df["key"].to_numpy(dtype=object),
+        timing_array(df["press_time"]),
+        timing_array(df["release_time"]),
+    )
 
 
 def create_kht_data_from_df(df):
@@ -17,10 +235,7 @@ def create_kht_data_from_df(df):
     KHT is defined as the difference between the release time and the press time for a given key instance.
     This function computes the KHT for each key in the dataframe and aggregates the results by key.
     """
-    kht_dict = defaultdict(list)
-    for i, row in df.iterrows():
-        kht_dict[row["key"]].append(row["release_time"] - row["press_time"])
-    return kht_dict
+    return group_samples_by_feature(*kht_samples(*_keystroke_arrays(df)))
 
 
 def create_kit_data_from_df(df, kit_feature_type):
@@ -45,29 +260,12 @@ def create_kit_data_from_df(df, kit_feature_type):
     This function computes the KIT for each pair of consecutive keys in the dataframe and aggregates
     the results by key pair. The method for computing the KIT is determined by the `kit_feature_type` parameter.
     """
-    kit_dict = defaultdict(list)
     if df.empty:
         # print("dig deeper: dataframe is empty!")
-        return kit_dict
-    num_rows = len(df.index)
-    for i in range(num_rows):
-        if i < num_rows - 1:
-            current_row = df.iloc[i]
-            next_row = df.iloc[i + 1]
-            key = current_row["key"] + next_row["key"]
-            initial_press = float(current_row["press_time"])
-            second_press = float(next_row["press_time"])
-            initial_release = float(current_row["release_time"])
-            second_release = float(next_row["release_time"])
-            if kit_feature_type == 1:
-                kit_dict[key].append(second_press - initial_release)
-            elif kit_feature_type == 2:
-                kit_dict[key].append(second_release - initial_release)
-            elif kit_feature_type == 3:
-                kit_dict[key].append(second_press - initial_press)
-            elif kit_feature_type == 4:
-                kit_dict[key].append(second_release - initial_press)
-    return kit_dict
+        return defaultdict(list)
+    return group_samples_by_feature(
+        *kit_samples(*_keystroke_arrays(df), kit_feature_type)
+    )
 
 
 def word_hold(word_list, raw_df):
@@ -96,7 +294,7 @@ def word_hold(word_list, raw_df):
         first_letter = word[0]
         # print(first_letter)
         potential_release_matches = raw_df[
-            (~raw_df["visited"]) & (raw_df["key"].str.strip("'") == first_letter)
+            (~raw_df["visited"]) & (raw_df["key"] == first_letter)
         ]
         if len(potential_release_matches) > 0:
             first_row = potential_release_matches.iloc[0]
@@ -121,5 +319,44 @@ def word_hold(word_list, raw_df):
                 raw_df.loc[
                     first_row_index : first_row_index + len(word) - 2, "visited"
                 ] = True
-            wh[word].append(release_time - press_time)
+            wh[word].append(float(release_time - press_time))
     return wh
+
+
+# The ways `cap_samples` can choose which timings of a feature to keep
+SAMPLE_CAP_STRATEGIES = ("reservoir", "recent")
+
+
+def cap_samples(pattern, max_samples, strategy="reservoir", seed=0):
+    """
+    Keep at most `max_samples` timings of every feature of a template.
+
+    Parameters:
+    - pattern (dict): A template mapping features to lists of timings, in typing order.
+    - max_samples (int): The largest number of timings kept per feature.
+    - strategy (str): "reservoir" keeps a uniform random sample, the outcome of reservoir
+      sampling, seeded by `seed` and the feature so it is the same on every run; "recent" keeps
+      the most recently typed timings.
+    - seed (int): The seed of the reservoir samples.
+
+    Returns:
+    - dict: A defaultdict(list) with the kept timings of every feature, still in typing order.
+
+    Raises:
+    - ValueError: If the strategy is unknown.
+    """
+    if strategy not in SAMPLE_CAP_STRATEGIES:
+        raise ValueError(
+            f"Unknown sample cap strategy {strategy}, expected one of {SAMPLE_CAP_STRATEGIES}"
+        )
+    capped = defaultdict(list)
+    for feature, timings in pattern.items():
+        if len(timings) <= max_samples:
+            capped[feature] = list(timings)
+        elif strategy == "recent":
+            capped[feature] = list(timings[-max_samples:])
+        else:
+            rng = np.random.default_rng([seed, zlib.crc32(str(feature).encode())])
+            kept = np.sort(rng.choice(len(timings), max_samples, replace=False))
+            capped[feature] = [timings[index] for index in kept]
+    return capped
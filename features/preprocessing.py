@@ -0,0 +1,125 @@
+import logging
+import re
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Keys the keylogger records without a key label
+INVALID_KEYS = ("<0>", "")
+
+# A printable key is recorded with single quotes around it, e.g. 'a'
+_QUOTED_KEY = re.compile(r"^'(.+)'$", re.DOTALL)
+
+SESSION_COLUMNS = ["user_ids", "platform_id", "session_id"]
+
+
+def normalize_keys(keys):
+    """
+    Normalize key labels: strip surrounding whitespace and the single quotes around printable keys,
+    so 'a' becomes a and ''' (the quote key) becomes ', while special keys like Key.space are kept.
+
+    Parameters:
+    - keys (pandas.Series): The recorded key labels.
+
+    Returns:
+    - pandas.Series: The normalized labels.
+    """
+    keys = keys.astype(str).str.strip()
+    return keys.str.replace(_QUOTED_KEY, r"\1", regex=True)
+
+
+def clean_events(df, config=None):
+    """
+    The row by row part of `clean_keystrokes`, which also works on any chunk of a dataset:
+    normalize the key labels, drop invalid events (unlabeled keys, missing times, releases before
+    the press) and clip holds longer than "max_hold_time".
+
+    Returns:
+    - tuple[pandas.DataFrame, dict]: The cleaned rows with a fresh index, and how many rows were
+      removed and clipped for every reason.
+    """
+    config = config or {}
+    keys = normalize_keys(df["key"])
+    press = df["press_time"].to_numpy(dtype=np.float64)
+    release = df["release_time"].to_numpy(dtype=np.float64)
+    invalid_key = keys.isin(INVALID_KEYS).to_numpy() | df["key"].isna().to_numpy()
+    missing_time = ~(np.isfinite(press) & np.isfinite(release)) & ~invalid_key
+    negative_hold = (release < press) & ~invalid_key & ~missing_time
+    kept = ~(invalid_key | missing_time | negative_hold)
+    report = {
+        "removed": {
+            "invalid_key": int(invalid_key.sum()),
+            "missing_time": int(missing_time.sum()),
+            "negative_hold": int(negative_hold.sum()),
+        },
+        "clipped": {"hold": 0, "flight": 0},
+    }
+    cleaned = df.loc[kept].copy()
+    cleaned["key"] = keys.to_numpy()[kept]
+    max_hold = config.get("max_hold_time")
+    if max_hold:
+        press, release = press[kept], release[kept]
+        too_long = release - press > max_hold
+        report["clipped"]["hold"] = int(too_long.sum())
+        cleaned["release_time"] = np.where(too_long, press + max_hold, release)
+    return cleaned.reset_index(drop=True), report
+
+
+def clean_keystrokes(df, config=None):
+    """
+    Clean a whole dataset once, at load time, so that feature extraction and scoring never have
+    to: every step is vectorized over all of the rows.
+
+    1. The key labels are normalized, see `normalize_keys`.
+    2. Invalid events are dropped: unlabeled keys ("<0>"), missing press or release times and
+       releases before the press.
+    3. Holds longer than "max_hold_time" are clipped to it.
+    4. The keystrokes of every session are sorted by press time.
+    5. Pauses between a release and the next press longer than "max_flight_time" are shortened to
+       it by moving the rest of the session earlier, which clips the flight without changing
+       any other hold or flight time.
+
+    Both limits are in the time unit of the dataset and off when null.
+
+    Parameters:
+    - df (pandas.DataFrame): A compact format dataset.
+    - config (dict, optional): The classifier configuration.
+
+    Returns:
+    - tuple[pandas.DataFrame, dict]: The cleaned dataset with a fresh index, and a report of the
+      number of rows read and kept, removed and clipped for every reason, and the number of
+      sessions that had to be reordered.
+    """
+    config = config or {}
+    rows = len(df)
+    df, report = clean_events(df, config)
+    sessions = df.groupby(SESSION_COLUMNS, sort=False).ngroup().to_numpy()
+    press = df["press_time"].to_numpy(dtype=np.float64)
+    order = np.lexsort((press, sessions))
+    out_of_order = order != np.arange(len(df))
+    report["reordered_sessions"] = int(len(np.unique(sessions[out_of_order])))
+    if out_of_order.any():
+        df = df.iloc[order].reset_index(drop=True)
+        sessions = sessions[order]
+        press = press[order]
+    max_flight = config.get("max_flight_time")
+    if max_flight and len(df) > 1:
+        release = df["release_time"].to_numpy(dtype=np.float64)
+        same_session = sessions[1:] == sessions[:-1]
+        excess = np.where(
+            same_session, np.maximum(press[1:] - release[:-1] - max_flight, 0.0), 0.0
+        )
+        report["clipped"]["flight"] = int(np.count_nonzero(excess))
+        shift = np.concatenate([[0.0], np.cumsum(excess)])
+        # Every session only moves by the pauses within it
+        starts = np.where(
+            np.concatenate([[True], ~same_session]), np.arange(len(df)), 0
+        )
+        shift -= shift[np.maximum.accumulate(starts)]
+        df["press_time"] = press - shift
+        df["release_time"] = release - shift
+    report = {"rows": rows, "kept": len(df), **report}
+    removed = sum(report["removed"].values())
+    if removed or any(report["clipped"].values()) or report["reordered_sessions"]:
+        logger.info("cleaned keystrokes: %s", report)
+    return df, report
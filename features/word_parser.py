@@ -1,24 +1,36 @@
 import os
 import pandas as pd
-import spacy
-import numpy as np
+from classifiers.template_generator import COMPACT_FORMAT_DTYPES
+from features.preprocessing import INVALID_KEYS, clean_keystrokes
+
+# The spaCy pipeline, loaded on first use since importing spaCy and its model takes seconds
+_nlp = None
+
+
+def _spacy_pipeline():
+    global _nlp
+    if _nlp is None:
+        import spacy
+
+        _nlp = spacy.load("en_core_web_sm")
+    return _nlp
 
 
 # https://stackoverflow.com/questions/18172851/deleting-dataframe-row-in-pandas-based-on-column-value
 def remove_invalid_keystrokes(df):
     """
     A helper function that takes as input a dataframe, and returns a new dataframe
-    no longer containing rows with the string "<0>".
+    no longer containing rows with an invalid key such as "<0>". Datasets read through
+    `read_compact_format` or `SentenceParser.as_df` are already cleaned unless
+    "clean_keystrokes" is off, in which case only their keys are normalized.
 
     Parameters:
     - df: a pandas DataFrame.
 
     Returns:
-    - DataFrame without rows containing the string "<0>".
+    - DataFrame without rows containing an invalid key.
     """
-    # A helper function that takes as input a dataframe, and return a new
-    # dataframe no longer containing rows with the string "<0>"
-    return df.loc[df["key"] != "<0>"]
+    return df.loc[~df["key"].isin(INVALID_KEYS)]
 
 
 def clean_letters(letters):
@@ -56,28 +68,26 @@ class SentenceParser:
         return self.csv_file_path
 
     def as_df(self):
-        return pd.read_csv(
+        df = pd.read_csv(
             os.path.join(os.getcwd(), "cleaned.csv"),
-            dtype={
-                "key": str,
-                "press_time": np.float64,
-                "release_time": np.float64,
-                "platform_id": np.uint8,
-                "session_id": np.uint8,
-                "user_ids": np.uint8,
-            },
+            dtype=COMPACT_FORMAT_DTYPES,
         )
+        return clean_keystrokes(df)[0]
 
     def letters(self, as_list: bool = False):
         if as_list == True:
-            return list(remove_invalid_keystrokes(self.as_df()).iloc[:, 1])
+            return list(self.as_df().iloc[:, 1])
         elif as_list == False:
-            return remove_invalid_keystrokes(self.as_df())
+            return self.as_df()
 
     def make_sentences(self, raw_df):
+        """
+        The keys of raw_df are expected to be normalized, see `normalize_keys`. Invalid keys are
+        still dropped, since they are kept when "clean_keystrokes" is off.
+        """
         ignorable = ["Key.cmd", "Key.tab", "Key.shift", "Key.shift_r"]
         filtered = []
-        keys = clean_letters(remove_invalid_keystrokes(raw_df).loc[:, "key"])
+        keys = list(remove_invalid_keystrokes(raw_df).loc[:, "key"])
         for i, key in enumerate(keys):
             filtered.append(key)
 
@@ -114,8 +124,7 @@ class SentenceParser:
     def get_words(self, data_df):
         tokenized_words = []
         sentences = self.make_sentences(data_df)
-        nlp = spacy.load("en_core_web_sm")
-        doc = nlp(sentences)
+        doc = _spacy_pipeline()(sentences)
         for token in doc:
             tokenized_words.append(token.text)
         return tokenized_words
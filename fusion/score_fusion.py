@@ -1,6 +1,13 @@
 import enum
 import statistics
 import numpy as np
+from classifiers.verifier_registry import VerifierType
+from performance_evaluation.score_matrix import (
+    DEFAULT_BLOCK_SIZE,
+    TiledScoreMatrix,
+    TopKScores,
+    rank_candidates,
+)
 
 
 class FusionAlgorithm(enum.Enum):
@@ -46,6 +53,21 @@ def choose_score(algorithm, score1, score2, score3):
         raise ValueError("Invalid algorithm")
 
 
+def _as_array(matrix):
+    if isinstance(matrix, TiledScoreMatrix):
+        return matrix.array
+    return np.asarray(matrix)
+
+
+# The vectorized counterpart of choose_score, reducing over the stacked verifier axis
+_FUSION_REDUCERS = {
+    FusionAlgorithm.MEAN: np.mean,
+    FusionAlgorithm.MEDIAN: np.median,
+    FusionAlgorithm.MIN: np.min,
+    FusionAlgorithm.MAX: np.max,
+}
+
+
 class ScoreFuser:
     """
     A helper class to fuse the feature matrices based on the algorithm
@@ -61,18 +83,40 @@ class ScoreFuser:
     """
 
     def __init__(self, itad_matrix, similarity_matrix, absolute_matrix):
-        self.itad_matrix = np.array(itad_matrix)
-        self.similarity_matrix = np.array(similarity_matrix)
-        self.absolute_matrix = np.array(absolute_matrix)
+        # Memory-mapped matrices are used in place rather than copied into memory
+        self.itad_matrix = _as_array(itad_matrix)
+        self.similarity_matrix = _as_array(similarity_matrix)
+        self.absolute_matrix = _as_array(absolute_matrix)
         assert (
-            len(self.itad_matrix)
-            == len(self.absolute_matrix)
-            == len(self.similarity_matrix)
+            self.itad_matrix.shape
+            == self.absolute_matrix.shape
+            == self.similarity_matrix.shape
         )
-        assert (
-            len([row[0] for row in self.similarity_matrix])
-            == len([row[0] for row in self.absolute_matrix])
-            == len([row[0] for row in self.itad_matrix])
+
+    @classmethod
+    def from_matrices(cls, matrices, normalization=None):
+        """
+        Build a fuser from the result of `HeatMap.multi_verifier_matrices`, or any mapping of
+        VerifierType to matrix.
+
+        Parameters:
+        - matrices (dict[VerifierType, matrix]): Must contain the ITAD, SIMILARITY and ABSOLUTE matrices.
+        - normalization (dict[VerifierType, CohortStatistics], optional): Cohort statistics to
+          normalize the matrices with first (see `fusion.score_normalization`), so the fused
+          scores are on one scale.
+
+        Returns:
+        - ScoreFuser: The fuser of the three matrices.
+        """
+        if normalization is not None:
+            matrices = {
+                verifier_type: normalization[verifier_type].normalize(_as_array(matrix))
+                for verifier_type, matrix in matrices.items()
+            }
+        return cls(
+            matrices[VerifierType.ITAD],
+            matrices[VerifierType.SIMILARITY],
+            matrices[VerifierType.ABSOLUTE],
         )
 
     def find_matrix(self, algorithm: FusionAlgorithm):
@@ -104,3 +148,99 @@ class ScoreFuser:
                     absolute_matrix_element,
                 )
         return res_matrix
+
+    def fused_row_blocks(
+        self, algorithm: FusionAlgorithm, block_rows=DEFAULT_BLOCK_SIZE
+    ):
+        """
+        Fuse the matrices one band of rows at a time, without materializing any of them.
+
+        Parameters:
+        - algorithm (FusionAlgorithm): The fusion algorithm to be applied.
+        - block_rows (int): The number of rows fused at once.
+
+        Yields:
+        - tuple[int, np.ndarray]: The first row index and the fused scores of the band.
+        """
+        if algorithm not in _FUSION_REDUCERS:
+            raise ValueError("Invalid algorithm")
+        reducer = _FUSION_REDUCERS[algorithm]
+        for row_start in range(0, len(self.absolute_matrix), block_rows):
+            band = slice(row_start, row_start + block_rows)
+            stacked = np.stack(
+                [
+                    np.asarray(self.itad_matrix[band], dtype=np.float64),
+                    np.asarray(self.similarity_matrix[band], dtype=np.float64),
+                    np.asarray(self.absolute_matrix[band], dtype=np.float64),
+                ]
+            )
+            yield row_start, reducer(stacked, axis=0)
+
+    def fuse_to_file(
+        self, algorithm: FusionAlgorithm, output_path, block_rows=DEFAULT_BLOCK_SIZE
+    ):
+        """
+        Fuse the matrices band by band into a memory-mapped matrix.
+
+        Parameters:
+        - algorithm (FusionAlgorithm): The fusion algorithm to be applied.
+        - output_path (str): The .npy file receiving the fused matrix.
+        - block_rows (int): The number of rows fused at once.
+
+        Returns:
+        - TiledScoreMatrix: The fused matrix.
+        """
+        fused = TiledScoreMatrix.create(output_path, self.absolute_matrix.shape)
+        for row_start, band in self.fused_row_blocks(algorithm, block_rows):
+            fused.write_block(row_start, 0, band)
+        fused.flush()
+        return fused
+
+
+def fuse_top_k_scores(
+    algorithm: FusionAlgorithm, itad_top, similarity_top, absolute_top
+):
+    """
+    Fuse the top-K candidate lists of the ITAD, similarity and absolute verifiers.
+
+    For every query the candidates of the three lists are pooled. A verifier that did not keep a
+    candidate contributes its K-th best score for that query instead, the best score the candidate
+    could have had, so a candidate has to be kept by at least one verifier to be fused at all.
+
+    Parameters:
+    - algorithm (FusionAlgorithm): The fusion algorithm to be applied.
+    - itad_top, similarity_top, absolute_top (TopKScores): The candidate lists, which must have the
+      same queries and candidates.
+
+    Returns:
+    - TopKScores: The K best candidates of every query under the fused score.
+    """
+    if algorithm not in _FUSION_REDUCERS:
+        raise ValueError("Invalid algorithm")
+    tops = [itad_top, similarity_top, absolute_top]
+    for top in tops[1:]:
+        assert np.array_equal(top.query_ids, itad_top.query_ids)
+        assert np.array_equal(top.candidate_ids, itad_top.candidate_ids)
+    k = min(top.k for top in tops)
+    pooled = np.concatenate([top.indices for top in tops], axis=1)
+    verifier_scores = []
+    for top in tops:
+        # Look every pooled candidate up in this verifier's list, falling back to its K-th score
+        matches = pooled[:, :, None] == top.indices[:, None, :]
+        found = np.any(matches, axis=2)
+        looked_up = np.take_along_axis(top.scores, np.argmax(matches, axis=2), axis=1)
+        verifier_scores.append(
+            np.where(found, looked_up, top.scores[:, -1:]).astype(np.float64)
+        )
+    fused = _FUSION_REDUCERS[algorithm](np.stack(verifier_scores), axis=0)
+    # Candidates kept by several verifiers appear several times in the pool
+    duplicate = np.zeros(pooled.shape, dtype=bool)
+    for column in range(1, pooled.shape[1]):
+        duplicate[:, column] = np.any(
+            pooled[:, :column] == pooled[:, column : column + 1], axis=1
+        )
+    fused[duplicate | (pooled < 0)] = -np.inf
+    result = TopKScores.empty(itad_top.query_ids, itad_top.candidate_ids, k)
+    result.scores, result.indices = rank_candidates(fused, pooled, k)
+    result.scores = result.scores.astype(np.float32)
+    return result
@@ -0,0 +1,305 @@
+import argparse
+import enum
+import json
+import os
+import numpy as np
+from classifiers.verifier_registry import (
+    DEFAULT_THRESHOLDS,
+    VerifierType,
+    get_verifier,
+    score_matrices,
+)
+
+
+class NormalizationType(enum.Enum):
+    """
+    Which side of a score the cohort statistics describe
+    """
+
+    # Every enrollment is scored against a cohort of impostor probes, so its statistics are
+    # computed once, offline, and normalize its row of any matrix
+    ZNORM = 1
+    # Every probe is scored against a cohort of impostor enrollments, normalizing its column
+    TNORM = 2
+
+
+class CohortStatistics:
+    """
+    The mean and standard deviation of the impostor scores of every template against a cohort,
+    with which scores are normalized to the number of standard deviations they lie above the
+    template's impostor scores. Normalized scores of different verifiers are on the same scale,
+    so they can be fused and thresholded alike.
+
+    Usage:
+    >>> statistics = CohortStatistics.from_scores(cohort_matrix, ids, cohort_ids)
+    >>> normalized_matrix = statistics.normalize(matrix)
+    >>> statistics.normalize_scores(enrollment_id, score)
+    """
+
+    def __init__(self, ids, means, stdevs, normalization=NormalizationType.ZNORM):
+        self.ids = [int(_id) for _id in ids]
+        self.means = np.asarray(means, dtype=np.float64)
+        self.stdevs = np.asarray(stdevs, dtype=np.float64)
+        self.normalization = normalization
+        self._positions = {_id: position for position, _id in enumerate(self.ids)}
+
+    @classmethod
+    def from_scores(
+        cls, scores, ids, cohort_ids=None, normalization=NormalizationType.ZNORM
+    ):
+        """
+        Compute the statistics from cohort scores, leaving out the genuine pairs.
+
+        Parameters:
+        - scores (array-like): The enrollment x cohort scores for Z-norm, or the cohort x probe
+          scores for T-norm.
+        - ids (list[int]): The user id of every enrollment (Z-norm) or probe (T-norm).
+        - cohort_ids (list[int], optional): The user id of every cohort template. Scores of a
+          template against its own user's cohort template are not impostor scores and are left out.
+        - normalization (NormalizationType): Whether the statistics are per enrollment or per probe.
+
+        Returns:
+        - CohortStatistics: The statistics of every template.
+        """
+        scores = np.asarray(scores, dtype=np.float64)
+        if normalization == NormalizationType.TNORM:
+            scores = scores.T
+        impostor = np.ones(scores.shape, dtype=bool)
+        if cohort_ids is not None:
+            impostor = np.asarray(ids)[:, np.newaxis] != np.asarray(cohort_ids)
+        counts = impostor.sum(axis=1)
+        means = np.where(impostor, scores, 0.0).sum(axis=1) / np.maximum(counts, 1)
+        squares = np.where(impostor, (scores - means[:, np.newaxis]) ** 2, 0.0)
+        stdevs = np.sqrt(squares.sum(axis=1) / np.maximum(counts - 1, 1))
+        return cls(ids, means, stdevs, normalization)
+
+    def _scale(self, positions):
+        # Templates whose impostor scores do not vary are only shifted
+        stdevs = self.stdevs[positions]
+        return self.means[positions], np.where(stdevs > 0, stdevs, 1.0)
+
+    def normalize(self, matrix, ids=None):
+        """
+        Normalize a score matrix with rows of enrollments and columns of probes.
+
+        Parameters:
+        - matrix (array-like): The scores.
+        - ids (list[int], optional): The ids of the rows (Z-norm) or columns (T-norm), defaults to
+          the ids of these statistics in order.
+
+        Returns:
+        - np.ndarray: The normalized scores.
+
+        Raises:
+        - KeyError: If an id has no statistics.
+        """
+        matrix = np.asarray(matrix, dtype=np.float64)
+        positions = (
+            np.arange(len(self.ids))
+            if ids is None
+            else np.array([self._positions[int(_id)] for _id in ids], dtype=np.int64)
+        )
+        means, stdevs = self._scale(positions)
+        if self.normalization == NormalizationType.ZNORM:
+            return (matrix - means[:, np.newaxis]) / stdevs[:, np.newaxis]
+        return (matrix - means) / stdevs
+
+    def normalize_scores(self, ids, scores):
+        """
+        Normalize online scores, each by the statistics of its template.
+
+        Parameters:
+        - ids (int or list[int]): The enrollment (Z-norm) or probe (T-norm) of every score.
+        - scores (float or array-like): The scores.
+
+        Returns:
+        - float or np.ndarray: The normalized scores, a float for a single score.
+
+        Raises:
+        - KeyError: If an id has no statistics.
+        """
+        positions = np.array(
+            [self._positions[int(_id)] for _id in np.atleast_1d(ids)], dtype=np.int64
+        )
+        means, stdevs = self._scale(positions)
+        normalized = (np.asarray(scores, dtype=np.float64) - means) / stdevs
+        if np.ndim(ids) == 0:
+            return float(normalized[0])
+        return normalized
+
+
+def znorm_statistics(
+    verifier_types,
+    enrollments,
+    cohort,
+    config,
+    enrollment_ids,
+    cohort_ids=None,
+    thresholds=DEFAULT_THRESHOLDS,
+):
+    """
+    Score every enrollment against a cohort of probes once and keep its impostor statistics.
+
+    Parameters:
+    - verifier_types (list[VerifierType]): The verifiers.
+    - enrollments, cohort (list[dict]): The enrollment and cohort probe templates.
+    - config (dict): The classifier configuration.
+    - enrollment_ids (list[int]): The user id of every enrollment.
+    - cohort_ids (list[int], optional): The user id of every cohort probe, to leave out genuine pairs.
+    - thresholds (tuple[int, int]): The feature selection thresholds of the enrollment and the probe.
+
+    Returns:
+    - dict[VerifierType, CohortStatistics]: The Z-norm statistics of every verifier.
+    """
+    verifier_types = list(verifier_types)
+    matrices = score_matrices(
+        [get_verifier(verifier_type) for verifier_type in verifier_types],
+        enrollments,
+        cohort,
+        config,
+        thresholds,
+    )
+    return {
+        verifier_type: CohortStatistics.from_scores(
+            matrix, enrollment_ids, cohort_ids, NormalizationType.ZNORM
+        )
+        for verifier_type, matrix in zip(verifier_types, matrices)
+    }
+
+
+def tnorm_statistics(
+    verifier_types,
+    cohort,
+    probes,
+    config,
+    probe_ids,
+    cohort_ids=None,
+    thresholds=DEFAULT_THRESHOLDS,
+):
+    """
+    Score every probe against a cohort of enrollments and keep its impostor statistics.
+
+    Parameters:
+    - verifier_types (list[VerifierType]): The verifiers.
+    - cohort, probes (list[dict]): The cohort enrollment and probe templates.
+    - config (dict): The classifier configuration.
+    - probe_ids (list[int]): The user id of every probe.
+    - cohort_ids (list[int], optional): The user id of every cohort enrollment, to leave out
+      genuine pairs.
+    - thresholds (tuple[int, int]): The feature selection thresholds of the enrollment and the probe.
+
+    Returns:
+    - dict[VerifierType, CohortStatistics]: The T-norm statistics of every verifier.
+    """
+    verifier_types = list(verifier_types)
+    matrices = score_matrices(
+        [get_verifier(verifier_type) for verifier_type in verifier_types],
+        cohort,
+        probes,
+        config,
+        thresholds,
+    )
+    return {
+        verifier_type: CohortStatistics.from_scores(
+            matrix, probe_ids, cohort_ids, NormalizationType.TNORM
+        )
+        for verifier_type, matrix in zip(verifier_types, matrices)
+    }
+
+
+def normalize_matrices(matrices, statistics):
+    """
+    Normalize the matrices of several verifiers, e.g. before `ScoreFuser.from_matrices`.
+
+    Parameters:
+    - matrices (dict[VerifierType, matrix]): The score matrix of every verifier.
+    - statistics (dict[VerifierType, CohortStatistics]): The statistics of every verifier, whose
+      ids are in the order of the matrix rows (Z-norm) or columns (T-norm).
+
+    Returns:
+    - dict[VerifierType, np.ndarray]: The normalized matrix of every verifier.
+    """
+    return {
+        verifier_type: statistics[verifier_type].normalize(matrix)
+        for verifier_type, matrix in matrices.items()
+    }
+
+
+def save_statistics(path, statistics):
+    """
+    Write the cohort statistics of several verifiers to a .npz file, e.g. next to a template snapshot.
+
+    Parameters:
+    - path (str): The file to write.
+    - statistics (dict[VerifierType, CohortStatistics]): The statistics of every verifier.
+    """
+    arrays = {}
+    for verifier_type, verifier_statistics in statistics.items():
+        name = verifier_type.name.lower()
+        arrays[f"{name}_ids"] = np.asarray(verifier_statistics.ids, dtype=np.int64)
+        arrays[f"{name}_means"] = verifier_statistics.means
+        arrays[f"{name}_stdevs"] = verifier_statistics.stdevs
+        arrays[f"{name}_normalization"] = np.asarray(
+            verifier_statistics.normalization.value
+        )
+    np.savez(path, **arrays)
+
+
+def load_statistics(path):
+    """
+    Read the cohort statistics written by `save_statistics`.
+
+    Returns:
+    - dict[VerifierType, CohortStatistics]: The statistics of every verifier.
+    """
+    statistics = {}
+    with np.load(path) as data:
+        for verifier_type in VerifierType:
+            name = verifier_type.name.lower()
+            if f"{name}_ids" not in data:
+                continue
+            statistics[verifier_type] = CohortStatistics(
+                data[f"{name}_ids"],
+                data[f"{name}_means"],
+                data[f"{name}_stdevs"],
+                NormalizationType(int(data[f"{name}_normalization"])),
+            )
+    return statistics
+
+
+if __name__ == "__main__":
+    from classifiers.session_templates import session_templates
+    from classifiers.template_generator import all_ids
+    from classifiers.template_store import family_for_kit
+    from service.verification_service import SERVICE_VERIFIERS
+
+    parser = argparse.ArgumentParser(
+        description="Compute the Z-norm statistics of the enrollments of a platform"
+    )
+    parser.add_argument("path")
+    parser.add_argument("--platform", type=int, default=1)
+    parser.add_argument("--session", type=int)
+    parser.add_argument(
+        "--cohort-platform",
+        type=int,
+        default=2,
+        help="The platform of the impostor probes every enrollment is scored against",
+    )
+    parser.add_argument("--kit-feature-type", type=int, default=1)
+    args = parser.parse_args()
+    with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
+        config = json.load(f)
+    ids = all_ids()
+    families = ["kht", family_for_kit(args.kit_feature_type)]
+    sessions = session_templates()
+    save_statistics(
+        args.path,
+        znorm_statistics(
+            SERVICE_VERIFIERS,
+            [sessions.template(i, args.platform, args.session, families) for i in ids],
+            [sessions.template(i, args.cohort_platform, None, families) for i in ids],
+            config,
+            ids,
+            ids,
+        ),
+    )
@@ -1,11 +1,11 @@
 import random
 import os
-from classifiers.template_generator import all_ids
+from classifiers.template_generator import all_ids, get_user_by_platform
 from experiments import print_k_table
 from features.word_parser import SentenceParser
 from fusion.decsion_fusion import get_actual_designation, is_fake_profile, verdict
 from fusion.score_fusion import FusionAlgorithm, ScoreFuser
-from performance_evaluation.heatmap import HeatMap, VerifierType, get_user_by_platform
+from performance_evaluation.heatmap import HeatMap, VerifierType
 from features.keystroke_features import (
     create_kht_data_from_df,
     create_kit_data_from_df,
@@ -48,16 +48,28 @@ def decision_fusion_test():
     print("Correct fusion classifications = " + str(correct / 100))
 
 
-def score_fusion_test(fusion_algorithm: FusionAlgorithm):
-    itad_heatmap = HeatMap(VerifierType.ITAD)
-    itad_matrix = itad_heatmap.combined_keystroke_matrix(1, 2, None, None, 1)
-    similarity_heatmap = HeatMap(VerifierType.SIMILARITY)
-    similarity_matrix = similarity_heatmap.combined_keystroke_matrix(
-        1, 2, None, None, 1
+# The verifiers whose scores are fused, all computed in a single pass
+FUSED_VERIFIERS = [VerifierType.ITAD, VerifierType.SIMILARITY, VerifierType.ABSOLUTE]
+
+
+def fused_matrices(
+    enroll_platform_id, probe_platform_id, enroll_session_id, probe_session_id
+):
+    heatmap = HeatMap(VerifierType.ITAD)
+    return ScoreFuser.from_matrices(
+        heatmap.multi_verifier_matrices(
+            FUSED_VERIFIERS,
+            enroll_platform_id,
+            probe_platform_id,
+            enroll_session_id,
+            probe_session_id,
+            1,
+        )
     )
-    absolute_heatmap = HeatMap(VerifierType.ABSOLUTE)
-    absolute_matrix = absolute_heatmap.combined_keystroke_matrix(1, 2, None, None, 1)
-    sf = ScoreFuser(itad_matrix, similarity_matrix, absolute_matrix)
+
+
+def score_fusion_test(fusion_algorithm: FusionAlgorithm):
+    sf = fused_matrices(1, 2, None, None)
     res = sf.find_matrix(fusion_algorithm)
     ids = all_ids()
     print(fusion_algorithm)
@@ -68,13 +80,7 @@ def score_fusion_test(fusion_algorithm: FusionAlgorithm):
 
 
 def platform_fusion_cross_test():
-    heatmap = HeatMap(VerifierType.SIMILARITY)
-    similarity_matrix = heatmap.combined_keystroke_matrix(1, 2, None, None, 1)
-    heatmap = HeatMap(VerifierType.ABSOLUTE)
-    absolute_matrix = heatmap.combined_keystroke_matrix(1, 2, None, None, 1)
-    heatmap = HeatMap(VerifierType.ITAD)
-    itad_matrix = heatmap.combined_keystroke_matrix(1, 2, None, None, 1)
-    sf = ScoreFuser(itad_matrix, similarity_matrix, absolute_matrix)
+    sf = fused_matrices(1, 2, None, None)
     for fusion_algorithm in FusionAlgorithm:
         res = sf.find_matrix(fusion_algorithm)
         ids = all_ids()
@@ -84,13 +90,7 @@ def platform_fusion_cross_test():
 
 
 def platform_even_split_fusion_cross_test():
-    heatmap = HeatMap(VerifierType.SIMILARITY)
-    similarity_matrix = heatmap.combined_keystroke_matrix(2, 2, [1, 3], [4, 6], 1)
-    heatmap = HeatMap(VerifierType.ABSOLUTE)
-    absolute_matrix = heatmap.combined_keystroke_matrix(2, 2, [1, 3], [4, 6], 1)
-    heatmap = HeatMap(VerifierType.ITAD)
-    itad_matrix = heatmap.combined_keystroke_matrix(2, 2, [1, 3], [4, 6], 1)
-    sf = ScoreFuser(itad_matrix, similarity_matrix, absolute_matrix)
+    sf = fused_matrices(2, 2, [1, 3], [4, 6])
     res = sf.find_matrix(FusionAlgorithm.MEDIAN)
     ids = all_ids()
     print("Instagram - even split")
@@ -98,13 +98,7 @@ def platform_even_split_fusion_cross_test():
 
 
 def single_platform_cross_test():
-    heatmap = HeatMap(VerifierType.ABSOLUTE)
-    absolute_matrix = heatmap.combined_keystroke_matrix(2, 1, None, None, 1)
-    heatmap = HeatMap(VerifierType.SIMILARITY)
-    similarity_matrix = heatmap.combined_keystroke_matrix(2, 1, None, None, 1)
-    heatmap = HeatMap(VerifierType.ITAD)
-    itad_matrix = heatmap.combined_keystroke_matrix(2, 1, None, None, 1)
-    sf = ScoreFuser(itad_matrix, similarity_matrix, absolute_matrix)
+    sf = fused_matrices(2, 1, None, None)
     res = sf.find_matrix(FusionAlgorithm.MEAN)
     ids = all_ids()
     print("I vs. F")
@@ -112,13 +106,7 @@ def single_platform_cross_test():
 
 
 def dual_platform_fusion_test():
-    heatmap = HeatMap(VerifierType.ABSOLUTE)
-    abs_matrix = heatmap.combined_keystroke_matrix([3, 2], 1, None, None, 1)
-    heatmap = HeatMap(VerifierType.SIMILARITY)
-    sim_matrix = heatmap.combined_keystroke_matrix([3, 2], 1, None, None, 1)
-    heatmap = HeatMap(VerifierType.ITAD)
-    itad_matrix = heatmap.combined_keystroke_matrix([3, 2], 1, None, None, 1)
-    sf = ScoreFuser(itad_matrix, sim_matrix, abs_matrix)
+    sf = fused_matrices([3, 2], 1, None, None)
     res = sf.find_matrix(FusionAlgorithm.MEAN)
     ids = all_ids()
     print("TI")
@@ -1,140 +1,42 @@
 import os
 import json
-import sys
-import enum
-import matplotlib.pyplot as plt
-import seaborn as sns
-from classifiers.template_generator import all_ids, read_compact_format
-from features.keystroke_features import (
-    create_kht_data_from_df,
-    create_kit_data_from_df,
-    word_hold,
+import logging
+from classifiers.template_generator import all_ids, get_user_by_platform
+from classifiers.template_store import (
+    TemplateStore,
+    family_for_kit,
+    family_for_ngraph,
 )
-from rich.progress import track
+from classifiers.session_templates import session_templates
+from features.compact_timings import compact_timing_unit
+from features.keystroke_features import DEFAULT_NGRAPH_MIN_COUNT, word_hold
 import classifiers.verifiers_library as vl
-from features.word_parser import SentenceParser
-
-path = os.path.dirname(os.getcwd())
-print(path)
-sys.path.insert(0, path)
-
-
-class VerifierType(enum.Enum):
-    """Enum class representing the different types of verifiers available."""
+from classifiers.shared_templates import score_matrices_in_processes
+from classifiers.verifier_registry import (
+    DEFAULT_THRESHOLDS,
+    ProbeSet,
+    VerifierType,
+    get_verifier,
+)
+from performance_evaluation.plotting import plot_score_matrix
+from performance_evaluation.score_matrix import (
+    DEFAULT_BLOCK_SIZE,
+    TiledScoreMatrix,
+    TopKScores,
+)
+from performance_evaluation.instrumentation import (
+    configure_from_config,
+    instrumentation,
+)
 
-    RELATIVE = 1
-    SIMILARITY = 2
-    SIMILARITY_UNWEIGHTED = 3
-    ABSOLUTE = 4
-    ITAD = 5
-    COSINE = 6
+logger = logging.getLogger(__name__)
 
 
-def get_user_by_platform(user_id, platform_id, session_id=None):
-    """
-    Retrieve data for a given user and platform, with an optional session_id filter.
-
-    Parameters:
-    - user_id (int): Identifier for the user.
-    - platform_id (int or list[int]): Identifier for the platform.
-      If provided as a list, it should contain two integers specifying
-      an inclusive range to search between.
-    - session_id (int or list[int], optional): Identifier for the session.
-      If provided as a list, it can either specify an inclusive range with
-      two integers or provide multiple session IDs to filter by.
-
-    Returns:
-    - DataFrame: Filtered data matching the given criteria.
-
-    Notes:
-    - When providing a list for platform_id or session_id to specify a range,
-      the order of the two integers does not matter.
-    - When providing a list with more than two integers for session_id,
-      it will filter by those exact session IDs.
-
-    Raises:
-    - AssertionError: If platform_id or session_id list does not follow the expected format.
-
-    Examples:
-    >>> df = get_user_by_platform(123, 1)
-    >>> df = get_user_by_platform(123, [1, 5])
-    >>> df = get_user_by_platform(123, 1, [2, 6])
-    >>> df = get_user_by_platform(123, 1, [2, 3, 4])
+def _track(sequence):
+    """Show the progress over `sequence`, importing rich only once a matrix is actually built"""
+    from rich.progress import track
 
-    """
-    # Get all of the data for a user amd platform with am optional session_id
-
-    # print(f"user_id:{user_id}", end=" | ")
-    df = read_compact_format()
-    if session_id is None:
-        if isinstance(platform_id, list):
-            # Should only contain an inclusive range of the starting id and ending id
-            assert len(platform_id) == 2
-            if platform_id[0] < platform_id[1]:
-                print("Session ID is:", session_id)
-                print("Dataframe is (look at the session id column):")
-                print(
-                    set(
-                        df[
-                            (df["user_ids"] == user_id)
-                            & (
-                                df["platform_id"].between(
-                                    platform_id[0], platform_id[1]
-                                )
-                            )
-                        ]["session_id"]
-                        .unique()
-                        .tolist()
-                    )
-                )
-                # input("Case 1")
-
-                return df[
-                    (df["user_ids"] == user_id)
-                    & (df["platform_id"].between(platform_id[0], platform_id[1]))
-                ]
-            else:
-                print("Dataframe is (look at the session id column):")
-                print(
-                    df[
-                        (df["user_ids"] == user_id)
-                        & (df["platform_id"].between(platform_id[1], platform_id[0]))
-                    ]
-                )
-                # input("Case 2")
-                return df[
-                    (df["user_ids"] == user_id)
-                    & (df["platform_id"].between(platform_id[1], platform_id[0]))
-                ]
-
-        return df[(df["user_ids"] == user_id) & (df["platform_id"] == platform_id)]
-    if isinstance(session_id, list):
-        # Should only contain an inclusive range of the starting id and ending id
-        if len(session_id) == 2:
-            return df[
-                (df["user_ids"] == user_id)
-                & (df["platform_id"] == platform_id)
-                & (df["session_id"].between(session_id[0], session_id[1]))
-            ]
-        elif len(session_id) > 2:
-            test = df[
-                (df["user_ids"] == user_id)
-                & (df["platform_id"] == platform_id)
-                & (df["session_id"].isin(session_id))
-            ]
-            # print(session_id)
-            # print(test["session_id"].unique())
-            # input()
-            return df[
-                (df["user_ids"] == user_id)
-                & (df["platform_id"] == platform_id)
-                & (df["session_id"].isin(session_id))
-            ]
-    return df[
-        (df["user_ids"] == user_id)
-        & (df["platform_id"] == platform_id)
-        & (df["session_id"] == session_id)
-    ]
+    return track(sequence)
 
 
 class HeatMap:
@@ -149,7 +51,273 @@ class HeatMap:
         self.p2_threshold = p2
         with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
             self.config = json.load(f)
-        print(f"----selected {verifier_type}")
+        configure_from_config(self.config)
+        logger.info("selected %s", verifier_type)
+
+    def _score(self, v, verifier_type=None):
+        """Run the selected verifier (or `verifier_type`) on an already constructed Verify instance"""
+        if verifier_type is None:
+            verifier_type = self.verifier_type
+        with instrumentation.stage(f"verifier.{verifier_type.name.lower()}"):
+            if verifier_type == VerifierType.ABSOLUTE:
+                return v.get_abs_match_score()
+            elif verifier_type == VerifierType.SIMILARITY:
+                return v.get_weighted_similarity_score()
+            elif verifier_type == VerifierType.SIMILARITY_UNWEIGHTED:
+                return v.get_similarity_score()
+            elif verifier_type == VerifierType.ITAD:
+                return v.itad_similarity()
+            elif verifier_type == VerifierType.COSINE:
+                return v.get_euclidean_knn_similarity()
+            elif verifier_type == VerifierType.RELATIVE:
+                return v.get_relative_score()
+            elif verifier_type == VerifierType.SCALED_MANHATTAN:
+                return v.get_scaled_manhattan_similarity()
+            else:
+                raise ValueError("Unknown VerifierType {}".format(verifier_type))
+
+    def _start_run(self):
+        instrumentation.reset()
+
+    def _finish_run(self, run_name):
+        instrumentation.emit_run_summary(
+            run_name,
+            trace_path=self.config.get("instrumentation_trace_path"),
+            profile_path=self.config.get("instrumentation_profile_path"),
+        )
+
+    def _template_store(self):
+        """
+        The optional on-disk template store named by "template_store_path" in the config.
+
+        Raises:
+        - ValueError: If the store's timings are not in the configured "compact_timing_unit".
+        """
+        store_path = self.config.get("template_store_path")
+        if not store_path:
+            return None
+        if getattr(self, "_store", None) is None:
+            store = TemplateStore(os.path.join(os.getcwd(), store_path))
+            unit = compact_timing_unit(self.config)
+            if store.timing_unit != unit:
+                raise ValueError(
+                    f"The template store {store_path} has compact_timing_unit "
+                    f"{store.timing_unit}, not {unit}"
+                )
+            self._store = store
+        return self._store
+
+    def _user_template(
+        self, user_id, platform_id, session_id, kit_feature_type=None, use_kht=True
+    ):
+        """
+        Extract the template of one user, with its KHT features if `use_kht` and the KIT flight
+        `kit_feature_type` if given, plus word hold features when configured.
+
+        The combined KHT and KIT templates also get the latencies of the frequent n-graphs when
+        "ngraph_n" is configured.
+
+        The template is merged from the cached templates of the selected sessions, or assembled
+        from the template store if one is configured; n-graph and word level features are only
+        available from the raw data.
+        """
+        families = []
+        if use_kht:
+            families.append("kht")
+        if kit_feature_type is not None:
+            families.append(family_for_kit(kit_feature_type))
+        ngraph_families = []
+        if use_kht and kit_feature_type is not None and self.config.get("ngraph_n"):
+            ngraph_families.append(
+                family_for_ngraph(
+                    int(self.config["ngraph_n"]),
+                    int(self.config.get("ngraph_min_count", DEFAULT_NGRAPH_MIN_COUNT)),
+                )
+            )
+        store = self._template_store()
+        if store is not None:
+            template = store.template(user_id, platform_id, session_id, families)
+            if not ngraph_families:
+                return template
+            return template | session_templates().template(
+                user_id, platform_id, session_id, ngraph_families
+            )
+        # The per-session templates are extracted once and merged for every selector
+        template = session_templates().template(
+            user_id, platform_id, session_id, families + ngraph_families
+        )
+        if use_kht and kit_feature_type is not None and self.config["use_word_holder"]:
+            from features.word_parser import SentenceParser
+
+            df = get_user_by_platform(user_id, platform_id, session_id)
+            sp = SentenceParser(os.path.join(os.getcwd(), "cleaned2.csv"))
+            with instrumentation.stage("word_hold_extraction"):
+                word_list = sp.get_words(df)
+                template = template | word_hold(word_list, df)
+        return template
+
+    def _prepare_probes(self, probes, thresholds, verifier_types=None):
+        """
+        Prepare probe templates once for the batched kernels of the registered verifiers, the
+        selected one unless `verifier_types` is given.
+
+        Writing the per-pair feature distribution is only done by Verify, so with
+        "print_feature_distribution" on the templates are left as they are and scored pair by pair.
+        """
+        if self.config["print_feature_distribution"]:
+            return probes
+        if verifier_types is None:
+            verifier_types = [self.verifier_type]
+        return ProbeSet(
+            [get_verifier(verifier_type) for verifier_type in verifier_types],
+            probes,
+            self.config,
+            tuple(thresholds) or DEFAULT_THRESHOLDS,
+        )
+
+    def _score_blocks(self, enrollments, probes, thresholds, verifier_types):
+        """
+        Score every enrollment template against every probe template with each of the verifiers,
+        sharing all of the work that does not depend on the verifier.
+
+        `probes` are either templates or the result of `_prepare_probes` for the same verifiers.
+
+        Returns:
+        - list[list[list[float]]]: One enrollment x probe matrix per verifier type.
+        """
+        if not isinstance(probes, ProbeSet):
+            probes = self._prepare_probes(probes, thresholds, verifier_types)
+        matrices = [[] for _ in verifier_types]
+        for enrollment in enrollments:
+            if isinstance(probes, ProbeSet):
+                rows = probes.score(enrollment).tolist()
+            else:
+                rows = [[] for _ in verifier_types]
+                for probe in probes:
+                    v = vl.Verify(enrollment, probe, *thresholds)
+                    for row, verifier_type in zip(rows, verifier_types):
+                        row.append(self._score(v, verifier_type))
+            for matrix, row in zip(matrices, rows):
+                matrix.append(row)
+        return matrices
+
+    def _score_block(self, enrollments, probes, thresholds):
+        """Score every enrollment template against every probe template, prepared or not"""
+        return self._score_blocks(
+            enrollments, probes, thresholds, [self.verifier_type]
+        )[0]
+
+    def _make_matrices(
+        self,
+        enroll_platform_id,
+        probe_platform_id,
+        enroll_session_id,
+        probe_session_id,
+        kit_feature_type,
+        use_kht,
+        thresholds,
+        verifier_types,
+    ):
+        ids = all_ids()
+        # Every template is extracted once and then reused for all of the pairs it is part of
+        probes = [
+            self._user_template(
+                j, probe_platform_id, probe_session_id, kit_feature_type, use_kht
+            )
+            for j in ids
+        ]
+        processes = self.config.get("scoring_processes", 1)
+        if processes > 1 and not self.config["print_feature_distribution"]:
+            enrollments = [
+                self._user_template(
+                    i, enroll_platform_id, enroll_session_id, kit_feature_type, use_kht
+                )
+                for i in _track(ids)
+            ]
+            matrices = score_matrices_in_processes(
+                verifier_types,
+                enrollments,
+                probes,
+                self.config,
+                tuple(thresholds) or DEFAULT_THRESHOLDS,
+                processes,
+            )
+            return matrices.tolist()
+        probes = self._prepare_probes(probes, thresholds, verifier_types)
+        matrices = [[] for _ in verifier_types]
+        for i in _track(ids):
+            logger.debug("current enrollment user id: %s", i)
+            enrollment = self._user_template(
+                i, enroll_platform_id, enroll_session_id, kit_feature_type, use_kht
+            )
+            blocks = self._score_blocks(
+                [enrollment], probes, thresholds, verifier_types
+            )
+            for matrix, block in zip(matrices, blocks):
+                matrix.extend(block)
+        return matrices
+
+    def _make_matrix(
+        self,
+        enroll_platform_id,
+        probe_platform_id,
+        enroll_session_id,
+        probe_session_id,
+        kit_feature_type,
+        use_kht,
+        thresholds,
+    ):
+        return self._make_matrices(
+            enroll_platform_id,
+            probe_platform_id,
+            enroll_session_id,
+            probe_session_id,
+            kit_feature_type,
+            use_kht,
+            thresholds,
+            [self.verifier_type],
+        )[0]
+
+    def _make_tiled_matrix(
+        self,
+        output_path,
+        block_size,
+        enroll_platform_id,
+        probe_platform_id,
+        enroll_session_id,
+        probe_session_id,
+        kit_feature_type,
+        use_kht,
+        thresholds,
+    ):
+        ids = all_ids()
+        matrix = TiledScoreMatrix.create(output_path, (len(ids), len(ids)))
+        for row_start in _track(range(0, len(ids), block_size)):
+            enrollments = [
+                self._user_template(
+                    i, enroll_platform_id, enroll_session_id, kit_feature_type, use_kht
+                )
+                for i in ids[row_start : row_start + block_size]
+            ]
+            # Only one band of enrollments and one tile of probes are in memory at a time
+            for column_start in range(0, len(ids), block_size):
+                probes = [
+                    self._user_template(
+                        j,
+                        probe_platform_id,
+                        probe_session_id,
+                        kit_feature_type,
+                        use_kht,
+                    )
+                    for j in ids[column_start : column_start + block_size]
+                ]
+                matrix.write_block(
+                    row_start,
+                    column_start,
+                    self._score_block(enrollments, probes, thresholds),
+                )
+        matrix.flush()
+        return matrix
 
     def make_kht_matrix(
         self, enroll_platform_id, probe_platform_id, enroll_session_id, probe_session_id
@@ -163,36 +331,17 @@ class HeatMap:
         # if not 1 <= enroll_platform_id <= 3 or not 1 <= probe_platform_id <= 3:
         #     raise ValueError("Platform ID must be between 1 and 3")
 
-        matrix = []
-        # TODO: We have to do a better job of figuring out how many users there
-        # are automatically so we don't need to keep changing it manually
-        ids = all_ids()
-        for i in track(ids):
-            print(i)
-            df = get_user_by_platform(i, enroll_platform_id, enroll_session_id)
-            enrollment = create_kht_data_from_df(df)
-            row = []
-            # TODO: We have to do a better job of figuring out how many users there
-            # are automatically so we don't need to keep changing it manually
-            for j in ids:
-                df = get_user_by_platform(j, probe_platform_id, probe_session_id)
-                probe = create_kht_data_from_df(df)
-                v = vl.Verify(enrollment, probe, self.p1_threshold, self.p2_threshold)
-                if self.verifier_type == VerifierType.ABSOLUTE:
-                    row.append(v.get_abs_match_score())
-                elif self.verifier_type == VerifierType.SIMILARITY:
-                    row.append(v.get_weighted_similarity_score())
-                elif self.verifier_type == VerifierType.SIMILARITY_UNWEIGHTED:
-                    row.append(v.get_similarity_score())
-                elif self.verifier_type == VerifierType.ITAD:
-                    row.append(v.itad_similarity())
-                elif self.verifier_type == VerifierType.COSINE:
-                    row.append(v.get_euclidean_knn_similarity())
-                else:
-                    raise ValueError(
-                        "Unknown VerifierType {}".format(self.verifier_type)
-                    )
-            matrix.append(row)
+        self._start_run()
+        matrix = self._make_matrix(
+            enroll_platform_id,
+            probe_platform_id,
+            enroll_session_id,
+            probe_session_id,
+            None,
+            True,
+            (self.p1_threshold, self.p2_threshold),
+        )
+        self._finish_run("make_kht_matrix")
         return matrix
 
     def make_kit_matrix(
@@ -215,32 +364,18 @@ class HeatMap:
         #     raise ValueError("Platform ID must be between 1 and 3")
         if not 1 <= kit_feature_type <= 4:
             raise ValueError("KIT feature type must be between 1 and 4")
-        print(self.verifier_type)
-        matrix = []
-        ids = all_ids()
-        for i in track(ids):
-            df = get_user_by_platform(i, enroll_platform_id, enroll_session_id)
-            enrollment = create_kit_data_from_df(df, kit_feature_type)
-            row = []
-            for j in ids:
-                df = get_user_by_platform(j, probe_platform_id, probe_session_id)
-                probe = create_kit_data_from_df(df, kit_feature_type)
-                v = vl.Verify(enrollment, probe)
-                if self.verifier_type == VerifierType.ABSOLUTE:
-                    row.append(v.get_abs_match_score())
-                elif self.verifier_type == VerifierType.SIMILARITY:
-                    row.append(v.get_weighted_similarity_score())
-                elif self.verifier_type == VerifierType.SIMILARITY_UNWEIGHTED:
-                    row.append(v.get_similarity_score())
-                elif self.verifier_type == VerifierType.ITAD:
-                    row.append(v.itad_similarity())
-                elif self.verifier_type == VerifierType.COSINE:
-                    row.append(v.get_euclidean_knn_similarity())
-                else:
-                    raise ValueError(
-                        "Unknown VerifierType {}".format(self.verifier_type)
-                    )
-            matrix.append(row)
+        logger.debug("making KIT matrix with %s", self.verifier_type)
+        self._start_run()
+        matrix = self._make_matrix(
+            enroll_platform_id,
+            probe_platform_id,
+            enroll_session_id,
+            probe_session_id,
+            kit_feature_type,
+            False,
+            (),
+        )
+        self._finish_run("make_kit_matrix")
         return matrix
 
     def combined_keystroke_matrix(
@@ -252,7 +387,8 @@ class HeatMap:
         kit_feature_type,
     ):
         """
-        Make a combined matrix of KIT and KHT features
+        Make a combined matrix of KIT and KHT features, plus word level features if
+        "use_word_holder" is configured
 
         Note if enroll_platform_id, probe_platform_id are None, then all ids are used.
         But if one of them are None the other must also be none
@@ -262,67 +398,158 @@ class HeatMap:
 
         if not 1 <= kit_feature_type <= 4:
             raise ValueError("KIT feature type must be between 1 and 4")
-        matrix = []
-        ids = all_ids()
-        for i in track(ids):
-            df = get_user_by_platform(i, enroll_platform_id, enroll_session_id)
-            print(
-                f"enroll_platform_id: {enroll_platform_id}, enroll_session_id: {enroll_session_id}, current enrollment user id: {i}, df.shape: {df.shape}"
-            )
+        self._start_run()
+        matrix = self._make_matrix(
+            enroll_platform_id,
+            probe_platform_id,
+            enroll_session_id,
+            probe_session_id,
+            kit_feature_type,
+            True,
+            (),
+        )
+        self._finish_run("combined_keystroke_matrix")
+        return matrix
 
-            kht_enrollment = create_kht_data_from_df(df)
-            kit_enrollment = create_kit_data_from_df(df, kit_feature_type)
-            if self.config["use_word_holder"]:
-                sp = SentenceParser(os.path.join(os.getcwd(), "cleaned2.csv"))
-                word_list = sp.get_words(df)
-                word_hold_enrollment = word_hold(word_list, df)
-                combined_enrollment = (
-                    kht_enrollment | kit_enrollment | word_hold_enrollment
-                )
-            else:
-                # kit_enrollment_2 = create_kit_data_from_df(df, 2)
-                # kit_enrollment_3 = create_kit_data_from_df(df, 3)
-                # kit_enrollment_4 = create_kit_data_from_df(df, 4)
-
-                combined_enrollment = (
-                    kht_enrollment | kit_enrollment
-                    # | kit_enrollment_2
-                    # | kit_enrollment_3
-                    # | kit_enrollment_4
-                )
-            row = []
-            for j in ids:
-                df = get_user_by_platform(j, probe_platform_id, probe_session_id)
-                print(
-                    f"probe_platform_id: {probe_platform_id}, probe_session_id: {probe_session_id}, current probe user id: {j}, df.shape: {df.shape}"
+    def multi_verifier_matrices(
+        self,
+        verifier_types,
+        enroll_platform_id,
+        probe_platform_id,
+        enroll_session_id,
+        probe_session_id,
+        kit_feature_type=None,
+        use_kht=True,
+    ):
+        """
+        Make the matrices of several verifiers in a single pass: the templates are extracted,
+        outlier filtered and intersected once, and only the verifier kernels run per verifier.
+
+        The features follow the single verifier builders: KHT only when kit_feature_type is None
+        (with this heatmap's p1/p2 feature selection thresholds, like `make_kht_matrix`), the combined
+        KHT and KIT features otherwise (like `combined_keystroke_matrix`), or KIT only if not `use_kht`
+        (like `make_kit_matrix`).
+
+        Parameters:
+        - verifier_types (list[VerifierType]): The verifiers to score with.
+
+        Returns:
+        - dict[VerifierType, list[list[float]]]: The enrollment x probe matrix of every verifier,
+          see `ScoreFuser.from_matrices` to fuse them.
+        """
+        if kit_feature_type is None:
+            if not use_kht:
+                raise ValueError("Either KHT or a KIT feature type must be selected")
+            thresholds = (self.p1_threshold, self.p2_threshold)
+        else:
+            if not 1 <= kit_feature_type <= 4:
+                raise ValueError("KIT feature type must be between 1 and 4")
+            thresholds = ()
+        verifier_types = list(verifier_types)
+        self._start_run()
+        matrices = self._make_matrices(
+            enroll_platform_id,
+            probe_platform_id,
+            enroll_session_id,
+            probe_session_id,
+            kit_feature_type,
+            use_kht,
+            thresholds,
+            verifier_types,
+        )
+        self._finish_run("multi_verifier_matrices")
+        return dict(zip(verifier_types, matrices))
+
+    def tiled_keystroke_matrix(
+        self,
+        enroll_platform_id,
+        probe_platform_id,
+        enroll_session_id,
+        probe_session_id,
+        kit_feature_type,
+        output_path,
+        block_size=DEFAULT_BLOCK_SIZE,
+    ):
+        """
+        Make the same combined KHT and KIT matrix as `combined_keystroke_matrix`, but score it tile by tile
+        (block_size enrollments x block_size probes) straight into a memory-mapped float32 file, so
+        neither the matrix nor all of the templates have to fit in memory.
+
+        Returns:
+        - TiledScoreMatrix: The matrix stored at `output_path`.
+        """
+        if not 1 <= kit_feature_type <= 4:
+            raise ValueError("KIT feature type must be between 1 and 4")
+        self._start_run()
+        matrix = self._make_tiled_matrix(
+            output_path,
+            block_size,
+            enroll_platform_id,
+            probe_platform_id,
+            enroll_session_id,
+            probe_session_id,
+            kit_feature_type,
+            True,
+            (),
+        )
+        self._finish_run("tiled_keystroke_matrix")
+        return matrix
+
+    def top_k_keystroke_matrix(
+        self,
+        enroll_platform_id,
+        probe_platform_id,
+        enroll_session_id,
+        probe_session_id,
+        kit_feature_type,
+        k=10,
+        block_size=DEFAULT_BLOCK_SIZE,
+    ):
+        """
+        Score the same combined KHT and KIT features as `combined_keystroke_matrix`, keeping
+        only the k best probes of every enrollment.
+
+        The candidate lists are oriented like the rows of the dense matrices, so their top-k
+        accuracy is the one `top_k_accuracy_score(ids, matrix)` computes over the dense matrix
+        and both are recorded under the same results store keys.
+
+        Probes are scored band by band against tiles of enrollments and every tile is folded into
+        the bounded candidate lists right away, so memory is O(N * k) instead of O(N^2).
+
+        Returns:
+        - TopKScores: For every enrollment id, the k best (probe index, score) pairs.
+        """
+        if not 1 <= kit_feature_type <= 4:
+            raise ValueError("KIT feature type must be between 1 and 4")
+        self._start_run()
+        ids = all_ids()
+        top = TopKScores.empty(query_ids=ids, candidate_ids=ids, k=k)
+        for probe_start in _track(range(0, len(ids), block_size)):
+            probes = [
+                self._user_template(
+                    j, probe_platform_id, probe_session_id, kit_feature_type
                 )
-                kht_probe = create_kht_data_from_df(df)
-                kit_probe = create_kit_data_from_df(df, kit_feature_type)
-                if self.config["use_word_holder"]:
-                    word_list = sp.get_words(df)
-                    word_hold_probe = word_hold(word_list, df)
-                    combined_probe = kht_probe | kit_probe | word_hold_probe
-                else:
-                    combined_probe = kht_probe | kit_probe
-                v = vl.Verify(combined_enrollment, combined_probe)
-                if self.verifier_type == VerifierType.ABSOLUTE:
-                    row.append(v.get_abs_match_score())
-                elif self.verifier_type == VerifierType.SIMILARITY:
-                    row.append(v.get_weighted_similarity_score())
-                elif self.verifier_type == VerifierType.SIMILARITY_UNWEIGHTED:
-                    row.append(v.get_similarity_score())
-                elif self.verifier_type == VerifierType.ITAD:
-                    row.append(v.itad_similarity())
-                elif self.verifier_type == VerifierType.COSINE:
-                    row.append(v.get_euclidean_knn_similarity())
-                else:
-                    raise ValueError(
-                        "Unknown VerifierType {}".format(self.verifier_type)
+                for j in ids[probe_start : probe_start + block_size]
+            ]
+            probes = self._prepare_probes(probes, ())
+            for enroll_start in range(0, len(ids), block_size):
+                enrollments = [
+                    self._user_template(
+                        i, enroll_platform_id, enroll_session_id, kit_feature_type
                     )
-            matrix.append(row)
-        return matrix
+                    for i in ids[enroll_start : enroll_start + block_size]
+                ]
+                block = self._score_block(enrollments, probes, ())
+                top.merge_block(enroll_start, probe_start, block)
+        self._finish_run("top_k_keystroke_matrix")
+        return top
+
+    def plot_heatmap(self, matrix, title=None, max_cells=512, **options):
+        """
+        Generate a heatmap from the provided feature matrix and optional title, see
+        `plot_score_matrix` for the options (output path, pooling and reordering).
 
-    def plot_heatmap(self, matrix, title=None):
-        """Generate a heatmap from the provided feature matrix and optional title"""
-        ax = sns.heatmap(matrix, linewidth=0.5).set_title(title)
-        plt.savefig(title)
+        Returns:
+        - str: The path of the saved image.
+        """
+        return plot_score_matrix(matrix, title, max_cells, **options)
@@ -0,0 +1,259 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class _NullStage:
+    """A do-nothing context manager handed out when instrumentation is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    """Times a single entry into a named stage and reports it back on exit"""
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.instrumentation.record(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+class Instrumentation:
+    """
+    Collects wall time and call counts for the named stages of a matrix build,
+    together with free-form counters and cache hit/miss tallies.
+
+    When disabled (the default) `stage` returns a shared no-op context manager and
+    the counting methods return immediately, so the instrumented hot paths only pay
+    for an attribute lookup and a branch.
+
+    Usage:
+    >>> with instrumentation.stage("kht_extraction"):
+    ...     enrollment = create_kht_data_from_df(df)
+    >>> instrumentation.cache_hit("compact_format")
+    >>> print(instrumentation.summary())
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self, trace=False):
+        """
+        Turn on collection.
+
+        Parameters:
+        - trace (bool): Also keep every individual stage entry so a Chrome trace
+          can be written out with `write_chrome_trace`.
+        """
+        self.enabled = True
+        self.trace_enabled = trace
+
+    def disable(self):
+        self.enabled = False
+        self.trace_enabled = False
+
+    def reset(self):
+        """Forget everything collected so far, keeping the enabled state"""
+        with self._lock:
+            self.stage_time_ns = defaultdict(int)
+            self.stage_calls = defaultdict(int)
+            self.counters = defaultdict(int)
+            self.cache_hits = defaultdict(int)
+            self.cache_misses = defaultdict(int)
+            self.events = []
+            self.run_start_ns = time.perf_counter_ns()
+
+    def stage(self, name):
+        """Return a context manager timing one entry into the stage `name`"""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def record(self, name, start_ns, end_ns):
+        with self._lock:
+            self.stage_time_ns[name] += end_ns - start_ns
+            self.stage_calls[name] += 1
+            if self.trace_enabled:
+                self.events.append((name, start_ns, end_ns, threading.get_ident()))
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += amount
+
+    def cache_hit(self, cache_name):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.cache_hits[cache_name] += 1
+
+    def cache_miss(self, cache_name):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.cache_misses[cache_name] += 1
+
+    def cache_hit_rate(self, cache_name):
+        """
+        Returns:
+        - float or None: The fraction of lookups of `cache_name` that hit, or None if it was never queried
+        """
+        total = self.cache_hits[cache_name] + self.cache_misses[cache_name]
+        if total == 0:
+            return None
+        return self.cache_hits[cache_name] / total
+
+    def as_dict(self):
+        """
+        Returns:
+        - dict: A JSON serializable profile with the per-stage totals, the counters
+          and the cache statistics of the current run.
+        """
+        with self._lock:
+            stages = {
+                name: {
+                    "calls": self.stage_calls[name],
+                    "total_seconds": self.stage_time_ns[name] / 1e9,
+                    "mean_seconds": self.stage_time_ns[name]
+                    / 1e9
+                    / self.stage_calls[name],
+                }
+                for name in self.stage_calls
+            }
+            caches = {
+                name: {
+                    "hits": self.cache_hits[name],
+                    "misses": self.cache_misses[name],
+                }
+                for name in set(self.cache_hits) | set(self.cache_misses)
+            }
+            counters = dict(self.counters)
+            wall = (time.perf_counter_ns() - self.run_start_ns) / 1e9
+        for name, cache in caches.items():
+            cache["hit_rate"] = self.cache_hit_rate(name)
+        return {
+            "wall_seconds": wall,
+            "stages": stages,
+            "counters": counters,
+            "caches": caches,
+        }
+
+    def summary(self):
+        """
+        Returns:
+        - str: A human readable table of the current run, slowest stage first
+        """
+        profile = self.as_dict()
+        lines = [f"Run wall time: {profile['wall_seconds']:.3f}s"]
+        lines.append(f"{'stage':<40}{'calls':>10}{'total (s)':>14}{'mean (ms)':>14}")
+        for name, stage in sorted(
+            profile["stages"].items(), key=lambda item: -item[1]["total_seconds"]
+        ):
+            lines.append(
+                f"{name:<40}{stage['calls']:>10}{stage['total_seconds']:>14.3f}"
+                f"{stage['mean_seconds'] * 1000:>14.3f}"
+            )
+        for name, value in sorted(profile["counters"].items()):
+            lines.append(f"counter {name}: {value}")
+        for name, cache in sorted(profile["caches"].items()):
+            lines.append(
+                f"cache {name}: {cache['hits']} hits, {cache['misses']} misses "
+                f"(hit rate {cache['hit_rate']:.1%})"
+            )
+        return "\n".join(lines)
+
+    def write_profile(self, filename):
+        """Write the `as_dict` profile of the current run to `filename` as JSON"""
+        with open(filename, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def write_chrome_trace(self, filename):
+        """
+        Write the recorded stage entries in the Chrome trace event format, viewable
+        in chrome://tracing or https://ui.perfetto.dev.
+
+        Only entries recorded while tracing was enabled are written.
+        """
+        pid = os.getpid()
+        with self._lock:
+            events = [
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start - self.run_start_ns) / 1000,
+                    "dur": (end - start) / 1000,
+                    "pid": pid,
+                    "tid": tid,
+                }
+                for name, start, end, tid in self.events
+            ]
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def emit_run_summary(self, run_name, trace_path=None, profile_path=None):
+        """
+        Log the summary of the current run and optionally persist it.
+
+        Parameters:
+        - run_name (str): A label for the run, used in the log message.
+        - trace_path (str, optional): Where to write a Chrome trace of the run.
+        - profile_path (str, optional): Where to write the JSON profile of the run.
+        """
+        if not self.enabled:
+            return
+        logger.info("Instrumentation summary for %s\n%s", run_name, self.summary())
+        if trace_path is not None and self.trace_enabled:
+            self.write_chrome_trace(trace_path)
+        if profile_path is not None:
+            self.write_profile(profile_path)
+
+
+# The process wide instance every instrumented module reports into
+instrumentation = Instrumentation()
+
+
+def configure_from_config(config):
+    """
+    Apply the instrumentation and logging settings of a loaded classifier_config.json.
+
+    Recognized (optional) keys:
+    - "log_level": The level of the root logger, e.g. "DEBUG" or "INFO". Defaults to "WARNING".
+    - "enable_instrumentation": Collect per-stage timers and counters.
+    - "instrumentation_trace_path": Also record a Chrome trace and write it here after each run.
+    - "instrumentation_profile_path": Write the JSON profile here after each run.
+    """
+    if not logging.getLogger().handlers:
+        logging.basicConfig(
+            level=str(config.get("log_level", "WARNING")).upper(),
+            format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        )
+    if config.get("enable_instrumentation", False):
+        instrumentation.enable(
+            trace=config.get("instrumentation_trace_path") is not None
+        )
+    else:
+        instrumentation.disable()
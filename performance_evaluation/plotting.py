@@ -0,0 +1,89 @@
+import os
+import re
+from performance_evaluation.score_matrix import (
+    TiledScoreMatrix,
+    cluster_order,
+    genuine_rank_order,
+)
+
+# How the rows and columns of a plotted matrix can be reordered
+MATRIX_ORDERS = ("genuine_rank", "cluster")
+
+
+def heatmap_path(title):
+    """
+    Returns:
+    - str: A file name for a plot with this title, e.g. "ff-combined-similarity.png".
+    """
+    name = re.sub(r"[^a-z0-9]+", "-", (title or "").lower()).strip("-")
+    return f"{name or 'heatmap'}.png"
+
+
+def plot_score_matrix(
+    matrix,
+    title=None,
+    max_cells=512,
+    path=None,
+    reduce="mean",
+    order=None,
+    ids=None,
+    cmap="viridis",
+):
+    """
+    Plot a score matrix as a heatmap image and save it.
+
+    The matrix is read one band of rows at a time, pooled down to at most max_cells x max_cells
+    cells and drawn with a single `imshow`, so plotting takes time linear in the size of the
+    matrix and memory in max_cells, however large the matrix. matplotlib is imported here rather
+    than at module level, so that building and scoring matrices never pays for it.
+
+    Parameters:
+    - matrix (list[list[float]], np.ndarray, TiledScoreMatrix or str): The enrollment x probe
+      scores, or the path of a `TiledScoreMatrix` .npy file, which is memory-mapped.
+    - title (str, optional): The title of the plot.
+    - max_cells (int): The largest number of rows and columns plotted, i.e. pixels of the image.
+    - path (str, optional): The file to save, defaults to a file name made from the title by
+      `heatmap_path`.
+    - reduce (str): How the cells of a pooled block are combined, "mean" or "max".
+    - order (str, optional): Reorder the rows and columns before pooling, by "genuine_rank"
+      (best recognized users first, which needs the ids) or by "cluster".
+    - ids (list[int], optional): The user id of every row, the columns being the sorted ids.
+
+    Returns:
+    - str: The path of the saved image.
+    """
+    import matplotlib.pyplot as plt
+
+    if isinstance(matrix, str):
+        matrix = TiledScoreMatrix.open(matrix)
+    elif not isinstance(matrix, TiledScoreMatrix):
+        matrix = TiledScoreMatrix.in_memory(matrix)
+    row_order = column_order = None
+    if order == "genuine_rank":
+        if ids is None:
+            raise ValueError("Ordering by genuine rank needs the ids of the rows")
+        row_order, column_order = genuine_rank_order(matrix, ids)
+    elif order == "cluster":
+        row_order, column_order = cluster_order(matrix, max_cells)
+    elif order is not None:
+        raise ValueError(f"Unknown order {order}, expected one of {MATRIX_ORDERS}")
+    pooled = matrix.pooled(max_cells, max_cells, reduce, row_order, column_order)
+    if path is None:
+        path = heatmap_path(title)
+    rows, columns = matrix.shape
+    figure, ax = plt.subplots(figsize=(9, 8))
+    image = ax.imshow(
+        pooled,
+        cmap=cmap,
+        aspect="auto",
+        interpolation="nearest",
+        extent=(0, columns, rows, 0),
+    )
+    figure.colorbar(image, ax=ax)
+    if title:
+        ax.set_title(title)
+    ax.set_xlabel("Probe")
+    ax.set_ylabel("Enrollment")
+    figure.savefig(path)
+    plt.close(figure)
+    return os.path.abspath(path)
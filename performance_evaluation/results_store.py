@@ -0,0 +1,266 @@
+import json
+import os
+import sqlite3
+import time
+
+TOP_K_ACCURACY = "top_k_accuracy"
+
+# The short names the plots give verifiers and fusion rules, e.g. "F-I-SIM" or "F-I-FMean"
+VERIFIER_LABELS = {"absolute": "ABS", "similarity": "SIM", "itad": "ITAD"}
+FUSION_LABELS = {"mean": "FMean", "median": "FMedian", "min": "FMin", "max": "FMax"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    description TEXT,
+    config TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    scenario TEXT NOT NULL,
+    verifier TEXT,
+    fusion TEXT,
+    fold INTEGER,
+    k INTEGER,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_by_key
+    ON results (scenario, verifier, fusion, fold, metric, k, run_id);
+"""
+
+# The most recent run that recorded the metric of the row r for its scenario, verifier and
+# fusion rule. A rerun supersedes all folds and ranks of the earlier run, also those it does
+# not record again
+_LATEST_RUN = """
+r.run_id = (
+    SELECT MAX(l.run_id) FROM results l
+    WHERE l.scenario = r.scenario AND l.verifier IS r.verifier AND l.fusion IS r.fusion
+      AND l.metric = r.metric
+)
+"""
+
+
+def results_store_path():
+    """
+    Returns:
+    - str: The optional "results_store_path" from the configuration file, or results.sqlite, in
+      the current working directory.
+    """
+    with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
+        configured = json.load(f).get("results_store_path")
+    return os.path.join(os.getcwd(), configured or "results.sqlite")
+
+
+def result_label(scenario, verifier=None, fusion=None):
+    """
+    Returns:
+    - str: The label of a result in the plots, e.g. "F-I-SIM" or "FI-T-FMean".
+    """
+    if fusion is not None:
+        return f"{scenario}-{FUSION_LABELS.get(fusion, fusion)}"
+    if verifier is not None:
+        return f"{scenario}-{VERIFIER_LABELS.get(verifier, verifier)}"
+    return scenario
+
+
+class ResultsRun:
+    """
+    The results of one experiment run, written to a `ResultsStore`.
+    """
+
+    def __init__(self, store, run_id):
+        self.store = store
+        self.run_id = run_id
+
+    def record(
+        self,
+        scenario,
+        value,
+        k=None,
+        verifier=None,
+        fusion=None,
+        fold=None,
+        metric=TOP_K_ACCURACY,
+    ):
+        """
+        Append one result.
+
+        Parameters:
+        - scenario (str): The enrollment and probe selection, e.g. "F" (Facebook even split),
+          "F-I" (Facebook enrollments, Instagram probes) or "FI-T".
+        - value (float): The result.
+        - k (int, optional): The rank of a top-k accuracy.
+        - verifier (str, optional): The verifier, e.g. "similarity".
+        - fusion (str, optional): The score fusion rule, e.g. "mean", for fused scores.
+        - fold (int, optional): The cross validation fold.
+        - metric (str): What the value measures.
+        """
+        self.record_many([(scenario, verifier, fusion, fold, k, metric, float(value))])
+
+    def record_top_k(self, scenario, accuracies, verifier=None, fusion=None, fold=None):
+        """
+        Append the top-k accuracies of one scenario for k = 1, 2, ...
+
+        Parameters:
+        - accuracies (list[float]): The top-1, top-2, ... accuracies.
+        """
+        self.record_many(
+            [
+                (scenario, verifier, fusion, fold, k, TOP_K_ACCURACY, float(accuracy))
+                for k, accuracy in enumerate(accuracies, start=1)
+            ]
+        )
+
+    def record_many(self, rows):
+        """
+        Append many results in one transaction.
+
+        Parameters:
+        - rows (iterable[tuple]): (scenario, verifier, fusion, fold, k, metric, value) tuples.
+        """
+        with self.store.connection:
+            self.store.connection.executemany(
+                "INSERT INTO results "
+                "(run_id, scenario, verifier, fusion, fold, k, metric, value) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(self.run_id, *row) for row in rows],
+            )
+
+
+class ResultsStore:
+    """
+    An append-only SQLite store of experiment results, keyed by scenario, verifier, fusion rule,
+    fold, k and metric, and indexed on that key.
+
+    Every run is kept. Queries return the results of the most recent run of every scenario,
+    verifier, fusion rule and metric unless asked for all of them, so rerunning an experiment
+    supersedes its earlier results, folds and ranks included, without deleting anything.
+
+    Usage:
+    >>> store = ResultsStore()
+    >>> run = store.start_run("cross platform sweep")
+    >>> run.record_top_k("F-I", [0.79, 0.92], verifier="similarity")
+    >>> store.top_k_table(["F-I"])
+    {'F-I-SIM': [0.79, 0.92]}
+    """
+
+    def __init__(self, path=None):
+        self.path = results_store_path() if path is None else path
+        self.connection = sqlite3.connect(self.path)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def start_run(self, description=None, config=None):
+        """
+        Parameters:
+        - description (str, optional): What the run is.
+        - config (dict, optional): The classifier configuration of the run, kept as JSON.
+
+        Returns:
+        - ResultsRun: The run, to record results into.
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (created_at, description, config) VALUES (?, ?, ?)",
+                (
+                    time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    description,
+                    None if config is None else json.dumps(config),
+                ),
+            )
+        return ResultsRun(self, cursor.lastrowid)
+
+    def runs(self):
+        """
+        Returns:
+        - list[dict]: Every run, oldest first.
+        """
+        return [
+            dict(row)
+            for row in self.connection.execute("SELECT * FROM runs ORDER BY run_id")
+        ]
+
+    def query(
+        self,
+        scenarios=None,
+        verifier=None,
+        fusion=None,
+        fold=None,
+        k=None,
+        metric=TOP_K_ACCURACY,
+        latest=True,
+    ):
+        """
+        Find results.
+
+        Parameters:
+        - scenarios (list[str], optional): The scenarios, defaults to all of them.
+        - verifier, fusion, fold, k (optional): Only the results with this verifier, fusion
+          rule, fold or k.
+        - metric (str): The metric.
+        - latest (bool): Only the results of the most recent run of every scenario, verifier,
+          fusion rule and metric.
+
+        Returns:
+        - list[dict]: The results ordered by scenario, verifier, fusion, fold, k and run.
+        """
+        conditions = ["r.metric = ?"]
+        parameters = [metric]
+        if scenarios is not None:
+            scenarios = list(scenarios)
+            conditions.append(f"r.scenario IN ({', '.join('?' * len(scenarios))})")
+            parameters.extend(scenarios)
+        for column, value in (
+            ("verifier", verifier),
+            ("fusion", fusion),
+            ("fold", fold),
+            ("k", k),
+        ):
+            if value is not None:
+                conditions.append(f"r.{column} = ?")
+                parameters.append(value)
+        if latest:
+            conditions.append(_LATEST_RUN)
+        return [
+            dict(row)
+            for row in self.connection.execute(
+                f"SELECT r.* FROM results r WHERE {' AND '.join(conditions)} "
+                "ORDER BY r.scenario, r.verifier, r.fusion, r.fold, r.k, r.run_id",
+                parameters,
+            )
+        ]
+
+    def top_k_table(self, scenarios, max_k=5, fold=None):
+        """
+        The top-k accuracies of every verifier and fusion rule of some scenarios, in the shape the
+        violin plots take.
+
+        Parameters:
+        - scenarios (list[str]): The scenarios.
+        - max_k (int): The largest k.
+        - fold (int, optional): Only this fold; otherwise the folds of a result are averaged.
+
+        Returns:
+        - dict[str, list[float]]: The top-1..max_k accuracies by `result_label`, in the order of
+          the scenarios.
+        """
+        scenarios = list(scenarios)
+        totals = {}
+        for row in self.query(scenarios, fold=fold):
+            if row["k"] is None or not 1 <= row["k"] <= max_k:
+                continue
+            label = result_label(row["scenario"], row["verifier"], row["fusion"])
+            key = (scenarios.index(row["scenario"]), label)
+            sums = totals.setdefault(key, [[0.0, 0] for _ in range(max_k)])
+            sums[row["k"] - 1][0] += row["value"]
+            sums[row["k"] - 1][1] += 1
+        return {
+            label: [total / count if count else float("nan") for total, count in sums]
+            for (_, label), sums in sorted(totals.items())
+        }
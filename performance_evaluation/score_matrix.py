@@ -0,0 +1,412 @@
+import numpy as np
+
+# The default edge length of the enrollment x probe tiles that are scored and stored at once
+DEFAULT_BLOCK_SIZE = 256
+
+
+class TiledScoreMatrix:
+    """
+    An enrollment x probe score matrix kept in a memory-mapped float32 .npy file, so that it never
+    has to be held in memory as a whole.
+
+    Rows are enrollments and columns are probes, like the nested lists returned by the `HeatMap`
+    matrix builders. Producers write it one tile at a time with `write_block`, and consumers read it
+    back one tile or one band of rows at a time with `iter_blocks` and `iter_row_blocks`.
+
+    Usage:
+    >>> matrix = TiledScoreMatrix.create("scores.npy", (100_000, 100_000))
+    >>> matrix.write_block(0, 0, np.ones((256, 256)))
+    >>> for row_start, rows in matrix.iter_row_blocks():
+    ...     ...
+    """
+
+    def __init__(self, array, path=None):
+        self.array = array
+        self.path = path
+
+    @classmethod
+    def create(cls, path, shape):
+        """
+        Create (or overwrite) a matrix file of the given shape, filled with zeros.
+
+        Parameters:
+        - path (str): The .npy file to create.
+        - shape (tuple[int, int]): The number of enrollments and probes.
+
+        Returns:
+        - TiledScoreMatrix: The writable matrix.
+        """
+        array = np.lib.format.open_memmap(
+            path, mode="w+", dtype=np.float32, shape=tuple(shape)
+        )
+        return cls(array, path)
+
+    @classmethod
+    def open(cls, path, mode="r"):
+        """Open an existing matrix file, read-only unless `mode` is "r+" """
+        return cls(np.load(path, mmap_mode=mode), path)
+
+    @classmethod
+    def in_memory(cls, matrix):
+        """Wrap a dense matrix (nested lists or an array) so it can be consumed block by block"""
+        return cls(np.asarray(matrix, dtype=np.float32))
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def write_block(self, row_start, column_start, block):
+        """Store a tile of scores whose top left corner is at (row_start, column_start)"""
+        block = np.asarray(block, dtype=np.float32)
+        self.array[
+            row_start : row_start + block.shape[0],
+            column_start : column_start + block.shape[1],
+        ] = block
+
+    def flush(self):
+        if isinstance(self.array, np.memmap):
+            self.array.flush()
+
+    def iter_row_blocks(self, block_rows=DEFAULT_BLOCK_SIZE):
+        """
+        Yields:
+        - tuple[int, np.ndarray]: The first row index and the scores of a band of at most
+          `block_rows` full rows.
+        """
+        for row_start in range(0, self.shape[0], block_rows):
+            yield row_start, np.asarray(self.array[row_start : row_start + block_rows])
+
+    def iter_blocks(self, block_rows=DEFAULT_BLOCK_SIZE, block_columns=None):
+        """
+        Yields:
+        - tuple[int, int, np.ndarray]: The top left corner and the scores of each tile, row band by row band.
+        """
+        if block_columns is None:
+            block_columns = block_rows
+        for row_start in range(0, self.shape[0], block_rows):
+            for column_start in range(0, self.shape[1], block_columns):
+                yield row_start, column_start, np.asarray(
+                    self.array[
+                        row_start : row_start + block_rows,
+                        column_start : column_start + block_columns,
+                    ]
+                )
+
+    def pooled(
+        self,
+        max_rows,
+        max_columns=None,
+        reduce="mean",
+        row_order=None,
+        column_order=None,
+    ):
+        """
+        Downsample the matrix to at most max_rows x max_columns cells by pooling equally sized
+        groups of rows and columns, reading one band of rows at a time.
+
+        Parameters:
+        - max_rows, max_columns (int): The largest output shape wanted.
+        - reduce (str): How a group of cells is pooled, "mean" or "max".
+        - row_order, column_order (array-like[int], optional): Permutations the rows and columns
+          are reordered by before pooling, e.g. from `genuine_rank_order` or `cluster_order`.
+
+        Returns:
+        - np.ndarray: The pooled matrix. It is the matrix itself when it is already small enough
+          and not reordered.
+        """
+        if max_columns is None:
+            max_columns = max_rows
+        if reduce not in ("mean", "max"):
+            raise ValueError(f"Unknown pooling {reduce}")
+        rows, columns = self.shape
+        row_factor = -(-rows // max_rows)
+        column_factor = -(-columns // max_columns)
+        # Groups of columns are contiguous, so each one is reduced with a single reduceat
+        column_starts = np.arange(0, columns, column_factor)
+        column_counts = np.diff(np.append(column_starts, columns))
+        pooled = []
+        # Read whole groups of rows at once so no group straddles two bands
+        band = max(1, DEFAULT_BLOCK_SIZE // row_factor) * row_factor
+        for row_start, block in self._iter_ordered_row_blocks(band, row_order):
+            block = block.astype(np.float64)
+            if column_order is not None:
+                block = block[:, column_order]
+            row_starts = np.arange(0, block.shape[0], row_factor)
+            if reduce == "mean":
+                row_counts = np.diff(np.append(row_starts, block.shape[0]))
+                summed = np.add.reduceat(block, row_starts, axis=0)
+                summed = np.add.reduceat(summed, column_starts, axis=1)
+                pooled.append(summed / np.outer(row_counts, column_counts))
+            else:
+                maxed = np.maximum.reduceat(block, row_starts, axis=0)
+                pooled.append(np.maximum.reduceat(maxed, column_starts, axis=1))
+        return np.concatenate(pooled) if pooled else np.zeros((0, len(column_starts)))
+
+    def _iter_ordered_row_blocks(self, block_rows, row_order=None):
+        """
+        Like `iter_row_blocks`, but with the rows in the order of a permutation. The rows of a band
+        are read from the file in file order and only then put in the order of the permutation.
+        """
+        if row_order is None:
+            yield from self.iter_row_blocks(block_rows)
+            return
+        row_order = np.asarray(row_order, dtype=np.int64)
+        for row_start in range(0, len(row_order), block_rows):
+            band = row_order[row_start : row_start + block_rows]
+            in_file_order = np.sort(band)
+            block = np.asarray(self.array[in_file_order])
+            yield row_start, block[np.searchsorted(in_file_order, band)]
+
+
+def genuine_rank_order(matrix, ids, block_rows=DEFAULT_BLOCK_SIZE):
+    """
+    Order the rows by the rank of their genuine score, best recognized users first, reading one
+    band of rows at a time.
+
+    Parameters:
+    - matrix (TiledScoreMatrix or array-like): The enrollment x probe scores.
+    - ids (list[int]): The id of every row, the columns being the sorted distinct ids.
+    - block_rows (int): The number of rows read at once.
+
+    Returns:
+    - tuple[np.ndarray, np.ndarray]: The row order and the column order, in which every column
+      follows the row of its user so the genuine scores stay on the diagonal.
+    """
+    if not isinstance(matrix, TiledScoreMatrix):
+        matrix = TiledScoreMatrix.in_memory(matrix)
+    true_columns = true_label_columns(ids)
+    ranks = np.empty(len(true_columns), dtype=np.int64)
+    for row_start, block in matrix.iter_row_blocks(block_rows):
+        rows = np.arange(block.shape[0])
+        genuine = block[rows, true_columns[row_start : row_start + block.shape[0]]]
+        ranks[row_start : row_start + block.shape[0]] = (
+            block > genuine[:, np.newaxis]
+        ).sum(axis=1)
+    row_order = np.argsort(ranks, kind="stable")
+    # The first row of every user decides where the user's column goes
+    columns = true_columns[row_order]
+    _, first = np.unique(columns, return_index=True)
+    column_order = columns[np.sort(first)]
+    missing = np.setdiff1d(np.arange(matrix.shape[1]), column_order)
+    return row_order, np.concatenate([column_order, missing])
+
+
+def cluster_order(matrix, max_cells=512, block_rows=DEFAULT_BLOCK_SIZE):
+    """
+    Order the rows and columns so that those scoring highest against the same part of the matrix
+    are next to each other, in linear time: every row is summarized by its column profile pooled
+    to max_cells groups and clustered by the group it scores highest in, strongest first; the
+    columns alike by their pooled row profiles.
+
+    Returns:
+    - tuple[np.ndarray, np.ndarray]: The row order and the column order.
+    """
+    if not isinstance(matrix, TiledScoreMatrix):
+        matrix = TiledScoreMatrix.in_memory(matrix)
+    row_profiles = np.concatenate(
+        [
+            TiledScoreMatrix.in_memory(block).pooled(len(block), max_cells)
+            for _, block in matrix.iter_row_blocks(block_rows)
+        ]
+    )
+    column_profiles = matrix.pooled(max_cells, matrix.shape[1]).T
+    return _profile_order(row_profiles), _profile_order(column_profiles)
+
+
+def _profile_order(profiles):
+    best = np.argmax(profiles, axis=1)
+    strength = profiles[np.arange(len(profiles)), best]
+    return np.lexsort((-strength, best))
+
+
+def true_label_columns(ids, column_ids=None):
+    """
+    Find the column of the correct probe for every row, following the label encoding of
+    sklearn's `top_k_accuracy_score`: the columns correspond to the sorted distinct ids.
+
+    Parameters:
+    - ids (list[int]): The id of every row.
+    - column_ids (list[int], optional): The ids of the columns, defaults to the sorted distinct `ids`.
+
+    Returns:
+    - np.ndarray[int]: The column index of every row's true id.
+    """
+    ids = np.asarray(ids)
+    classes = np.unique(ids) if column_ids is None else np.asarray(column_ids)
+    columns = np.searchsorted(classes, ids)
+    if np.any(columns >= len(classes)) or np.any(classes[columns] != ids):
+        raise ValueError("Every row id must also be a column id")
+    return columns
+
+
+def top_k_hits(block, true_columns, k):
+    """
+    Check for a band of rows whether the true column is among the k best scores, breaking ties
+    exactly like sklearn's `top_k_accuracy_score`.
+
+    Parameters:
+    - block (np.ndarray): The scores of a band of full rows.
+    - true_columns (np.ndarray[int]): The true column of each row of the band.
+    - k (int): The number of best scores considered.
+
+    Returns:
+    - np.ndarray[bool]: Whether each row is a top-k hit.
+    """
+    best = np.argsort(block, axis=1, kind="mergesort")[:, ::-1][:, :k]
+    return np.any(best == np.asarray(true_columns)[:, None], axis=1)
+
+
+def top_k_accuracy_blockwise(matrix, ids, k, block_rows=DEFAULT_BLOCK_SIZE):
+    """
+    Compute the top-k accuracy of a score matrix one band of rows at a time.
+
+    Parameters:
+    - matrix (TiledScoreMatrix or array-like): The enrollment x probe scores.
+    - ids (list[int]): The id of every row (enrollment), the columns being the sorted distinct ids.
+    - k (int): The number of best scores considered.
+    - block_rows (int): The number of rows read at once.
+
+    Returns:
+    - float: The fraction of rows whose own id is among their k best scoring columns.
+    """
+    if not isinstance(matrix, TiledScoreMatrix):
+        matrix = TiledScoreMatrix.in_memory(matrix)
+    true_columns = true_label_columns(ids)
+    hits = 0
+    for row_start, block in matrix.iter_row_blocks(block_rows):
+        hits += int(
+            top_k_hits(
+                block, true_columns[row_start : row_start + block.shape[0]], k
+            ).sum()
+        )
+    return hits / len(true_columns)
+
+
+def rank_candidates(scores, candidates, k):
+    """
+    Order the candidates of every row best first and keep k of them. Ties are broken towards the
+    larger candidate index, which is the order sklearn's `top_k_accuracy_score` ranks ties in.
+    """
+    order = np.lexsort((-candidates, -scores), axis=-1)[:, :k]
+    return (
+        np.take_along_axis(scores, order, axis=1),
+        np.take_along_axis(candidates, order, axis=1),
+    )
+
+
+class TopKScores:
+    """
+    The k best scoring candidates of every query, a compact (N x K) alternative to a dense
+    N x N score matrix for identification workloads.
+
+    Row q holds the indices (into `candidate_ids`) and scores of the K candidates that match query
+    `query_ids[q]` best, best first. The experiments take the enrollments as the queries and the
+    probes as the candidates, the orientation of the rows of a dense enrollment x probe matrix,
+    so `top_k_accuracy` equals `top_k_accuracy_score(ids, matrix)` over that matrix. Memory is
+    O(N * K) and the rows can be filled tile by tile with `merge_block`, which folds a tile of
+    scores into the bounded per-row candidate lists.
+
+    Usage:
+    >>> top = TopKScores.empty(query_ids=ids, candidate_ids=ids, k=10)
+    >>> top.merge_block(0, 0, scores_of_first_tile)
+    >>> top.top_k_accuracy(5)
+    """
+
+    def __init__(self, indices, scores, query_ids, candidate_ids):
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        self.query_ids = np.asarray(query_ids)
+        self.candidate_ids = np.asarray(candidate_ids)
+
+    @classmethod
+    def empty(cls, query_ids, candidate_ids, k):
+        """Returns an instance without any candidates yet, to be filled with `merge_block`"""
+        k = min(k, len(candidate_ids))
+        return cls(
+            np.full((len(query_ids), k), -1),
+            np.full((len(query_ids), k), -np.inf),
+            query_ids,
+            candidate_ids,
+        )
+
+    @classmethod
+    def from_dense(cls, matrix, query_ids, candidate_ids, k):
+        """
+        Keep the k best columns of every row of a dense (query x candidate) matrix.
+
+        Note that the matrices of the `HeatMap` builders are enrollment x probe, so they have to be
+        transposed for probes to be the queries.
+        """
+        top = cls.empty(query_ids, candidate_ids, k)
+        if not isinstance(matrix, TiledScoreMatrix):
+            matrix = TiledScoreMatrix.in_memory(matrix)
+        for row_start, band in matrix.iter_row_blocks():
+            top.merge_block(row_start, 0, band)
+        return top
+
+    @property
+    def k(self):
+        return self.indices.shape[1]
+
+    def __len__(self):
+        return len(self.query_ids)
+
+    def merge_block(self, query_start, candidate_start, block):
+        """
+        Fold a tile of scores into the candidate lists of its queries.
+
+        Parameters:
+        - query_start (int): The index of the first query (row) of the tile.
+        - candidate_start (int): The index of the first candidate (column) of the tile.
+        - block (array-like): The scores of the tile, queries x candidates.
+        """
+        block = np.asarray(block, dtype=np.float32)
+        rows = slice(query_start, query_start + block.shape[0])
+        tile_candidates = np.broadcast_to(
+            np.arange(candidate_start, candidate_start + block.shape[1]), block.shape
+        )
+        scores = np.concatenate([self.scores[rows], block], axis=1)
+        candidates = np.concatenate([self.indices[rows], tile_candidates], axis=1)
+        self.scores[rows], self.indices[rows] = rank_candidates(
+            scores, candidates, self.k
+        )
+
+    def candidate_id_matrix(self):
+        """
+        Returns:
+        - np.ndarray: The id of each of the k best candidates of every query, best first.
+        """
+        return self.candidate_ids[self.indices]
+
+    def top_k_accuracy(self, k):
+        """
+        Returns:
+        - float: The fraction of queries whose own id is among their k best candidates.
+        """
+        if k > self.k:
+            raise ValueError(f"Only the top {self.k} candidates were kept")
+        hits = self.candidate_id_matrix()[:, :k] == self.query_ids[:, None]
+        return float(np.mean(np.any(hits, axis=1)))
+
+    def save(self, path):
+        """Write the candidate lists to an .npz file"""
+        np.savez(
+            path,
+            indices=self.indices,
+            scores=self.scores,
+            query_ids=self.query_ids,
+            candidate_ids=self.candidate_ids,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data["indices"],
+                data["scores"],
+                data["query_ids"],
+                data["candidate_ids"],
+            )
@@ -1,43 +1,27 @@
+import os
+import sys
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
 
-# Given data multiplied by 100
-data = {
-    "FI-T-ABS": [83.3333, 87.5, 87.5, 87.5, 87.5],
-    "FI-T-SIM": [79.1667, 79.1667, 87.5, 87.5, 87.5],
-    "FI-T-ITAD": [75, 79.1667, 79.1667, 83.3333, 83.3333],
-    "FI-T-FMean": [87.5, 87.5, 87.5, 87.5, 87.5],
-    "FI-T-FMedian": [83.3333, 87.5, 87.5, 87.5, 87.5],
-    "FT-I-ABS": [91.6667, 91.6667, 91.6667, 91.6667, 91.6667],
-    "FT-I-SIM": [83.3333, 87.5, 91.6667, 91.6667, 91.6667],
-    "FT-I-ITAD": [91.6667, 91.6667, 91.6667, 91.6667, 91.6667],
-    "FT-I-FMean": [91.6667, 91.6667, 91.6667, 91.6667, 91.6667],
-    "FT-I-FMedian": [91.6667, 91.6667, 91.6667, 91.6667, 91.6667],
-    "IF-T-ABS": [83.3333, 87.5, 87.5, 87.5, 87.5],
-    "IF-T-SIM": [79.1667, 79.1667, 87.5, 87.5, 87.5],
-    "IF-T-ITAD": [75, 79.1667, 79.1667, 83.3333, 83.3333],
-    "IF-T-FMean": [87.5, 87.5, 87.5, 87.5, 87.5],
-    "IF-T-FMedian": [83.3333, 87.5, 87.5, 87.5, 87.5],
-    "IT-F-ABS": [91.6667, 91.6667, 91.6667, 91.6667, 91.6667],
-    "IT-F-SIM": [75, 83.3333, 83.3333, 87.5, 87.5],
-    "IT-F-ITAD": [83.3333, 87.5, 91.6667, 95.8333, 95.8333],
-    "IT-F-FMean": [87.5, 91.6667, 95.8333, 95.8333, 95.8333],
-    "IT-F-FMedian": [91.6667, 91.6667, 91.6667, 91.6667, 91.6667],
-    "TF-I-ABS": [91.6667, 91.6667, 91.6667, 91.6667, 91.6667],
-    "TF-I-SIM": [83.3333, 87.5, 91.6667, 91.6667, 91.6667],
-    "TF-I-ITAD": [91.6667, 91.6667, 91.6667, 91.6667, 91.6667],
-    "TF-I-FMean": [91.6667, 91.6667, 91.6667, 91.6667, 91.6667],
-    "TF-I-FMedian": [91.6667, 91.6667, 91.6667, 91.6667, 91.6667],
-    "TI-F-ABS": [91.6667, 91.6667, 91.6667, 91.6667, 91.6667],
-    "TI-F-SIM": [75, 83.3333, 83.3333, 87.5, 87.5],
-    "TI-F-ITAD": [83.3333, 87.5, 91.6667, 95.8333, 95.8333],
-    "TI-F-FMean": [87.5, 91.6667, 95.8333, 95.8333, 95.8333],
-    "TI-F-FMedian": [91.6667, 91.6667, 91.6667, 91.6667, 91.6667],
-}
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from performance_evaluation.results_store import ResultsStore  # noqa: E402
+
+# The top-1..5 accuracies of every verifier and fusion rule, recorded by
+# python experiments.py --sweep combined-cross-platform
+SCENARIOS = ["FI-T", "FT-I", "IF-T", "IT-F", "TF-I", "TI-F"]
+data = ResultsStore().top_k_table(SCENARIOS)
+if not data:
+    sys.exit(
+        "No results of these scenarios in the results store yet, record them with: "
+        "python experiments.py --sweep combined-cross-platform"
+    )
 
 # Convert dictionary to DataFrame
 df = pd.DataFrame(data)
+# Multiply every value by 100
+df = df * 100
 
 # Sorting columns by median in ascending order
 sorted_columns = df.median().sort_values().index
@@ -1,40 +1,22 @@
+import os
+import sys
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
 
-# Given data
-data = {
-    "F-I-ABS": [0.75, 0.75, 0.833333, 0.916667, 0.916667],
-    "F-I-SIM": [0.791667, 0.791667, 0.791667, 0.833333, 0.875],
-    "F-I-ITAD": [0.708333, 0.791667, 0.791667, 0.791667, 0.833333],
-    "F-I-FMean": [0.791667, 0.916667, 0.916667, 0.916667, 0.916667],
-    "F-I-FMedian": [0.75, 0.75, 0.833333, 0.916667, 0.916667],
-    "F-T-ABS": [0.791667, 0.833333, 0.875, 0.875, 0.875],
-    "F-T-SIM": [0.708333, 0.791667, 0.833333, 0.833333, 0.833333],
-    "F-T-ITAD": [0.708333, 0.791667, 0.791667, 0.791667, 0.833333],
-    "F-T-FMean": [0.833333, 0.875, 0.875, 0.875, 0.875],
-    "F-T-FMedian": [0.791667, 0.833333, 0.875, 0.875, 0.875],
-    "I-F-ABS": [0.791667, 0.833333, 0.875, 0.916667, 0.916667],
-    "I-F-SIM": [0.75, 0.833333, 0.833333, 0.875, 0.875],
-    "I-F-ITAD": [0.75, 0.791667, 0.875, 0.916667, 0.916667],
-    "I-F-FMean": [0.875, 0.916667, 0.916667, 0.916667, 0.916667],
-    "I-F-FMedian": [0.791667, 0.833333, 0.875, 0.916667, 0.916667],
-    "I-T-ABS": [0.833333, 0.833333, 0.833333, 0.833333, 0.833333],
-    "I-T-SIM": [0.666667, 0.708333, 0.791667, 0.833333, 0.833333],
-    "I-T-ITAD": [0.625, 0.75, 0.791667, 0.791667, 0.833333],
-    "I-T-FMean": [0.833333, 0.833333, 0.833333, 0.833333, 0.833333],
-    "I-T-FMedian": [0.833333, 0.833333, 0.833333, 0.833333, 0.833333],
-    "T-F-ABS": [0.791667, 0.791667, 0.791667, 0.791667, 0.833333],
-    "T-F-SIM": [0.708333, 0.75, 0.791667, 0.833333, 0.875],
-    "T-F-ITAD": [0.666667, 0.75, 0.833333, 0.833333, 0.833333],
-    "T-F-FMean": [0.833333, 0.833333, 0.875, 0.875, 0.875],
-    "T-F-FMedian": [0.791667, 0.791667, 0.791667, 0.791667, 0.833333],
-    "T-I-ABS": [0.75, 0.833333, 0.833333, 0.833333, 0.833333],
-    "T-I-SIM": [0.75, 0.833333, 0.833333, 0.833333, 0.833333],
-    "T-I-ITAD": [0.75, 0.75, 0.791667, 0.791667, 0.791667],
-    "T-I-FMean": [0.833333, 0.833333, 0.833333, 0.833333, 0.833333],
-    "T-I-FMedian": [0.75, 0.833333, 0.833333, 0.833333, 0.833333],
-}
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from performance_evaluation.results_store import ResultsStore  # noqa: E402
+
+# The top-1..5 accuracies of every verifier and fusion rule, recorded by
+# python experiments.py --sweep cross-platform
+SCENARIOS = ["F-I", "F-T", "I-F", "I-T", "T-F", "T-I"]
+data = ResultsStore().top_k_table(SCENARIOS)
+if not data:
+    sys.exit(
+        "No results of these scenarios in the results store yet, record them with: "
+        "python experiments.py --sweep cross-platform"
+    )
 
 # Convert dictionary to DataFrame
 df = pd.DataFrame(data)
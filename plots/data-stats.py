@@ -1,6 +1,16 @@
+import os
+import sys
 import matplotlib.pyplot as plt
 import numpy as np
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataset_stats import (  # noqa: E402
+    dataset_report,
+    mean_samples_for_platform,
+    mean_samples_per_session,
+)
+
 
 def remove_spines(ax):
     ax.spines["top"].set_visible(False)
@@ -9,7 +19,9 @@ def remove_spines(ax):
     ax.spines["right"].set_visible(False)
 
 
-# Data definitions
+# Data definitions. Gender and handedness come from the study survey, the mean keystroke
+# counts from the (cached) statistics report of the configured dataset
+report = dataset_report()
 labels_gender = ["M", "F", "Others"]
 sizes_gender = [38, 54, 8]
 
@@ -17,10 +29,13 @@ labels_handedness = ["Left", "Right"]
 sizes_handedness = [13.6, 86.4]
 
 labels_platform = ["Facebook", "Instagram", "Twitter"]
-sizes_platform = [29997, 22317, 18332]
+sizes_platform = [mean_samples_for_platform(platform, report) for platform in (1, 2, 3)]
 
+# The extra session 7 of a single user is left out, see dataset_stats.keystrokes_per_session
 labels_session = ["1", "2", "3", "4", "5", "6"]
-sizes_session = [2462, 1981, 1983, 1787, 1809, 1730]
+sizes_session = [
+    mean_samples_per_session(session, report) for session in labels_session
+]
 
 # Adjusting the color palette for better visibility and aesthetics
 colors_adjusted = {
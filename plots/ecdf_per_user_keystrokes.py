@@ -1,40 +1,19 @@
+import os
+import sys
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 import seaborn as sns
 from scipy.interpolate import make_interp_spline
 
-# Data
-user_ids = [
-    i for i in range(1, 27) if i != 22
-]  # Excluding 22 as it's missing from the data
-sample_counts = [
-    1193,
-    755,
-    814,
-    745,
-    426,
-    867,
-    376,
-    1138,
-    587,
-    1132,
-    1122,
-    1128,
-    1871,
-    1194,
-    931,
-    742,
-    984,
-    703,
-    2537,
-    768,
-    1043,
-    930,
-    699,
-    512,
-    362,
-]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataset_stats import dataset_report, mean_samples_for_user  # noqa: E402
+
+# The mean keystrokes of every user, from the (cached) statistics report of the configured
+# dataset
+report = dataset_report()
+sample_counts = [mean_samples_for_user(user_id, report) for user_id in report["users"]]
 
 # Calculate ECDF
 x = np.sort(sample_counts)
@@ -43,16 +22,23 @@ y = np.arange(1, len(x) + 1) / len(x)
 # Defining the color palette
 colors_adjusted = {"silver": "#e6e6fa", "gray": "#808080"}
 
-# Interpolating the data for a smoother curve
-x_new = np.linspace(
-    min(x), max(x), 500
-)  # Create 500 evenly spaced values within the range of x
-y_new = np.interp(x_new, x, y)  # Interpolate a smooth curve based on original x and y
+if len(np.unique(x)) > 3:
+    # Interpolating the data for a smoother curve
+    x_new = np.linspace(
+        min(x), max(x), 500
+    )  # Create 500 evenly spaced values within the range of x
+    y_new = np.interp(
+        x_new, x, y
+    )  # Interpolate a smooth curve based on original x and y
 
-# Using a spline interpolation to further smooth the ECDF
-x_spline = np.linspace(x_new.min(), x_new.max(), 1000)
-spline = make_interp_spline(x_new, y_new, k=3)  # Using a 3rd degree spline
-y_spline = spline(x_spline)
+    # Using a spline interpolation to further smooth the ECDF
+    x_spline = np.linspace(x_new.min(), x_new.max(), 1000)
+    spline = make_interp_spline(x_new, y_new, k=3)  # Using a 3rd degree spline
+    y_spline = spline(x_spline)
+else:
+    # Too few distinct counts (e.g. a dataset cleansed to the same number of keystrokes
+    # per user) to smooth, so the ECDF is plotted as it is
+    x_spline, y_spline = x, y
 
 # Plotting the further smoothed ECDF
 plt.figure(figsize=(12, 7))
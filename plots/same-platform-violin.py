@@ -1,8 +1,14 @@
 # Import necessary libraries
+import os
+import sys
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from performance_evaluation.results_store import ResultsStore  # noqa: E402
+
 
 def remove_spines(ax):
     ax.spines["top"].set_visible(False)
@@ -11,24 +17,15 @@ def remove_spines(ax):
     ax.spines["right"].set_visible(False)
 
 
-# Define the data
-data_violin = {
-    "F-ABS": [0.625, 0.708333, 0.791667, 0.833333, 0.875],
-    "F-SIM": [0.708333, 0.791667, 0.875, 0.916667, 0.958333],
-    "F-ITAD": [0.666667, 0.833333, 0.833333, 0.875, 0.875],
-    "F-FMean": [0.916667, 1, 1, 1, 1],
-    "F-FMedian": [0.666667, 0.791667, 0.875, 0.916667, 0.958333],
-    "I-ABS": [0.458333, 0.5, 0.708333, 0.75, 0.791667],
-    "I-SIM": [0.708333, 0.791667, 0.791667, 0.833333, 0.833333],
-    "I-ITAD": [0.75, 0.833333, 0.833333, 0.875, 0.875],
-    "I-FMean": [0.791667, 0.833333, 0.875, 0.875, 0.875],
-    "I-FMedian": [0.5, 0.583333, 0.708333, 0.791667, 0.833333],
-    "T-ABS": [0.5, 0.75, 0.791667, 0.833333, 0.833333],
-    "T-SIM": [0.583333, 0.666667, 0.75, 0.791667, 0.833333],
-    "T-ITAD": [0.5, 0.708333, 0.833333, 0.875, 0.875],
-    "T-FMean": [0.75, 0.791667, 0.875, 0.875, 0.875],
-    "T-FMedian": [0.625, 0.708333, 0.791667, 0.833333, 0.833333],
-}
+# The top-1..5 accuracies of every verifier and fusion rule, recorded by
+# python experiments.py --sweep same-platform
+SCENARIOS = ["F", "I", "T"]
+data_violin = ResultsStore().top_k_table(SCENARIOS)
+if not data_violin:
+    sys.exit(
+        "No results of these scenarios in the results store yet, record them with: "
+        "python experiments.py --sweep same-platform"
+    )
 
 # Convert the data to DataFrame
 df_violin = pd.DataFrame(data_violin)
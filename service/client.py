@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import json
+from service.verification_service import DEFAULT_PORT
+
+
+def keystrokes_from_df(df):
+    """
+    Returns:
+    - dict: The keystrokes of a compact format DataFrame as the payload expected by the service.
+      The times must be in nanoseconds, as read by `read_compact_format_file`, and not compact
+      timings.
+    """
+    return {
+        "key": df["key"].tolist(),
+        "press_time": df["press_time"].tolist(),
+        "release_time": df["release_time"].tolist(),
+        "session_id": df["session_id"].tolist(),
+    }
+
+
+class VerificationClient:
+    """
+    A minimal asyncio client of the verification service, over TCP or a Unix socket.
+
+    Every request opens its own connection, so one client can issue many concurrent requests,
+    which the service then batches together.
+
+    Usage:
+    >>> client = VerificationClient(port=8765)
+    >>> result = await client.verify(3, keystrokes_from_df(df))
+    >>> result["designation"]
+    'Genuine'
+    """
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, unix_path=None):
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+
+    async def _request(self, method, path, payload=None):
+        if self.unix_path is not None:
+            reader, writer = await asyncio.open_unix_connection(self.unix_path)
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            body = b"" if payload is None else json.dumps(payload).encode()
+            writer.write(
+                (
+                    f"{method} {path} HTTP/1.1\r\n"
+                    f"Host: {self.host}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "Connection: close\r\n"
+                    "\r\n"
+                ).encode("latin-1")
+                + body
+            )
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            content = await reader.readexactly(int(headers.get("content-length", 0)))
+            return status, json.loads(content)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    async def verify(self, enrollment_id, keystrokes):
+        """
+        Verify probe keystrokes against an enrolled user.
+
+        Returns:
+        - dict: The per verifier scores and verdicts and the fused "designation".
+
+        Raises:
+        - RuntimeError: If the service rejects the request.
+        """
+        status, response = await self._request(
+            "POST",
+            "/verify",
+            {"enrollment_id": enrollment_id, "keystrokes": keystrokes},
+        )
+        if status != 200:
+            raise RuntimeError(f"Verification failed ({status}): {response['error']}")
+        return response
+
+    async def stats(self):
+        """
+        Returns:
+        - dict: The latency and throughput counters of the service.
+        """
+        return (await self._request("GET", "/stats"))[1]
+
+    async def health(self):
+        return (await self._request("GET", "/health"))[1]
+
+
+async def _verify_against_everyone(client, probe_id, ids, keystrokes):
+    results = await asyncio.gather(
+        *[client.verify(enrollment_id, keystrokes) for enrollment_id in ids]
+    )
+    for enrollment_id, result in zip(ids, results):
+        print(
+            f"probe {probe_id} vs enrollment {enrollment_id}: {result['designation']} "
+            f"{result['scores']}"
+        )
+    print(json.dumps(await client.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    from classifiers.template_generator import (
+        all_ids,
+        dataset_path,
+        read_compact_format_file,
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Verify a user's probe against every enrolled user concurrently"
+    )
+    parser.add_argument("probe_id", type=int)
+    parser.add_argument("--platform", type=int, default=2)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix-socket")
+    args = parser.parse_args()
+    # The raw rows, which the service cleans (and compacts) like the enrollments
+    df = read_compact_format_file(dataset_path())
+    probe_keystrokes = keystrokes_from_df(
+        df[(df["user_ids"] == args.probe_id) & (df["platform_id"] == args.platform)]
+    )
+    asyncio.run(
+        _verify_against_everyone(
+            VerificationClient(args.host, args.port, args.unix_socket),
+            args.probe_id,
+            all_ids(),
+            probe_keystrokes,
+        )
+    )
@@ -0,0 +1,594 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict, deque
+import numpy as np
+import pandas as pd
+from classifiers.prepared_templates import FeatureVocabulary, PreparedTemplate
+from classifiers.session_templates import session_templates
+from classifiers.template_generator import all_ids, dataset_path
+from classifiers.template_snapshot import TemplateSnapshot
+from classifiers.template_store import family_for_kit
+from classifiers.verifier_registry import (
+    DEFAULT_THRESHOLDS,
+    ProbeSet,
+    VerifierType,
+    get_verifier,
+    required_statistics,
+)
+from features.compact_timings import compact_timing_unit, to_session_offsets
+from features.keystroke_features import (
+    group_samples_by_feature,
+    kht_samples,
+    kit_samples,
+    timing_array,
+)
+from features.preprocessing import clean_keystrokes, normalize_keys
+from fusion.decsion_fusion import (
+    DEFAULT_NORMALIZED_THRESHOLD,
+    is_fake_profile,
+    normalized_verdict,
+    verdict,
+)
+from fusion.score_normalization import NormalizationType
+from performance_evaluation.instrumentation import configure_from_config
+
+logger = logging.getLogger(__name__)
+
+# The verifiers whose verdicts are fused into the designation of a probe
+SERVICE_VERIFIERS = [VerifierType.ABSOLUTE, VerifierType.SIMILARITY, VerifierType.ITAD]
+DEFAULT_PORT = 8765
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+
+def keystrokes_to_template(keystrokes, kit_feature_type=1, config=None):
+    """
+    Build the combined KHT and KIT template of a probe from its raw keystrokes like the heatmap
+    builders do from the compact format. The keystrokes are cleaned first, the same way the
+    dataset is at load time (see `clean_keystrokes`), so that the key labels, the order of the
+    keystrokes and the clipped holds and flights line up with those of the enrollments, and KIT
+    digraphs are extracted per session so they never span two sessions.
+
+    The times are always sent in nanoseconds, like the dataset records them. When a
+    "compact_timing_unit" is configured, they are turned into int32 offsets from the start of
+    their session (see `to_session_offsets`) before the holds and flights are extracted, exactly
+    like the times of the enrollments, so both round to the same ticks.
+
+    Parameters:
+    - keystrokes (dict): The aligned lists "key", "press_time" and "release_time" (in
+      nanoseconds), in typing order, and optionally "session_id". Without it the probe is
+      taken as a single session.
+    - kit_feature_type (int): The KIT flight (1-4) to extract.
+    - config (dict, optional): The classifier configuration with the cleaning settings.
+
+    Returns:
+    - dict: A defaultdict(list) mapping every feature to its timings.
+
+    Raises:
+    - ValueError: If a list is missing or the lists are not aligned.
+    - OverflowError: If a session lasts too long for the configured compact timings.
+    """
+    try:
+        columns = {
+            "key": np.asarray(keystrokes["key"], dtype=object),
+            "press_time": np.asarray(keystrokes["press_time"], dtype=np.float64),
+            "release_time": np.asarray(keystrokes["release_time"], dtype=np.float64),
+        }
+        columns["session_id"] = np.asarray(
+            keystrokes.get("session_id", np.zeros(len(columns["key"]))), dtype=np.int64
+        )
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise ValueError(f"Malformed keystrokes: {e}") from None
+    if len({len(column) for column in columns.values()}) != 1:
+        raise ValueError(
+            "key, press_time, release_time and session_id must have the same length"
+        )
+    probe = pd.DataFrame(columns)
+    # The sessions of a probe all belong to the one user and platform it was typed on
+    probe["user_ids"] = 0
+    probe["platform_id"] = 0
+    config = config or {}
+    if config.get("clean_keystrokes") is False:
+        probe["key"] = normalize_keys(probe["key"])
+    else:
+        probe, _ = clean_keystrokes(probe, config)
+    unit = compact_timing_unit(config)
+    if unit:
+        probe = to_session_offsets(probe, unit)
+    keys = probe["key"].to_numpy(dtype=object)
+    press_times = timing_array(probe["press_time"])
+    release_times = timing_array(probe["release_time"])
+    sessions = list(probe.groupby("session_id", sort=False).indices.values())
+    template = defaultdict(list)
+    for extract in (
+        kht_samples,
+        lambda *arrays: kit_samples(*arrays, kit_feature_type),
+    ):
+        samples = [
+            extract(keys[rows], press_times[rows], release_times[rows])
+            for rows in sessions
+        ]
+        if not samples:
+            continue
+        names = np.concatenate([names for names, _ in samples])
+        values = np.concatenate([values for _, values in samples])
+        template |= group_samples_by_feature(
+            names, values.astype(press_times.dtype, copy=False)
+        )
+    return template
+
+
+class ServiceMetrics:
+    """
+    Latency and throughput counters of the verification service.
+
+    Latencies are kept for the most recent `window` requests, from which the percentiles are computed.
+    """
+
+    def __init__(self, window=10_000):
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.max_batch_size = 0
+        self.scoring_seconds = 0.0
+        self.latencies = deque(maxlen=window)
+
+    def record_request(self, latency):
+        self.requests += 1
+        self.latencies.append(latency)
+
+    def record_error(self):
+        self.errors += 1
+
+    def record_batch(self, size, scoring_seconds):
+        self.batches += 1
+        self.batched_requests += size
+        self.max_batch_size = max(self.max_batch_size, size)
+        self.scoring_seconds += scoring_seconds
+
+    def as_dict(self):
+        """
+        Returns:
+        - dict: The counters, with latencies in milliseconds and the throughput in requests per second.
+        """
+        uptime = time.perf_counter() - self.started
+        latencies = np.array(self.latencies) * 1000
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).tolist()
+            latency = {
+                "mean": float(latencies.mean()),
+                "p50": p50,
+                "p95": p95,
+                "p99": p99,
+                "max": float(latencies.max()),
+            }
+        else:
+            latency = {}
+        return {
+            "uptime_s": uptime,
+            "requests": self.requests,
+            "errors": self.errors,
+            "throughput_rps": self.requests / uptime if uptime > 0 else 0.0,
+            "batches": self.batches,
+            "mean_batch_size": (
+                self.batched_requests / self.batches if self.batches else 0.0
+            ),
+            "max_batch_size": self.max_batch_size,
+            "mean_scoring_ms": (
+                1000 * self.scoring_seconds / self.batches if self.batches else 0.0
+            ),
+            "latency_ms": latency,
+        }
+
+
+class VerificationService:
+    """
+    Verifies probe keystrokes against enrollment templates loaded at startup.
+
+    Requests arriving within `batch_window` seconds of each other (up to `max_batch_size` of them)
+    are scored together: their probes are prepared as one batch and every enrollment they refer
+    to is scored against the whole batch with the batched Absolute, Similarity and ITAD kernels,
+    whose verdicts are then fused by majority like `fusion.decsion_fusion`. Scoring runs in a
+    worker thread, so the event loop keeps accepting requests meanwhile.
+
+    Usage:
+    >>> service = VerificationService.from_dataset(platform_id=1)
+    >>> asyncio.run(service.serve(port=8765))
+    """
+
+    def __init__(
+        self,
+        enrollments,
+        config,
+        kit_feature_type=1,
+        batch_window=0.005,
+        max_batch_size=64,
+        thresholds=DEFAULT_THRESHOLDS,
+        vocabulary=None,
+        normalization=None,
+        normalized_threshold=DEFAULT_NORMALIZED_THRESHOLD,
+    ):
+        """
+        Parameters:
+        - enrollments (dict[int, dict or PreparedTemplate]): The enrollment template of every
+          user id, either as extracted or already prepared with `vocabulary`.
+        - config (dict): The classifier configuration.
+        - kit_feature_type (int): The KIT flight the enrollment templates were built with.
+        - batch_window (float): How long, in seconds, a batch waits for more requests.
+        - max_batch_size (int): The largest number of requests scored together.
+        - thresholds (tuple[int, int]): The feature selection thresholds of the enrollment and the probe.
+        - vocabulary (FeatureVocabulary, optional): The vocabulary of prepared enrollments.
+        - normalization (dict[VerifierType, CohortStatistics], optional): Z-norm statistics of
+          the enrollments (see `fusion.score_normalization`). When given, the scores are also
+          reported normalized and the verdicts are taken on the normalized scores.
+        - normalized_threshold (float): The verdict threshold of normalized scores.
+
+        Raises:
+        - ValueError: If the normalization statistics are not Z-norm statistics, or do not cover
+          every enrollment and verifier.
+        """
+        self.config = config
+        self.kit_feature_type = kit_feature_type
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.thresholds = thresholds
+        self.verifiers = [
+            get_verifier(verifier_type) for verifier_type in SERVICE_VERIFIERS
+        ]
+        required = required_statistics(self.verifiers)
+        self.vocabulary = FeatureVocabulary() if vocabulary is None else vocabulary
+        self.enrollments = {}
+        for user_id, template in enrollments.items():
+            if not isinstance(template, PreparedTemplate):
+                template = PreparedTemplate.from_pattern(
+                    template, self.vocabulary, True, config
+                )
+            template.prepare(required)
+            self.enrollments[user_id] = template
+        self.normalization = normalization
+        self.normalized_threshold = normalized_threshold
+        if normalization is not None:
+            for verifier_type, statistics in normalization.items():
+                # T-norm statistics are keyed by probe ids, so they cannot be applied by
+                # enrollment id
+                if statistics.normalization != NormalizationType.ZNORM:
+                    raise ValueError(
+                        f"The {verifier_type.name.lower()} normalization statistics are "
+                        f"{statistics.normalization.name}, the service needs ZNORM ones"
+                    )
+            for verifier_type in SERVICE_VERIFIERS:
+                if verifier_type not in normalization or not set(
+                    self.enrollments
+                ).issubset(normalization[verifier_type].ids):
+                    raise ValueError(
+                        f"The {verifier_type.name.lower()} normalization statistics do not "
+                        "cover every enrollment"
+                    )
+        self.metrics = ServiceMetrics()
+        self._queue = None
+
+    @classmethod
+    def from_dataset(
+        cls, platform_id, session_id=None, kit_feature_type=1, ids=None, **kwargs
+    ):
+        """
+        Load the combined KHT and KIT enrollment templates of the configured dataset.
+
+        Parameters:
+        - platform_id, session_id: The enrollment selector, with the semantics of `get_user_by_platform`.
+        - kit_feature_type (int): The KIT flight (1-4) to extract.
+        - ids (list[int], optional): The users to enroll, defaults to every user of the dataset.
+        - **kwargs: Passed on to the constructor.
+
+        Returns:
+        - VerificationService: The service.
+        """
+        with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
+            config = json.load(f)
+        configure_from_config(config)
+        families = ["kht", family_for_kit(kit_feature_type)]
+        sessions = session_templates()
+        enrollments = {
+            user_id: sessions.template(user_id, platform_id, session_id, families)
+            for user_id in (all_ids() if ids is None else ids)
+        }
+        logger.info("loaded %d enrollment templates", len(enrollments))
+        return cls(enrollments, config, kit_feature_type=kit_feature_type, **kwargs)
+
+    @classmethod
+    def from_snapshot(cls, path, **kwargs):
+        """
+        Load the enrollment templates from a snapshot written by `classifiers/template_snapshot.py`,
+        without reading the dataset.
+
+        Parameters:
+        - path (str): The snapshot file.
+        - **kwargs: Passed on to the constructor.
+
+        Returns:
+        - VerificationService: The service.
+
+        Raises:
+        - ValueError: If the snapshot is out of date with the dataset or the configuration.
+        """
+        with open(os.path.join(os.getcwd(), "classifier_config.json"), "r") as f:
+            config = json.load(f)
+        configure_from_config(config)
+        snapshot = TemplateSnapshot.load(path, config, dataset_path())
+        logger.info("mapped %d enrollment templates from %s", len(snapshot), path)
+        return cls(
+            snapshot.templates(),
+            config,
+            kit_feature_type=snapshot.selector.get("kit_feature_type", 1),
+            vocabulary=snapshot.vocabulary(),
+            **kwargs,
+        )
+
+    async def verify(self, enrollment_id, keystrokes):
+        """
+        Verify a probe against an enrollment, batched with any concurrent requests.
+
+        Parameters:
+        - enrollment_id (int): The enrolled user the probe claims to be.
+        - keystrokes (dict): The raw probe keystrokes, see `keystrokes_to_template`.
+
+        Returns:
+        - dict: The score and verdict of every verifier and the fused "designation", "Genuine" or "Fake".
+
+        Raises:
+        - KeyError: If the enrollment id is unknown.
+        - ValueError: If the keystrokes are malformed.
+        - OverflowError: If the probe is too long for the configured compact timings.
+        """
+        if enrollment_id not in self.enrollments:
+            raise KeyError(f"Unknown enrollment id {enrollment_id}")
+        template = keystrokes_to_template(
+            keystrokes, self.kit_feature_type, self.config
+        )
+        if self._queue is None:
+            self._start_batcher()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((enrollment_id, template, future))
+        return await future
+
+    def _start_batcher(self):
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.get_running_loop().create_task(self._run_batcher())
+
+    async def _run_batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            started = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(None, self._score_batch, batch)
+            except Exception as e:
+                logger.exception("scoring a batch of %d requests failed", len(batch))
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.metrics.record_batch(len(batch), time.perf_counter() - started)
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _score_batch(self, batch):
+        """Score a batch of (enrollment id, probe template, future) requests at once"""
+        probe_set = ProbeSet(
+            self.verifiers,
+            [template for _, template, _ in batch],
+            self.config,
+            self.thresholds,
+            vocabulary=self.vocabulary,
+        )
+        columns = {}
+        for column, (enrollment_id, _, _) in enumerate(batch):
+            columns.setdefault(enrollment_id, []).append(column)
+        results = [None] * len(batch)
+        for enrollment_id, enrollment_columns in columns.items():
+            scores = probe_set.score(self.enrollments[enrollment_id])
+            for column in enrollment_columns:
+                results[column] = self._result(enrollment_id, scores[:, column])
+        return results
+
+    def _result(self, enrollment_id, scores):
+        result = {"scores": {}, "verdicts": {}}
+        if self.normalization is not None:
+            result["normalized_scores"] = {}
+        verdicts = []
+        for verifier_type, score in zip(SERVICE_VERIFIERS, scores.tolist()):
+            result["scores"][verifier_type.name.lower()] = score
+            if self.normalization is None:
+                is_fake = verdict(score, verifier_type)
+            else:
+                normalized = self.normalization[verifier_type].normalize_scores(
+                    enrollment_id, score
+                )
+                result["normalized_scores"][verifier_type.name.lower()] = normalized
+                is_fake = normalized_verdict(normalized, self.normalized_threshold)
+            result["verdicts"][verifier_type.name.lower()] = (
+                "Fake" if is_fake else "Genuine"
+            )
+            verdicts.append(is_fake)
+        result["designation"] = is_fake_profile(verdicts)
+        return result
+
+    async def _handle(self, method, path, body):
+        """Route one HTTP request, returning the status and the JSON response"""
+        if path == "/health":
+            return 200, {"status": "ok", "enrollments": len(self.enrollments)}
+        if path == "/stats":
+            return 200, self.metrics.as_dict()
+        if path != "/verify":
+            return 404, {"error": f"Unknown path {path}"}
+        if method != "POST":
+            return 405, {"error": "/verify only accepts POST"}
+        started = time.perf_counter()
+        try:
+            payload = json.loads(body)
+            enrollment_id = payload["enrollment_id"]
+            keystrokes = payload["keystrokes"]
+            # Enrollments are keyed by integer user ids, and a list or object id is not even
+            # hashable
+            if isinstance(enrollment_id, bool) or not isinstance(enrollment_id, int):
+                raise TypeError(
+                    f"enrollment_id must be an integer, got {enrollment_id!r}"
+                )
+        except (ValueError, KeyError, TypeError) as e:
+            self.metrics.record_error()
+            return 400, {"error": f"Malformed request: {e}"}
+        if enrollment_id not in self.enrollments:
+            self.metrics.record_error()
+            return 404, {"error": f"Unknown enrollment id {enrollment_id}"}
+        try:
+            result = await self.verify(enrollment_id, keystrokes)
+        except (ValueError, OverflowError) as e:
+            self.metrics.record_error()
+            return 400, {"error": str(e)}
+        except Exception as e:
+            self.metrics.record_error()
+            return 500, {"error": str(e)}
+        latency = time.perf_counter() - started
+        self.metrics.record_request(latency)
+        return 200, {
+            "enrollment_id": enrollment_id,
+            **result,
+            "latency_ms": 1000 * latency,
+        }
+
+    async def _handle_connection(self, reader, writer):
+        """Serve the HTTP/1.1 requests of one connection, keeping it alive until the client closes it"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, _ = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    length = int(headers.get("content-length", 0))
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    # The body cannot be delimited, so the connection cannot carry another request
+                    status, response = 400, {"error": "Invalid Content-Length"}
+                    keep_alive = False
+                    self.metrics.record_error()
+                else:
+                    body = await reader.readexactly(length)
+                    status, response = await self._handle(method, path, body)
+                content = json.dumps(response).encode()
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                        "Content-Type: application/json\r\n"
+                        f"Content-Length: {len(content)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                        "\r\n"
+                    ).encode("latin-1")
+                    + content
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=DEFAULT_PORT, unix_path=None):
+        """
+        Start listening on a TCP port, or on a Unix socket if `unix_path` is given.
+
+        Returns:
+        - asyncio.Server: The listening server.
+        """
+        if self._queue is None:
+            self._start_batcher()
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self._handle_connection, unix_path)
+            logger.info("verification service listening on %s", unix_path)
+        else:
+            server = await asyncio.start_server(self._handle_connection, host, port)
+            logger.info("verification service listening on %s:%d", host, port)
+        return server
+
+    async def serve(self, host="127.0.0.1", port=DEFAULT_PORT, unix_path=None):
+        """Start the server and serve until cancelled"""
+        server = await self.start(host, port, unix_path)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve keystroke verification of probes against enrolled users"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix-socket", help="Listen on this Unix socket instead")
+    parser.add_argument("--platform", type=int, default=1)
+    parser.add_argument("--session", type=int)
+    parser.add_argument("--kit-feature-type", type=int, default=1)
+    parser.add_argument("--batch-window-ms", type=float, default=5.0)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument(
+        "--snapshot", help="Load the enrollments from this template snapshot instead"
+    )
+    parser.add_argument(
+        "--normalization",
+        help="Z-norm statistics written by fusion/score_normalization.py to decide on",
+    )
+    args = parser.parse_args()
+    options = {
+        "batch_window": args.batch_window_ms / 1000,
+        "max_batch_size": args.max_batch_size,
+    }
+    if args.normalization is not None:
+        from fusion.score_normalization import load_statistics
+
+        options["normalization"] = load_statistics(args.normalization)
+    if args.snapshot is not None:
+        verification_service = VerificationService.from_snapshot(
+            args.snapshot, **options
+        )
+    else:
+        verification_service = VerificationService.from_dataset(
+            args.platform,
+            args.session,
+            kit_feature_type=args.kit_feature_type,
+            **options,
+        )
+    asyncio.run(verification_service.serve(args.host, args.port, args.unix_socket))